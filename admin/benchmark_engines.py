@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+"""Compare the run time of the gcov engines on a generated project.
+
+The project has --files source files with --functions functions each,
+full of branches and loops.  It is compiled with coverage, run once,
+and then gcovr is run --repeat times with every engine.
+The reports of all engines must be the same.
+
+Usage: python admin/benchmark_engines.py [--files N] [--functions N] [-j N]
+       [--parallel-mode MODE] [--engines ENGINE...]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FUNCTION = """
+int f{file}_{function}(int x)
+{{
+    int sum = 0;
+    for (int i = 0; i < x % 7; ++i) sum += i;
+    if (x > {function} && x % 3)
+        sum += x;
+    else
+        sum -= x;
+    switch (x % 4) {{
+    case 0: sum *= 2; break;
+    case 1: sum += 3; break;
+    default: break;
+    }}
+    return sum;
+}}
+"""
+
+
+def generate_project(directory, files, functions):
+    sources = []
+    calls = []
+    for file_ in range(files):
+        source = os.path.join(directory, 'file{0}.cpp'.format(file_))
+        with open(source, 'w') as stream:
+            for function in range(functions):
+                stream.write(FUNCTION.format(file=file_, function=function))
+                calls.append('f{0}_{1}'.format(file_, function))
+        sources.append(source)
+
+    main = os.path.join(directory, 'main.cpp')
+    with open(main, 'w') as stream:
+        for call in calls:
+            stream.write('int {0}(int x);\n'.format(call))
+        stream.write('int main(int argc, char**)\n{\n    int sum = 0;\n')
+        for i, call in enumerate(calls):
+            # Leave some functions unexecuted
+            if i % 5:
+                stream.write('    sum += {0}(argc + {1});\n'.format(call, i))
+        stream.write('    return sum == 42;\n}\n')
+    sources.append(main)
+
+    cxx = os.environ.get('CXX', 'g++')
+    objects = []
+    for source in sources:
+        obj = os.path.splitext(source)[0] + '.o'
+        subprocess.check_call(
+            [cxx, '-fprofile-arcs', '-ftest-coverage', '-c', source,
+             '-o', obj], cwd=directory)
+        objects.append(obj)
+    subprocess.check_call(
+        [cxx, '-fprofile-arcs', '-ftest-coverage'] + objects +
+        ['-o', 'testcase'], cwd=directory)
+    subprocess.check_call([os.path.join(directory, 'testcase')], cwd=directory)
+
+
+def run_gcovr(directory, engine, options):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT
+    return subprocess.check_output(
+        [sys.executable, '-m', 'gcovr', '-r', directory, '-b',
+         '--gcov-engine', engine, '-j', str(options.jobs),
+         '--parallel-mode', options.parallel_mode],
+        cwd=directory, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--functions', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-j', type=int, default=1, dest='jobs')
+    parser.add_argument(
+        '--parallel-mode', choices=['auto', 'threads', 'processes'],
+        default='auto')
+    parser.add_argument(
+        '--engines', nargs='+', default=['text', 'json', 'python'])
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='gcovr-benchmark-')
+    try:
+        generate_project(directory, options.files, options.functions)
+        print("{0} files with {1} functions each, -j {2} ({3})".format(
+            options.files + 1, options.functions, options.jobs,
+            options.parallel_mode))
+
+        reports = dict()
+        for engine in options.engines:
+            reports[engine] = run_gcovr(directory, engine, options)
+            seconds = min(timeit.repeat(
+                lambda: run_gcovr(directory, engine, options),
+                number=1, repeat=options.repeat))
+            print("{0:>8}: {1:.3f}s".format(engine, seconds))
+
+        first = options.engines[0]
+        for engine in options.engines[1:]:
+            if reports[engine] != reports[first]:
+                print("The reports of {0} and {1} differ!".format(
+                    first, engine))
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+"""Measure the throughput of the gcov text parser in lines per second.
+
+A gcov report with --functions functions is generated in memory,
+with counts, uncovered and non-code lines, branches, calls,
+comments and template specialization sections, as written by
+"gcov --branch-counts --branch-probabilities".
+It is parsed --repeat times, and the best time is reported.
+With --binary, the report is parsed from bytes, like gcov files.
+
+Usage: python admin/benchmark_gcov_parser.py [--functions N] [--repeat N]
+       [--exclude-unreachable-branches] [--binary]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcovr.gcov import GcovParser  # noqa: E402
+from gcovr.utils import Logger  # noqa: E402
+
+# The documented target of GcovParser, on one core of a current machine
+TARGET_LINES_PER_SECOND = 1000000
+
+FUNCTION = """\
+        -:{l[0]:>5}:// Computes the {n}th value
+{c:>9}:{l[1]:>5}:int f{n}(int x)
+        -:{l[2]:>5}:{{
+function f{n}(int) called {c} returned 100% blocks executed 80%
+{c:>9}:{l[3]:>5}:    int sum = 0;  /* accumulator */
+{loop:>9}:{l[4]:>5}:    for (int i = 0; i < x; ++i)
+branch  0 taken {loop}
+branch  1 taken {c} (fallthrough)
+{loop:>9}:{l[5]:>5}:        sum += g(i);
+call    0 returned {loop}
+    #####:{l[6]:>5}:    if (x < 0)
+branch  0 never executed
+branch  1 never executed
+    =====:{l[7]:>5}:        throw x;
+{c:>9}:{l[8]:>5}:    return sum;
+{c:>9}:{l[9]:>5}:}}
+branch  0 taken {c}
+branch  1 taken 0
+------------------
+f{n}<int>:
+function f{n}<int> called {c} returned 100% blocks executed 100%
+{c:>9}:{l[9]:>5}:}}
+------------------
+        -:{l[10]:>5}:
+"""
+
+
+def generate_report(functions):
+    lines = [
+        "        -:    0:Source:benchmark.cpp\n",
+        "        -:    0:Graph:benchmark.gcno\n",
+        "        -:    0:Data:benchmark.gcda\n",
+        "        -:    0:Runs:1\n",
+    ]
+    for function in range(functions):
+        first = function * 11 + 1
+        lines.extend(FUNCTION.format(
+            n=function, c=function % 5 + 1, loop=function % 5 * 4,
+            l=range(first, first + 11)).splitlines(True))
+    return lines
+
+
+def parse(lines, exclude_unreachable_branches, binary=False):
+    parser = GcovParser("benchmark.cpp", Logger())
+    parser.parse_all_lines(
+        lines,
+        exclude_unreachable_branches=exclude_unreachable_branches,
+        ignore_parse_errors=False,
+        binary=binary)
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--functions', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--exclude-unreachable-branches', action='store_true')
+    parser.add_argument('--binary', action='store_true')
+    options = parser.parse_args()
+
+    lines = generate_report(options.functions)
+    if options.binary:
+        lines = [line.encode('utf-8') for line in lines]
+    seconds = min(timeit.repeat(
+        lambda: parse(
+            lines, options.exclude_unreachable_branches, options.binary),
+        number=1, repeat=options.repeat))
+    rate = len(lines) / seconds
+    print("{0} lines in {1:.3f}s: {2:.0f} lines/s (target: {3} lines/s)".format(
+        len(lines), seconds, rate, TARGET_LINES_PER_SECOND))
+    return 0 if rate >= TARGET_LINES_PER_SECOND else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+"""Compare the batched rows of an --html-details page with the old rows.
+
+A source file of --lines lines is generated in memory,
+with coverage data for three quarters of them
+(a third of those with branches).  The rows of its page are rendered
+--repeat times, once with source_rows() and once with a string.Template
+per line as before, and the best times are reported.
+The rows must be the same.
+
+Usage: python admin/benchmark_html_rows.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from string import Template
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcovr.coverage import CoverageData, COVERED, UNCOVERED  # noqa: E402
+from gcovr.html_generator import html_escape, source_rows  # noqa: E402
+
+
+def generate_source(lines):
+    source = []
+    covered = dict()
+    uncovered = set()
+    branches = dict()
+    for line in range(1, lines + 1):
+        source.append('    value = compute(value, {0}) & mask;  // <{0}>\n'.format(line))
+        if line % 4 == 0:
+            continue
+        if line % 5:
+            covered[line] = line % 7 + 1
+        else:
+            uncovered.add(line)
+        if line % 3 == 0:
+            branches[line] = dict((b, (line + b) % 3) for b in range(line % 6 + 1))
+    coverage = CoverageData('/project/src/file.cpp')
+    coverage.update(
+        uncovered=uncovered, uncovered_exceptional=set(),
+        covered=covered, branches=branches, noncode=set())
+    return source, coverage
+
+
+def template_row(lineno, source, record):
+    rowstr = Template('''
+    <tr>
+    <td align="right" class="lineno"><pre>${lineno}</pre></td>
+    <td align="right" class="linebranch">${linebranch}</td>
+    <td align="right" class="linecount ${covclass}"><pre>${linecount}</pre></td>
+    <td align="left" class="src ${covclass}"><pre>${source}</pre></td>
+    </tr>''')
+    kwargs = {}
+    kwargs['lineno'] = str(lineno)
+    _, state, count, branches = record or (lineno, 0, 0, None)
+    if state & COVERED:
+        kwargs['covclass'] = 'coveredLine'
+        kwargs['linebranch'] = ''
+        if branches is not None:
+            branchcounter = 0
+            for branch, branch_count in branches:
+                if branch_count > 0:
+                    kwargs['linebranch'] += '<span class="takenBranch" title="Branch ' + str(branch) + ' taken ' + str(branch_count) + ' times">&check;</span>'
+                else:
+                    kwargs['linebranch'] += '<span class="notTakenBranch" title="Branch ' + str(branch) + ' not taken">&cross;</span>'
+                branchcounter += 1
+                if (branchcounter > 0) and ((branchcounter % 4) == 0):
+                    kwargs['linebranch'] += '<br/>'
+        kwargs['linecount'] = str(count)
+    elif state & UNCOVERED:
+        kwargs['covclass'] = 'uncoveredLine'
+        kwargs['linebranch'] = ''
+        kwargs['linecount'] = ''
+    else:
+        kwargs['covclass'] = ''
+        kwargs['linebranch'] = ''
+        kwargs['linecount'] = ''
+    kwargs['source'] = html_escape(source)
+    return rowstr.substitute(**kwargs)
+
+
+def template_rows(source_lines, cdata):
+    """The rows as the page rendered them before source_rows()"""
+    rows = []
+    records = cdata.line_records()
+    record = next(records, None)
+    ctr = 1
+    for line in source_lines:
+        while record is not None and record[0] < ctr:
+            record = next(records, None)
+        rows.append(template_row(
+            ctr, line.rstrip(),
+            record if record is not None and record[0] == ctr else None))
+        ctr += 1
+    return '\n'.join(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    source, coverage = generate_source(args.lines)
+    print("{0} source lines".format(args.lines))
+    outputs = []
+    for name, render in [('batched', source_rows), ('template', template_rows)]:
+        outputs.append(render(source, coverage))
+        seconds = min(timeit.repeat(
+            lambda: render(source, coverage), number=1, repeat=args.repeat))
+        print("{0:>10}: {1:.3f}s".format(name, seconds))
+    if outputs[0] != outputs[1]:
+        print("The rows differ!")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
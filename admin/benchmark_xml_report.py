@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+"""Compare the streaming XML report with the minidom report it replaced.
+
+Coverage data of --files files with --lines executable lines each
+(a third of them with branches) is generated in memory.
+Both reports are written --repeat times to a temporary file,
+and the best time is reported, with the peak memory of the first run
+on Python 3.  The reports must be the same.
+
+Usage: python admin/benchmark_xml_report.py [--files N] [--lines N]
+       [--repeat N] [--pretty] [--streaming-only]
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import timeit
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcovr.cobertura_xml_generator import write_xml_report  # noqa: E402
+from gcovr.coverage import CoverageData  # noqa: E402
+from gcovr.utils import get_global_stats  # noqa: E402
+from gcovr.version import __version__  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+def generate_covdata(files, lines):
+    covdata = dict()
+    for file_ in range(files):
+        fname = '/project/src/dir{0}/file{1}.cpp'.format(file_ % 10, file_)
+        covered = dict()
+        uncovered = set()
+        branches = dict()
+        for line in range(1, lines + 1):
+            if line % 4:
+                covered[line] = line % 7 + 1
+            else:
+                uncovered.add(line)
+            if line % 3 == 0:
+                branches[line] = {0: line % 2, 1: 1}
+        coverage = CoverageData(fname)
+        coverage.update(
+            uncovered=uncovered, uncovered_exceptional=set(),
+            covered=covered, branches=branches, noncode=set())
+        covdata[fname] = coverage
+    return covdata
+
+
+def print_minidom_report(covdata, options):
+    """The minidom generator that write_xml_report replaced."""
+    (lineTotal, lineCovered, _,
+        branchTotal, branchCovered, _) = get_global_stats(covdata)
+
+    impl = xml.dom.minidom.getDOMImplementation()
+    docType = impl.createDocumentType(
+        "coverage", None,
+        "http://cobertura.sourceforge.net/xml/coverage-04.dtd"
+    )
+    doc = impl.createDocument(None, "coverage", docType)
+    root = doc.documentElement
+    root.setAttribute(
+        "line-rate", lineTotal == 0 and '0.0' or
+        str(float(lineCovered) / lineTotal)
+    )
+    root.setAttribute(
+        "branch-rate", branchTotal == 0 and '0.0' or
+        str(float(branchCovered) / branchTotal)
+    )
+    root.setAttribute(
+        "lines-covered", str(lineCovered)
+    )
+    root.setAttribute(
+        "lines-valid", str(lineTotal)
+    )
+    root.setAttribute(
+        "branches-covered", str(branchCovered)
+    )
+    root.setAttribute(
+        "branches-valid", str(branchTotal)
+    )
+    root.setAttribute(
+        "complexity", "0.0"
+    )
+    root.setAttribute(
+        "timestamp", str(int(time.time()))
+    )
+    root.setAttribute(
+        "version", "gcovr %s" % (__version__,)
+    )
+
+    # Generate the <sources> element: this is either the root directory
+    # (specified by --root), or the CWD.
+    sources = doc.createElement("sources")
+    root.appendChild(sources)
+
+    # Generate the coverage output (on a per-package basis)
+    packageXml = doc.createElement("packages")
+    root.appendChild(packageXml)
+    packages = {}
+    source_dirs = set()
+
+    keys = list(covdata.keys())
+    keys.sort()
+    for f in keys:
+        data = covdata[f]
+        directory = options.root_filter.sub('', f)
+        if f.endswith(directory):
+            src_path = f[:-1 * len(directory)]
+            if len(src_path) > 0:
+                while directory.startswith(os.path.sep):
+                    src_path += os.path.sep
+                    directory = directory[len(os.path.sep):]
+                source_dirs.add(src_path)
+        else:
+            # Do no truncation if the filter does not start matching at
+            # the beginning of the string
+            directory = f
+        directory, fname = os.path.split(directory)
+
+        package = packages.setdefault(
+            directory, [doc.createElement("package"), {}, 0, 0, 0, 0]
+        )
+        c = doc.createElement("class")
+        # The Cobertura DTD requires a methods section, which isn't
+        # trivial to get from gcov (so we will leave it blank)
+        c.appendChild(doc.createElement("methods"))
+        lines = doc.createElement("lines")
+        c.appendChild(lines)
+
+        class_lines = 0
+        class_hits = 0
+        class_branches = 0
+        class_branch_hits = 0
+        for line, state, hits, branches in data.line_records():
+            class_lines += 1
+            if hits > 0:
+                class_hits += 1
+            L = doc.createElement("line")
+            L.setAttribute("number", str(line))
+            L.setAttribute("hits", str(hits))
+            if branches is None:
+                L.setAttribute("branch", "false")
+            else:
+                b_hits = 0
+                for _, v in branches:
+                    if v > 0:
+                        b_hits += 1
+                coverage = 100 * b_hits / len(branches)
+                L.setAttribute("branch", "true")
+                L.setAttribute(
+                    "condition-coverage",
+                    "%i%% (%i/%i)" % (coverage, b_hits, len(branches))
+                )
+                cond = doc.createElement('condition')
+                cond.setAttribute("number", "0")
+                cond.setAttribute("type", "jump")
+                cond.setAttribute("coverage", "%i%%" % (coverage))
+                class_branch_hits += b_hits
+                class_branches += float(len(branches))
+                conditions = doc.createElement("conditions")
+                conditions.appendChild(cond)
+                L.appendChild(conditions)
+
+            lines.appendChild(L)
+
+        className = fname.replace('.', '_')
+        c.setAttribute("name", className)
+        c.setAttribute("filename", os.path.join(directory, fname).replace('\\', '/'))
+        c.setAttribute(
+            "line-rate",
+            str(class_hits / (1.0 * class_lines or 1.0))
+        )
+        c.setAttribute(
+            "branch-rate",
+            str(class_branch_hits / (1.0 * class_branches or 1.0))
+        )
+        c.setAttribute("complexity", "0.0")
+
+        package[1][className] = c
+        package[2] += class_hits
+        package[3] += class_lines
+        package[4] += class_branch_hits
+        package[5] += class_branches
+
+    keys = list(packages.keys())
+    keys.sort()
+    for packageName in keys:
+        packageData = packages[packageName]
+        package = packageData[0]
+        packageXml.appendChild(package)
+        classes = doc.createElement("classes")
+        package.appendChild(classes)
+        classNames = list(packageData[1].keys())
+        classNames.sort()
+        for className in classNames:
+            classes.appendChild(packageData[1][className])
+        package.setAttribute("name", packageName.replace(os.sep, '.'))
+        package.setAttribute(
+            "line-rate", str(packageData[2] / (1.0 * packageData[3] or 1.0))
+        )
+        package.setAttribute(
+            "branch-rate", str(packageData[4] / (1.0 * packageData[5] or 1.0))
+        )
+        package.setAttribute("complexity", "0.0")
+
+    # Populate the <sources> element: this is the root directory
+    source = doc.createElement("source")
+    source.appendChild(doc.createTextNode(options.root.strip()))
+    sources.appendChild(source)
+
+    if options.prettyxml:
+        import textwrap
+        lines = doc.toprettyxml(" ").split('\n')
+        for i in xrange(len(lines)):
+            n = 0
+            while n < len(lines[i]) and lines[i][n] == " ":
+                n += 1
+            lines[i] = "\n".join(textwrap.wrap(
+                lines[i], 78,
+                break_long_words=False,
+                break_on_hyphens=False,
+                subsequent_indent=" " + n * " "
+            ))
+        xmlString = "\n".join(lines)
+        # print textwrap.wrap(doc.toprettyxml(" "), 80)
+    else:
+        xmlString = doc.toprettyxml(indent="")
+    options.output.write(xmlString + '\n')
+
+
+def write_streaming(covdata, options):
+    write_xml_report(covdata, options, options.output)
+
+
+def run(report, covdata, options, filename):
+    with open(filename, 'w') as stream:
+        options.output = stream
+        report(covdata, options)
+
+
+def peak_memory(report, covdata, options, filename):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    run(report, covdata, options, filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pretty', action='store_true')
+    parser.add_argument('--streaming-only', action='store_true')
+    args = parser.parse_args()
+
+    covdata = generate_covdata(args.files, args.lines)
+    options = argparse.Namespace(
+        root='/project', prettyxml=args.pretty, output=None,
+        root_filter=re.compile(re.escape('/project' + os.sep)))
+    reports = [('streaming', write_streaming)]
+    if not args.streaming_only:
+        reports.append(('minidom', print_minidom_report))
+
+    # Both reports get the same timestamp
+    now = time.time()
+    time.time = lambda: now
+
+    directory = tempfile.mkdtemp(prefix='gcovr-benchmark-')
+    try:
+        print("{0} files with {1} lines each".format(args.files, args.lines))
+        outputs = []
+        for name, report in reports:
+            filename = os.path.join(directory, name + '.xml')
+            peak = peak_memory(report, covdata, options, filename)
+            seconds = min(timeit.repeat(
+                lambda: run(report, covdata, options, filename),
+                number=1, repeat=args.repeat))
+            with open(filename) as stream:
+                outputs.append(stream.read())
+            print("{0:>10}: {1:.3f}s{2}".format(
+                name, seconds, '' if peak is None else
+                ", peak {0:.1f} MB".format(peak / 1e6)))
+        if len(outputs) > 1 and outputs[0] != outputs[1]:
+            print("The reports differ!")
+            return 1
+        return 0
+    finally:
+        for name, _ in reports:
+            filename = os.path.join(directory, name + '.xml')
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -39,11 +39,16 @@ from multiprocessing import cpu_count
 from tempfile import mkdtemp
 from shutil import rmtree
 
-from .gcov import get_datafiles, process_existing_gcov_file, process_datafile
-from .utils import get_global_stats, build_filter, Logger
+from .gcov import (
+    get_datafiles, get_listed_datafiles, process_existing_gcov_file,
+    process_datafile, process_datafile_batch, process_datafile_json,
+    process_datafile_python, group_datafiles, estimate_cost, merge_results,
+    probe_gcov)
+from .cache import ResultCache
+from .gcno import read_compile_commands
+from .utils import get_global_stats, build_filter, read_file_list, Logger
 from .version import __version__
-from .workers import Workers
-from .coverage import CoverageData
+from .workers import Scheduler, Workers, WorkingDirectoryCache
 
 # generators
 from .cobertura_xml_generator import print_xml_report
@@ -71,6 +76,36 @@ def fail_under(covdata, threshold_line, threshold_branch):
         sys.exit(4)
 
 
+def work_directory(item):
+    """The directory of a file or a batch of files, for the scheduler."""
+    if isinstance(item, list):
+        item = item[0]
+    return os.path.dirname(os.path.abspath(item))
+
+
+def cache_key_options(options, gcov_version):
+    """The options that change the coverage of a data file.
+
+    Parsing gcov files (-g) only depends on the parser options,
+    as their source file names are resolved on every run.
+    """
+    def patterns(filters):
+        return [f.pattern for f in filters]
+
+    if options.gcov_files:
+        return (
+            'gcov', options.exclude_unreachable_branches,
+            options.gcov_ignore_parse_errors)
+    return (
+        gcov_version, options.gcov_cmd, options.gcov_engine,
+        options.gcov_pipe, options.objdir, options.compile_commands,
+        options.exclude_unreachable_branches,
+        options.gcov_ignore_parse_errors,
+        options.root_dir, options.starting_dir,
+        patterns(options.filter), patterns(options.exclude),
+        patterns(options.gcov_filter), patterns(options.gcov_exclude))
+
+
 # helper for percentage actions
 def check_percentage(value):
     try:
@@ -226,6 +261,30 @@ def parse_arguments(args):
         dest="html_details",
         default=False
     )
+    output_options.add_argument(
+        "--html-tree",
+        help="List only the top directories and files on the HTML report, "
+             "and write a page for every directory "
+             "with the totals of everything below it, "
+             "which keeps the pages of large projects small. "
+             "Requires --output as a basename for the pages. "
+             "Implies --html. "
+             "Default: %(default)s.",
+        action="store_true",
+        dest="html_tree",
+        default=False
+    )
+    output_options.add_argument(
+        "--html-incremental",
+        help="Only rewrite the --html-details pages whose source, "
+             "coverage or options changed since the last report. "
+             "Their fingerprints are kept in OUTPUT.fingerprints. "
+             "The pages that are left alone keep their old date. "
+             "Default: %(default)s.",
+        action="store_true",
+        dest="html_incremental",
+        default=False
+    )
     output_options.add_argument(
         "--html-absolute-paths",
         help="Use absolute paths to link the --html-details reports. "
@@ -365,6 +424,79 @@ def parse_arguments(args):
         dest="objdir",
         default=None
     )
+    gcov_options.add_argument(
+        '--compile-commands',
+        help="Read the directory where the compiler was run "
+             "for every object file from a compile_commands.json "
+             "compilation database, "
+             "instead of the gcno files. "
+             "Such a directory is tried first "
+             "as gcov working directory. "
+             "Default: %(default)s.",
+        action="store",
+        dest="compile_commands",
+        default=None
+    )
+    gcov_options.add_argument(
+        '--datafiles-from',
+        help="Process the data files (or the gcov files for -g) "
+             "listed in FILE, separated by newlines or NUL characters, "
+             "instead of searching the search paths. "
+             "A data file can also be listed by its object file. "
+             "If FILE is '-', the list is read from the standard input. "
+             "Default: %(default)s.",
+        metavar="FILE",
+        action="store",
+        dest="datafiles_from",
+        default=None
+    )
+    gcov_options.add_argument(
+        '--datafiles-from-compile-commands',
+        help="Process the data files of the object files "
+             "of the --compile-commands database, "
+             "instead of searching the search paths. "
+             "Default: %(default)s.",
+        action="store_true",
+        dest="datafiles_from_compile_commands",
+        default=False
+    )
+    gcov_options.add_argument(
+        "--gcov-engine",
+        help="Choose how gcov reports coverage: "
+             "'text' parses the human-readable gcov output, "
+             "'json' parses the JSON intermediate format of GCC 9 and later. "
+             "The JSON format does not need the gcc working directory "
+             "and writes no files, "
+             "but cannot tell lines that are only reached by exceptions, "
+             "numbers the branches of a line without its calls, "
+             "and adds up the counts of all template instances "
+             "on a line instead of taking the last one. "
+             "'python' reads the gcno and gcda files of GCC 8 and later "
+             "without running gcov, "
+             "and follows the counting rules of gcov's JSON output; "
+             "gcov is still run for other files. "
+             "With 'json' and 'python', --gcov-filter and --gcov-exclude "
+             "match the source file names instead of the gcov file names. "
+             "'auto' uses 'json' if gcov supports it "
+             "and neither --gcov-filter nor --gcov-exclude is given. "
+             "Default: %(default)s.",
+        choices=['auto', 'text', 'json', 'python'],
+        dest="gcov_engine",
+        default='text'
+    )
+    gcov_options.add_argument(
+        "--gcov-pipe",
+        help="Read the gcov output over a pipe ('gcov --stdout') "
+             "instead of creating and reading .gcov files. "
+             "The --gcov-filter and --gcov-exclude filters are then "
+             "matched against the source file names reported by gcov. "
+             "Falls back to .gcov files "
+             "if gcov does not support --stdout. "
+             "Default: %(default)s.",
+        action="store_true",
+        dest="gcov_pipe",
+        default=False
+    )
     gcov_options.add_argument(
         "-k", "--keep",
         help="Keep gcov files after processing. "
@@ -391,6 +523,116 @@ def parse_arguments(args):
         dest="gcov_parallel",
         default=1
     )
+    gcov_options.add_argument(
+        "--search-parallel",
+        help="Read up to N directories at once "
+             "while searching for raw coverage files, "
+             "which helps on network file systems. "
+             "Default: %(default)s.",
+        metavar="N",
+        type=int,
+        dest="search_parallel",
+        default=1
+    )
+    gcov_options.add_argument(
+        "--parallel-mode",
+        help="Run the -j workers as 'threads' or as 'processes'. "
+             "Processes can parse gcov files on several CPU cores, "
+             "but have to send their results back. "
+             "'auto' uses processes for existing gcov files (-g) "
+             "and for the --html-details pages, "
+             "and threads otherwise, "
+             "as the threads mostly wait for gcov. "
+             "Default: %(default)s.",
+        choices=['auto', 'threads', 'processes'],
+        dest="parallel_mode",
+        default='auto'
+    )
+    gcov_options.add_argument(
+        "--schedule",
+        help="Choose the order in which the data files are processed. "
+             "'size' starts with the directory "
+             "with the largest data files among those found so far, "
+             "and processes its largest files first, "
+             "so that no big file is left for the end. "
+             "'found' processes the files in the order they are found. "
+             "Default: %(default)s.",
+        choices=['size', 'found'],
+        dest="schedule",
+        default='size'
+    )
+    gcov_options.add_argument(
+        "--gcov-batch",
+        help="Run a single gcov process for up to N data files "
+             "that share an object directory. "
+             "Smaller batches are started while -j threads are idle. "
+             "If gcov fails for a batch, "
+             "its files are processed one at a time. "
+             "Without N, batches hold up to %(const)s files. "
+             "Default: %(default)s (no batching).",
+        metavar="N",
+        nargs="?",
+        const=64,
+        type=int,
+        dest="gcov_batch",
+        default=1
+    )
+
+    cache_options = parser.add_argument_group(
+        "Cache Options",
+        description="Gcovr can keep the coverage of every data file "
+                    "in a cache directory, "
+                    "so that later runs only need to run gcov "
+                    "for the data files that changed. "
+                    "Data files are recognized by their contents "
+                    "and by the stamp of their gcno file. "
+                    "An entry is only used while its source files "
+                    "are unchanged, "
+                    "and all options that change the coverage "
+                    "are part of the key. "
+                    "With -g, the cache keeps the parsed gcov files "
+                    "instead, recognized by their contents. "
+                    "The batches of --gcov-batch are only stored "
+                    "without --gcov-pipe."
+    )
+    cache_options.add_argument(
+        "--cache",
+        help="Use this directory as cache. "
+             "The entries are JSON data, but anyone who can write to "
+             "the directory can change the reported coverage, "
+             "so only share it between trusted jobs. "
+             "Defaults to the GCOVR_CACHE_DIR environment variable, "
+             "if set: '%(default)s'.",
+        metavar="DIR",
+        dest="cache_dir",
+        default=os.environ.get('GCOVR_CACHE_DIR')
+    )
+    cache_options.add_argument(
+        "--no-cache",
+        help="Bypass the cache. Default: %(default)s.",
+        action="store_true",
+        dest="no_cache",
+        default=False
+    )
+    cache_options.add_argument(
+        "--cache-clear",
+        help="Remove all entries from the cache before starting. "
+             "Default: %(default)s.",
+        action="store_true",
+        dest="cache_clear",
+        default=False
+    )
+    cache_options.add_argument(
+        "--cache-size",
+        help="Limit the size of the cache to MB megabytes. "
+             "The least recently used entries are removed "
+             "after every run. "
+             "Default: %(default)s.",
+        metavar="MB",
+        type=int,
+        dest="cache_size",
+        default=256
+    )
     return parser.parse_args(args=args)
 
 
@@ -441,6 +683,36 @@ def main(args=None):
                 "\tThe specified directory does not exist.")
             sys.exit(1)
 
+    options.compile_directories = dict()
+    if options.compile_commands is not None:
+        try:
+            options.compile_directories = read_compile_commands(
+                options.compile_commands)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            logger.error(
+                "Bad --compile-commands option.\n"
+                "\tCannot read the compilation database: {0}", e)
+            sys.exit(1)
+
+    # Data files that are listed instead of searched for
+    listed_files = None
+    if options.datafiles_from is not None:
+        try:
+            listed_files = read_file_list(options.datafiles_from)
+        except (IOError, OSError) as e:
+            logger.error(
+                "Bad --datafiles-from option.\n"
+                "\tCannot read the list of data files: {0}", e)
+            sys.exit(1)
+    if options.datafiles_from_compile_commands:
+        if options.compile_commands is None:
+            logger.error(
+                "--datafiles-from-compile-commands "
+                "requires the --compile-commands option.")
+            sys.exit(1)
+        listed_files = (listed_files or []) + sorted(
+            stem + '.gcda' for stem in options.compile_directories)
+
     options.starting_dir = os.path.abspath(os.getcwd())
     if not options.root:
         logger.error(
@@ -472,61 +744,168 @@ def main(args=None):
         options.gcov_exclude[i] = build_filter(options.gcov_exclude[i])
     for i in range(0, len(options.gcov_filter)):
         options.gcov_filter[i] = build_filter(options.gcov_filter[i])
+    # The gcov filters match other names with the JSON format
+    gcov_filtered = bool(options.gcov_filter or options.gcov_exclude)
     if len(options.gcov_filter) == 0:
         options.gcov_filter.append(re.compile(''))
 
+    if options.no_cache:
+        options.cache_dir = None
+    elif options.keep and not options.gcov_files and \
+            options.cache_dir is not None:
+        # Cache hits leave no gcov files to keep
+        logger.warn(
+            "The cache leaves no gcov files to keep.\n"
+            "\tIgnoring the --cache option, as --keep is set.")
+        options.cache_dir = None
+    elif options.gcov_pipe and options.gcov_batch > 1 and \
+            options.cache_dir is not None:
+        # The output of a batch on a pipe cannot be told apart by data file
+        logger.warn(
+            "The --gcov-pipe output of a --gcov-batch batch "
+            "is not stored in the cache.\n"
+            "\tOnly data files that gcov processes alone are cached.")
+    gcov_info = dict(version=None)
+
+    if options.gcov_files:
+        options.gcov_engine = 'text'
+    elif options.gcov_pipe or options.gcov_engine != 'text' or \
+            options.cache_dir is not None:
+        gcov_info = probe_gcov(options.gcov_cmd)
+        logger.verbose_msg(
+            "Probed {0}: version {1}", options.gcov_cmd,
+            '.'.join(str(x) for x in gcov_info['version'] or ['unknown']))
+
+        if options.gcov_pipe and not gcov_info['stdout']:
+            logger.warn(
+                "{0} does not support --stdout.\n"
+                "\tIgnoring the --gcov-pipe option.",
+                options.gcov_cmd)
+            options.gcov_pipe = False
+
+        if options.gcov_engine == 'json' and not gcov_info['json']:
+            logger.warn(
+                "{0} does not support the JSON intermediate format.\n"
+                "\tUsing the text format instead.",
+                options.gcov_cmd)
+        if options.gcov_engine == 'auto' and gcov_filtered:
+            options.gcov_engine = 'text'
+        if options.gcov_engine in ('auto', 'json'):
+            options.gcov_engine = 'json' if gcov_info['json'] else 'text'
+        logger.verbose_msg("Using the {0} gcov engine", options.gcov_engine)
+
     # Get data files
     if not options.search_paths:
         options.search_paths = [options.root]
 
         if options.objdir is not None:
             options.search_paths.append(options.objdir)
-    datafiles = get_datafiles(options.search_paths, options)
+    if listed_files is not None:
+        datafiles = get_listed_datafiles(listed_files, options)
+    else:
+        datafiles = get_datafiles(options.search_paths, options)
+
+    cache = None
+    if options.cache_dir is not None:
+        cache = ResultCache(
+            os.path.abspath(options.cache_dir),
+            size_limit=options.cache_size * 1024 * 1024,
+            key_options=cache_key_options(options, gcov_info['version']))
+        if options.cache_clear:
+            logger.verbose_msg("Clearing the cache {0}", cache.directory)
+            cache.clear()
 
     # Get coverage data
+    parallel_mode = options.parallel_mode
+    if parallel_mode == 'auto':
+        if options.gcov_files and options.gcov_parallel > 1:
+            parallel_mode = 'processes'
+        else:
+            parallel_mode = 'threads'
+
+    # The results of the workers are merged as they come in,
+    # while the search for more data files goes on.
+    # Worker processes first reduce the results of several data files.
+    covdata = dict()
+    toerase = set()
+    stats = dict()
+    results = {'covdata': covdata, 'toerase': toerase, 'stats': stats}
+
+    wd_cache = WorkingDirectoryCache()
     with Workers(options.gcov_parallel, lambda: {
-                 'covdata': dict(),
                  'workdir': mkdtemp(),
-                 'toerase': set(),
-                 'options': options}) as pool:
-        logger.verbose_msg("Pool started with {0} threads", pool.size())
-        for file_ in datafiles:
-            if options.gcov_files:
-                pool.add(process_existing_gcov_file, file_)
-            else:
-                pool.add(process_datafile, file_)
+                 'wd_cache': wd_cache,
+                 'cache': cache,
+                 'options': options},
+                 processes=parallel_mode == 'processes',
+                 results={
+                     'covdata': dict(),
+                     'toerase': set(),
+                     'stats': dict()},
+                 merge=lambda item_results: merge_results(
+                     results, item_results),
+                 reduce=merge_results) as pool:
+        logger.verbose_msg(
+            "Pool started with {0} {1}", pool.size(), parallel_mode)
+        scheduler = Scheduler(estimate_cost)
+
+        def ready():
+            # Start a smaller batch if nothing else is waiting
+            return pool.queue_empty() and not scheduler
+
+        if options.gcov_files:
+            work, items = process_existing_gcov_file, datafiles
+        elif options.gcov_engine == 'json':
+            work = process_datafile_json
+            items = group_datafiles(datafiles, options.gcov_batch, flush=ready)
+        elif options.gcov_engine == 'python':
+            work = process_datafile_python
+            items = group_datafiles(datafiles, options.gcov_batch, flush=ready)
+        elif options.gcov_batch > 1:
+            work = process_datafile_batch
+            items = group_datafiles(datafiles, options.gcov_batch, flush=ready)
+        else:
+            work, items = process_datafile, datafiles
+
+        if options.schedule == 'size':
+            items = scheduler.schedule(
+                items, directory=work_directory, ready=pool.queue_empty)
+        for item in items:
+            pool.add(work, item)
         contexts = pool.wait()
 
-    covdata = dict()
-    toerase = set()
     for context in contexts:
-        for fname, cov in context['covdata'].items():
-            if fname not in covdata:
-                covdata[fname] = CoverageData(fname)
-            covdata[fname].update(
-                uncovered=cov.uncovered,
-                uncovered_exceptional=cov.uncovered_exceptional,
-                covered=cov.covered,
-                branches=cov.branches,
-                noncode=cov.noncode)
-        toerase.update(context['toerase'])
         rmtree(context['workdir'])
     for filepath in toerase:
         if os.path.exists(filepath):
             os.remove(filepath)
 
     logger.verbose_msg("Gathered coveraged data for {0} files", len(covdata))
+    if not options.gcov_files:
+        logger.verbose_msg(
+            "Spawned {0} gcov processes for {1} data files",
+            stats.get('gcov_runs', 0), stats.get('datafiles', 0))
+    if cache is not None:
+        evicted = cache.evict()
+        logger.verbose_msg(
+            "Cache: {0} hits, {1} misses, {2} entries evicted",
+            stats.get('cache_hits', 0), stats.get('cache_misses', 0),
+            evicted)
+    if 'wd_cache_hits' in stats or 'wd_cache_misses' in stats:
+        logger.verbose_msg(
+            "Working directory cache: {0} hits, {1} misses",
+            stats.get('wd_cache_hits', 0), stats.get('wd_cache_misses', 0))
 
     # Print report
     if options.xml or options.prettyxml:
         print_xml_report(covdata, options)
-    elif options.html or options.html_details:
+    elif options.html or options.html_details or options.html_tree:
         print_html_report(covdata, options)
     else:
         print_text_report(covdata, options)
 
     if options.print_summary:
-        print_summary(covdata, options)
+        print_summary(covdata)
 
     if options.fail_under_line > 0.0 or options.fail_under_branch > 0.0:
         fail_under(covdata, options.fail_under_line, options.fail_under_branch)
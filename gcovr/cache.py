@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+
+# Changes whenever the format of the cached results changes
+CACHE_VERSION = 4
+
+
+class ResultCache(object):
+    """On-disk cache for the coverage results of input files.
+
+    Every entry is a file named by the hash of its key,
+    holding the compressed JSON of the results.
+    The results are plain lists, dicts, strings and numbers:
+    the cache directory can be shared, and loading an entry
+    must not run code from it, as unpickling would.
+    Entries are evicted in least recently used order
+    (by modification time, which is updated on every hit)
+    once the cache is larger than size_limit bytes.
+    The cache is only a directory, so it can be shared
+    by worker threads and processes.
+    """
+
+    def __init__(self, directory, size_limit, key_options):
+        self.directory = directory
+        self.size_limit = size_limit
+        # Options that change the results are part of every key
+        self.key_options = key_options
+
+    def key(self, *parts):
+        """Build the key for some input, e.g. the hash of a file."""
+        digest = hashlib.sha1(
+            repr((CACHE_VERSION, self.key_options)).encode('utf-8'))
+        digest.update(repr(parts).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, key):
+        """Get the results for the key, or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as stream:
+                results = json.loads(
+                    zlib.decompress(stream.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error):
+            # A missing or damaged entry is a miss
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return results
+
+    def store(self, key, results):
+        """Save the results for the key."""
+        path = self.path(key)
+        data = zlib.compress(json.dumps(results).encode('utf-8'))
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass  # created by another worker
+        # Write to a temporary file first,
+        # so that other workers never see half an entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                stream.write(data)
+            if os.path.exists(path):
+                os.remove(path)  # for Windows
+            os.rename(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def entries(self):
+        """List the (modification time, size, path) of all entries."""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries above the size limit.
+
+        returns: the number of removed entries
+        """
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if size <= self.size_limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Remove all entries."""
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def hash_file(filename):
+    """Hash the contents of a file, or return None if it is missing."""
+    digest = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as stream:
+            for block in iter(lambda: stream.read(1 << 16), b''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
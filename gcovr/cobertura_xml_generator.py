@@ -7,216 +7,236 @@
 # This software is distributed under the BSD license.
 
 import os
+import re
 import sys
+import textwrap
 import time
-import xml.dom.minidom
+from bisect import bisect_left
 
 from .version import __version__
+from .utils import get_global_stats
 
-try:
-    xrange
-except NameError:
-    xrange = range
+# Whitespace that textwrap replaces
+TEXTWRAP_WHITESPACE = re.compile('[\t\n\x0b\x0c\r]')
 
 
 #
 # Produce an XML report in the Cobertura format
 #
 def print_xml_report(covdata, options):
-    branchTotal = 0
-    branchCovered = 0
-    lineTotal = 0
-    lineCovered = 0
-
-    for key in covdata.keys():
-        (total, covered, percent) = covdata[key].coverage(show_branch=True)
-        branchTotal += total
-        branchCovered += covered
-
-    for key in covdata.keys():
-        (total, covered, percent) = covdata[key].coverage(show_branch=False)
-        lineTotal += total
-        lineCovered += covered
-
-    impl = xml.dom.minidom.getDOMImplementation()
-    docType = impl.createDocumentType(
-        "coverage", None,
-        "http://cobertura.sourceforge.net/xml/coverage-04.dtd"
-    )
-    doc = impl.createDocument(None, "coverage", docType)
-    root = doc.documentElement
-    root.setAttribute(
-        "line-rate", lineTotal == 0 and '0.0' or
-        str(float(lineCovered) / lineTotal)
-    )
-    root.setAttribute(
-        "branch-rate", branchTotal == 0 and '0.0' or
-        str(float(branchCovered) / branchTotal)
-    )
-    root.setAttribute(
-        "lines-covered", str(lineCovered)
-    )
-    root.setAttribute(
-        "lines-valid", str(lineTotal)
-    )
-    root.setAttribute(
-        "branches-covered", str(branchCovered)
-    )
-    root.setAttribute(
-        "branches-valid", str(branchTotal)
-    )
-    root.setAttribute(
-        "complexity", "0.0"
-    )
-    root.setAttribute(
-        "timestamp", str(int(time.time()))
-    )
-    root.setAttribute(
-        "version", "gcovr %s" % (__version__,)
-    )
-
-    # Generate the <sources> element: this is either the root directory
+    if options.output is None:
+        write_xml_report(covdata, options, sys.stdout)
+    else:
+        with open(options.output, 'w') as stream:
+            write_xml_report(covdata, options, stream)
+
+
+def write_xml_report(covdata, options, stream):
+    """Write the XML report element by element.
+
+    Only the totals of the packages and classes are gathered first,
+    so that the lines of a file go straight to the stream.
+    The output is the same as that of the minidom document
+    that gcovr used to build.
+    """
+    (lineTotal, lineCovered, _,
+        branchTotal, branchCovered, _) = get_global_stats(covdata)
+
+    if options.prettyxml:
+        writer = XmlWriter(stream, indent=" ", width=78)
+    else:
+        writer = XmlWriter(stream, indent="")
+
+    writer.line('<?xml version="1.0" ?>')
+    writer.line('<!DOCTYPE coverage')
+    writer.line(
+        "  SYSTEM 'http://cobertura.sourceforge.net/xml/coverage-04.dtd'>")
+    writer.start('coverage', [
+        ("line-rate", lineTotal == 0 and '0.0' or
+            str(float(lineCovered) / lineTotal)),
+        ("branch-rate", branchTotal == 0 and '0.0' or
+            str(float(branchCovered) / branchTotal)),
+        ("lines-covered", str(lineCovered)),
+        ("lines-valid", str(lineTotal)),
+        ("branches-covered", str(branchCovered)),
+        ("branches-valid", str(branchTotal)),
+        ("complexity", "0.0"),
+        ("timestamp", str(int(time.time()))),
+        ("version", "gcovr %s" % (__version__,)),
+    ])
+
+    # Generate the <sources> element: this is the root directory
     # (specified by --root), or the CWD.
-    sources = doc.createElement("sources")
-    root.appendChild(sources)
+    writer.start('sources')
+    writer.text_element('source', options.root.strip())
+    writer.end('sources')
 
     # Generate the coverage output (on a per-package basis)
-    packageXml = doc.createElement("packages")
-    root.appendChild(packageXml)
+    packages = collect_packages(covdata, options)
+    if not packages:
+        writer.empty('packages')
+    else:
+        writer.start('packages')
+    for packageName in sorted(packages):
+        classes, hits, lines, branch_hits, branches = packages[packageName]
+        writer.start('package', [
+            ("name", packageName.replace(os.sep, '.')),
+            ("line-rate", str(hits / (1.0 * lines or 1.0))),
+            ("branch-rate", str(branch_hits / (1.0 * branches or 1.0))),
+            ("complexity", "0.0"),
+        ])
+        writer.start('classes')
+        for className in sorted(classes):
+            write_class(writer, className, *classes[className])
+        writer.end('classes')
+        writer.end('package')
+    if packages:
+        writer.end('packages')
+
+    writer.end('coverage')
+    writer.line('')
+
+
+def collect_packages(covdata, options):
+    """Group the files by directory, with the totals of every package.
+
+    returns: a dict of the package names to
+        [{class name: (data, filename, class totals)},
+         hits, lines, branch hits, branches]
+    """
     packages = {}
-    source_dirs = set()
-
-    keys = list(covdata.keys())
-    keys.sort()
-    for f in keys:
+    for f in sorted(covdata):
         data = covdata[f]
         directory = options.root_filter.sub('', f)
         if f.endswith(directory):
             src_path = f[:-1 * len(directory)]
             if len(src_path) > 0:
                 while directory.startswith(os.path.sep):
-                    src_path += os.path.sep
                     directory = directory[len(os.path.sep):]
-                source_dirs.add(src_path)
         else:
             # Do no truncation if the filter does not start matching at
             # the beginning of the string
             directory = f
         directory, fname = os.path.split(directory)
 
-        package = packages.setdefault(
-            directory, [doc.createElement("package"), {}, 0, 0, 0, 0]
-        )
-        c = doc.createElement("class")
-        # The Cobertura DTD requires a methods section, which isn't
-        # trivial to get from gcov (so we will leave it blank)
-        c.appendChild(doc.createElement("methods"))
-        lines = doc.createElement("lines")
-        c.appendChild(lines)
-
-        class_lines = 0
-        class_hits = 0
-        class_branches = 0
-        class_branch_hits = 0
-        for line in sorted(data.all_lines):
-            hits = data.covered.get(line, 0)
-            class_lines += 1
-            if hits > 0:
-                class_hits += 1
-            L = doc.createElement("line")
-            L.setAttribute("number", str(line))
-            L.setAttribute("hits", str(hits))
-            branches = data.branches.get(line)
-            if branches is None:
-                L.setAttribute("branch", "false")
-            else:
-                b_hits = 0
-                for v in branches.values():
-                    if v > 0:
-                        b_hits += 1
-                coverage = 100 * b_hits / len(branches)
-                L.setAttribute("branch", "true")
-                L.setAttribute(
-                    "condition-coverage",
-                    "%i%% (%i/%i)" % (coverage, b_hits, len(branches))
-                )
-                cond = doc.createElement('condition')
-                cond.setAttribute("number", "0")
-                cond.setAttribute("type", "jump")
-                cond.setAttribute("coverage", "%i%%" % (coverage))
-                class_branch_hits += b_hits
-                class_branches += float(len(branches))
-                conditions = doc.createElement("conditions")
-                conditions.appendChild(cond)
-                L.appendChild(conditions)
-
-            lines.appendChild(L)
-
-        className = fname.replace('.', '_')
-        c.setAttribute("name", className)
-        c.setAttribute("filename", os.path.join(directory, fname).replace('\\', '/'))
-        c.setAttribute(
-            "line-rate",
-            str(class_hits / (1.0 * class_lines or 1.0))
-        )
-        c.setAttribute(
-            "branch-rate",
-            str(class_branch_hits / (1.0 * class_branches or 1.0))
-        )
-        c.setAttribute("complexity", "0.0")
-
-        package[1][className] = c
-        package[2] += class_hits
-        package[3] += class_lines
-        package[4] += class_branch_hits
-        package[5] += class_branches
-
-    keys = list(packages.keys())
-    keys.sort()
-    for packageName in keys:
-        packageData = packages[packageName]
-        package = packageData[0]
-        packageXml.appendChild(package)
-        classes = doc.createElement("classes")
-        package.appendChild(classes)
-        classNames = list(packageData[1].keys())
-        classNames.sort()
-        for className in classNames:
-            classes.appendChild(packageData[1][className])
-        package.setAttribute("name", packageName.replace(os.sep, '.'))
-        package.setAttribute(
-            "line-rate", str(packageData[2] / (1.0 * packageData[3] or 1.0))
-        )
-        package.setAttribute(
-            "branch-rate", str(packageData[4] / (1.0 * packageData[5] or 1.0))
-        )
-        package.setAttribute("complexity", "0.0")
-
-    # Populate the <sources> element: this is the root directory
-    source = doc.createElement("source")
-    source.appendChild(doc.createTextNode(options.root.strip()))
-    sources.appendChild(source)
-
-    if options.prettyxml:
-        import textwrap
-        lines = doc.toprettyxml(" ").split('\n')
-        for i in xrange(len(lines)):
-            n = 0
-            while n < len(lines[i]) and lines[i][n] == " ":
-                n += 1
-            lines[i] = "\n".join(textwrap.wrap(
-                lines[i], 78,
+        totals = class_totals(data)
+        package = packages.setdefault(directory, [{}, 0, 0, 0, 0])
+        package[0][fname.replace('.', '_')] = (
+            data, os.path.join(directory, fname), totals)
+        for i, total in enumerate(totals):
+            package[i + 1] += total
+    return packages
+
+
+def class_totals(data):
+    """Count the (hits, lines, branch hits, branches) of a file.
+
+    Only the branches of executable lines are counted,
+    as only these lines are in the report.
+    """
+    lines = data.lines
+    hits = len(data.counts) - data.counts.count(0)
+    offsets = data.branch_offsets
+    branch_hits = 0
+    branches = 0
+    for i, line in enumerate(data.branch_lines):
+        j = bisect_left(lines, line)
+        if j < len(lines) and lines[j] == line:
+            counts = data.branch_counts[offsets[i]:offsets[i + 1]]
+            branches += len(counts)
+            branch_hits += len(counts) - counts.count(0)
+    return hits, len(lines), branch_hits, branches
+
+
+def write_class(writer, className, data, filename, totals):
+    class_hits, class_lines, class_branch_hits, class_branches = totals
+    writer.start('class', [
+        ("name", className),
+        ("filename", filename.replace('\\', '/')),
+        ("line-rate", str(class_hits / (1.0 * class_lines or 1.0))),
+        ("branch-rate",
+            str(class_branch_hits / (1.0 * class_branches or 1.0))),
+        ("complexity", "0.0"),
+    ])
+    # The Cobertura DTD requires a methods section, which isn't
+    # trivial to get from gcov (so we will leave it blank)
+    writer.empty('methods')
+    if not len(data.lines):
+        writer.empty('lines')
+        writer.end('class')
+        return
+
+    writer.start('lines')
+    line = writer.line
+    for number, state, hits, branches in data.line_records():
+        if branches is None:
+            line('<line number="%d" hits="%d" branch="false"/>' % (
+                number, hits))
+            continue
+        b_hits = 0
+        for _, v in branches:
+            if v > 0:
+                b_hits += 1
+        coverage = 100 * b_hits / len(branches)
+        line('<line number="%d" hits="%d" branch="true" '
+             'condition-coverage="%i%% (%i/%i)">' % (
+                 number, hits, coverage, b_hits, len(branches)))
+        line('<conditions>', 1)
+        line('<condition number="0" type="jump" coverage="%i%%"/>' % (
+            coverage), 2)
+        line('</conditions>', 1)
+        line('</line>')
+    writer.end('lines')
+    writer.end('class')
+
+
+class XmlWriter(object):
+    """Write the lines of an XML document to a stream,
+    like the toprettyxml() of minidom.
+
+    With a width, longer lines are wrapped with textwrap,
+    their next lines indented by one more level.
+    """
+
+    def __init__(self, stream, indent, width=None):
+        self.stream = stream
+        self.indent = indent
+        self.width = width
+        self.depth = 0
+
+    def line(self, text, depth=0):
+        """Write a line, depth levels below the current element."""
+        text = self.indent * (self.depth + depth) + text
+        if self.width is not None and (
+                len(text) > self.width or TEXTWRAP_WHITESPACE.search(text)):
+            n = len(text) - len(text.lstrip(" "))
+            text = "\n".join(textwrap.wrap(
+                text, self.width,
                 break_long_words=False,
                 break_on_hyphens=False,
-                subsequent_indent=" " + n * " "
-            ))
-        xmlString = "\n".join(lines)
-        # print textwrap.wrap(doc.toprettyxml(" "), 80)
-    else:
-        xmlString = doc.toprettyxml(indent="")
-    if options.output is None:
-        sys.stdout.write(xmlString + '\n')
-    else:
-        OUTPUT = open(options.output, 'w')
-        OUTPUT.write(xmlString + '\n')
-        OUTPUT.close()
+                subsequent_indent=" " + n * " "))
+        self.stream.write(text + "\n")
+
+    def start(self, name, attributes=()):
+        self.line("<%s%s>" % (name, format_attributes(attributes)))
+        self.depth += 1
+
+    def end(self, name):
+        self.depth -= 1
+        self.line("</%s>" % name)
+
+    def empty(self, name, attributes=()):
+        self.line("<%s%s/>" % (name, format_attributes(attributes)))
+
+    def text_element(self, name, text):
+        self.line("<%s>%s</%s>" % (name, escape(text), name))
+
+
+def format_attributes(attributes):
+    return "".join(
+        ' %s="%s"' % (name, escape(value)) for name, value in attributes)
+
+
+def escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
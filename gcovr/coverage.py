@@ -6,41 +6,301 @@
 # Copyright 2013 Sandia Corporation
 # This software is distributed under the BSD license.
 
+import array
+import operator
+import sys
+from bisect import bisect_left
+
 from .utils import calculate_coverage
 
+# The state of a line, as flags
+COVERED = 1
+UNCOVERED = 2
+UNCOVERED_EXCEPTIONAL = 4
+
+if sys.version_info >= (3, 3):
+    def count_vector(values=()):
+        return array.array('q', values)
+else:
+    # Python 2 has no 64 bit array type,
+    # and execution counts can exceed 32 bits
+    def count_vector(values=()):
+        return list(values)
+
+
+def line_vector(values=()):
+    return array.array('i', values)
+
 
 class CoverageData(object):
     """Container for coverage statistics of one file.
+
+    The executable lines are kept in sorted arrays:
+    lines holds their numbers, counts their execution counts,
+    and states their COVERED, UNCOVERED and UNCOVERED_EXCEPTIONAL flags.
+    The branches are kept flat: branch_lines[i] has the branches
+    with the numbers branch_numbers[j] and counts branch_counts[j],
+    for branch_offsets[i] <= j < branch_offsets[i + 1].
+    Branches can also be on lines that are not executable.
+
+    The reports use line_records(), stats() and coverage().
+    The statistics are computed once, until the next update() or merge().
+    The covered,
+    uncovered, uncovered_exceptional, noncode, all_lines and branches
+    properties build the sets and dicts of these arrays on every use.
     """
 
+    __slots__ = (
+        'fname', 'lines', 'counts', 'states', 'noncode_lines',
+        'branch_lines', 'branch_offsets', 'branch_numbers', 'branch_counts',
+        '_stats')
+
     def __init__(self, fname):
         self.fname = fname
-        self.uncovered = set()
-        self.uncovered_exceptional = set()
-        self.covered = dict()
-        self.noncode = set()
-        self.all_lines = set()
-        self.branches = dict()
+        self.lines = line_vector()
+        self.counts = count_vector()
+        self.states = array.array('B')
+        self.noncode_lines = line_vector()
+        self.branch_lines = line_vector()
+        self.branch_offsets = array.array('l', [0])
+        self.branch_numbers = line_vector()
+        self.branch_counts = count_vector()
+        self._stats = None
 
     def update(
             self, uncovered, uncovered_exceptional, covered, branches,
             noncode):
-        self.all_lines.update(uncovered)
-        self.all_lines.update(uncovered_exceptional)
-        self.all_lines.update(covered.keys())
-        self.uncovered.update(uncovered)
-        self.uncovered_exceptional.update(uncovered_exceptional)
-        self.noncode.intersection_update(noncode)
-        update_counters(self.covered, covered)
-        for k in branches.keys():
-            d = self.branches.setdefault(k, {})
-            update_counters(d, branches[k])
-        self.uncovered.difference_update(self.covered.keys())
-        self.uncovered_exceptional.difference_update(self.covered.keys())
+        self._stats = None
+        states = dict()
+        for line in uncovered:
+            states[line] = UNCOVERED
+        for line in uncovered_exceptional:
+            states[line] = states.get(line, 0) | UNCOVERED_EXCEPTIONAL
+        for line in covered:
+            states[line] = COVERED
+        lines = sorted(states)
+        self.merge_lines(
+            line_vector(lines), [covered.get(line, 0) for line in lines],
+            [states[line] for line in lines])
+        lines, offsets, numbers, counts = flatten_branches(branches)
+        self.merge_branches(
+            line_vector(lines), array.array('l', offsets),
+            line_vector(numbers), counts)
+        self.merge_noncode(noncode)
+
+    def merge(self, other):
+        """Add the coverage of another CoverageData of the same file."""
+        self._stats = None
+        self.merge_lines(other.lines, other.counts, other.states)
+        self.merge_branches(
+            other.branch_lines, other.branch_offsets, other.branch_numbers,
+            other.branch_counts)
+        self.merge_noncode(set(other.noncode_lines))
+
+    def merge_lines(self, lines, counts, states):
+        """Add the counts and states of sorted line numbers."""
+        if not self.lines:
+            self.lines = line_vector(lines)
+            self.counts = count_vector(counts)
+            self.states = array.array('B', states)
+            return
+
+        if self.lines == lines:
+            # e.g. a header in many translation units
+            self.counts = count_vector(map(operator.add, self.counts, counts))
+            self.states = array.array('B', map(
+                COVERED_STATES.__getitem__,
+                map(operator.or_, self.states, states)))
+            return
+
+        missing = []
+        start = 0
+        for line in lines:
+            start = bisect_left(self.lines, line, start)
+            if start == len(self.lines) or self.lines[start] != line:
+                missing.append(line)
+        if missing:
+            self.insert_lines(missing)
+
+        start = 0
+        for i, line in enumerate(lines):
+            start = bisect_left(self.lines, line, start)
+            self.counts[start] += counts[i]
+            self.states[start] = covered_state(self.states[start] | states[i])
+
+    def insert_lines(self, new_lines):
+        """Insert sorted new line numbers, with no count and state."""
+        lines = line_vector()
+        counts = count_vector()
+        states = array.array('B')
+        start = 0
+        for line in new_lines:
+            end = bisect_left(self.lines, line, start)
+            lines.extend(self.lines[start:end])
+            counts.extend(self.counts[start:end])
+            states.extend(self.states[start:end])
+            lines.append(line)
+            counts.append(0)
+            states.append(0)
+            start = end
+        lines.extend(self.lines[start:])
+        counts.extend(self.counts[start:])
+        states.extend(self.states[start:])
+        self.lines, self.counts, self.states = lines, counts, states
+
+    def merge_branches(self, lines, offsets, numbers, counts):
+        """Add branches in the flat layout,
+        sorted by line and by branch number."""
+        if not self.branch_lines:
+            self.set_branches(lines, offsets, numbers, counts)
+            return
+
+        if self.branch_lines == lines and self.branch_offsets == offsets and \
+                self.branch_numbers == numbers:
+            self.branch_counts = count_vector(
+                map(operator.add, self.branch_counts, counts))
+            return
+
+        # Add the counts in place, unless there are new branches
+        positions = self.find_branches(lines, offsets, numbers)
+        if positions is not None:
+            for position, count in zip(positions, counts):
+                self.branch_counts[position] += count
+            return
+
+        merged = dict(
+            (line, dict(branches)) for line, branches in self.branch_records())
+        for line, branches in iter_branches(lines, offsets, numbers, counts):
+            line_branches = merged.setdefault(line, {})
+            for number, count in branches:
+                line_branches[number] = line_branches.get(number, 0) + count
+        self.set_branches(*flatten_branches(merged))
+
+    def find_branches(self, lines, offsets, numbers):
+        """Find the index of every branch of the flat layout,
+        or return None if there are new branches."""
+        positions = []
+        start = 0
+        for i, line in enumerate(lines):
+            start = bisect_left(self.branch_lines, line, start)
+            if start == len(self.branch_lines) or \
+                    self.branch_lines[start] != line:
+                return None
+            first = self.branch_offsets[start]
+            line_numbers = self.branch_numbers[
+                first:self.branch_offsets[start + 1]]
+            for number in numbers[offsets[i]:offsets[i + 1]]:
+                index = bisect_left(line_numbers, number)
+                if index == len(line_numbers) or \
+                        line_numbers[index] != number:
+                    return None
+                positions.append(first + index)
+        return positions
+
+    def set_branches(self, lines, offsets, numbers, counts):
+        self.branch_lines = line_vector(lines)
+        self.branch_offsets = array.array('l', offsets)
+        self.branch_numbers = line_vector(numbers)
+        self.branch_counts = count_vector(counts)
+
+    def merge_noncode(self, noncode):
+        # Only lines that are non-code in every report stay non-code
+        self.noncode_lines = line_vector(
+            line for line in self.noncode_lines if line in noncode)
+
+    def branch_records(self):
+        """Iterate over the (line number, [(branch number, count), ...])
+        of the lines with branches, in line order."""
+        return iter_branches(
+            self.branch_lines, self.branch_offsets, self.branch_numbers,
+            self.branch_counts)
+
+    def line_records(self):
+        """Iterate over the executable lines in order,
+        as (line number, state, count, branches) tuples.
+
+        branches is a list of (branch number, count),
+        or None for a line without branches.
+        """
+        branch_lines = self.branch_lines
+        offsets = self.branch_offsets
+        b = 0
+        for i, line in enumerate(self.lines):
+            while b < len(branch_lines) and branch_lines[b] < line:
+                b += 1
+            branches = None
+            if b < len(branch_lines) and branch_lines[b] == line:
+                start, end = offsets[b], offsets[b + 1]
+                branches = list(zip(
+                    self.branch_numbers[start:end],
+                    self.branch_counts[start:end]))
+            yield line, self.states[i], self.counts[i], branches
+
+    def lines_with_state(self, flag):
+        return [
+            line for line, state in zip(self.lines, self.states)
+            if state & flag]
+
+    @property
+    def covered(self):
+        return dict(
+            (line, count)
+            for line, count, state in zip(self.lines, self.counts, self.states)
+            if state & COVERED)
+
+    @property
+    def uncovered(self):
+        return set(self.lines_with_state(UNCOVERED))
+
+    @property
+    def uncovered_exceptional(self):
+        return set(self.lines_with_state(UNCOVERED_EXCEPTIONAL))
+
+    @property
+    def noncode(self):
+        return set(self.noncode_lines)
+
+    @property
+    def all_lines(self):
+        return set(self.lines)
+
+    @property
+    def branches(self):
+        return dict(
+            (line, dict(branches)) for line, branches in self.branch_records())
+
+    def __getstate__(self):
+        # Lists of small numbers pickle smaller than arrays,
+        # and they can be stored as JSON
+        return (self.fname, self.lines.tolist(), list(self.counts),
+                self.states.tolist(), self.noncode_lines.tolist(),
+                self.branch_lines.tolist(), self.branch_offsets.tolist(),
+                self.branch_numbers.tolist(), list(self.branch_counts))
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild the coverage of a file from __getstate__(),
+        e.g. as read back from JSON."""
+        cov = cls.__new__(cls)
+        cov.__setstate__(state)
+        return cov
+
+    def __setstate__(self, state):
+        (self.fname, lines, counts, states, noncode_lines, branch_lines,
+         branch_offsets, branch_numbers, branch_counts) = state
+        self.lines = line_vector(lines)
+        self.counts = count_vector(counts)
+        self.states = array.array('B', states)
+        self.noncode_lines = line_vector(noncode_lines)
+        self.set_branches(
+            branch_lines, branch_offsets, branch_numbers, branch_counts)
+        self._stats = None
 
     def lines_with_uncovered_branches(self):
-        for line in self.branches.keys():
-            if any(count == 0 for count in self.branches[line].values()):
+        offsets = self.branch_offsets
+        for i, line in enumerate(self.branch_lines):
+            if any(count == 0 for count in
+                   self.branch_counts[offsets[i]:offsets[i + 1]]):
                 yield line
 
     def uncovered_str(self, exceptional, show_branch):
@@ -50,9 +310,9 @@ class CoverageData(object):
             return ",".join(str(x) for x in sorted(tmp))
 
         if exceptional:
-            tmp = list(self.uncovered_exceptional)
+            tmp = self.lines_with_state(UNCOVERED_EXCEPTIONAL)
         else:
-            tmp = list(self.uncovered)
+            tmp = self.lines_with_state(UNCOVERED)
         if len(tmp) == 0:
             return ""
 
@@ -65,25 +325,74 @@ class CoverageData(object):
         # provides a counterintuitive listing.
         return ",".join(
             format_range(first, last)
-            for first, last in find_consecutive_ranges(sorted(tmp)))
+            for first, last in find_consecutive_ranges(tmp))
+
+    def stats(self):
+        """Get the (lines total, lines covered,
+        branches total, branches covered) of the file."""
+        if self._stats is None:
+            self._stats = (
+                len(self.lines), self.states.count(COVERED),
+                len(self.branch_counts),
+                len(self.branch_counts) - self.branch_counts.count(0))
+        return self._stats
 
     def coverage(self, show_branch):
+        lines_total, lines_covered, branches_total, branches_covered = \
+            self.stats()
         if show_branch:
-            total = 0
-            cover = 0
-            for line in self.branches.keys():
-                for branch in self.branches[line].keys():
-                    total += 1
-                    cover += 1 if self.branches[line][branch] > 0 else 0
+            total, cover = branches_total, branches_covered
         else:
-            total = len(self.all_lines)
-            cover = len(self.covered)
+            total, cover = lines_total, lines_covered
 
         percent = calculate_coverage(cover, total, nan_value=None)
         percent = "--" if percent is None else str(int(percent))
         return (total, cover, percent)
 
 
+def covered_state(state):
+    """A covered line is neither uncovered nor uncovered exceptional."""
+    return COVERED if state & COVERED else state
+
+
+COVERED_STATES = tuple(covered_state(state) for state in range(8))
+
+
+def flatten_branches(branches):
+    """Get the flat layout of a dict of branch counts by line."""
+    lines = sorted(branches)
+    items = sorted(
+        (line, number, count)
+        for line, line_branches in branches.items()
+        for number, count in line_branches.items())
+    offsets = [0]
+    total = 0
+    for line in lines:
+        total += len(branches[line])
+        offsets.append(total)
+    return (
+        lines, offsets, [item[1] for item in items],
+        [item[2] for item in items])
+
+
+def iter_branches(lines, offsets, numbers, counts):
+    for i, line in enumerate(lines):
+        start, end = offsets[i], offsets[i + 1]
+        yield line, list(zip(numbers[start:end], counts[start:end]))
+
+
+def merge_covdata(target, source):
+    """Merge the CoverageData objects of one dict into another.
+
+    Both dicts are keyed by the source file name.
+    """
+    for fname, cov in source.items():
+        if fname not in target:
+            target[fname] = cov
+            continue
+        target[fname].merge(cov)
+
+
 def update_counters(target, source):
     for k in source:
         target[k] = target.get(k, 0) + source[k]
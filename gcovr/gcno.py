@@ -0,0 +1,698 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import json
+import os
+import shlex
+import struct
+
+from os.path import normpath
+
+GCNO_MAGIC = b'gcno'
+
+
+def read_gcno_header(filename):
+    """Read the version, stamp and gcc working directory of a .gcno file.
+
+    Returns a dict, or None if the file is missing or is no .gcno file.
+    The working directory is None if the file does not record it
+    (GCC 7 and older).
+    """
+    try:
+        with open(filename, 'rb') as stream:
+            return parse_gcno_header(stream)
+    except (IOError, OSError):
+        return None
+
+
+def parse_gcno_header(stream):
+    magic = stream.read(4)
+    if magic == GCNO_MAGIC:
+        byte_order = '>'
+    elif magic == GCNO_MAGIC[::-1]:
+        byte_order = '<'
+    else:
+        return None
+
+    def read_unsigned():
+        data = stream.read(4)
+        if len(data) < 4:
+            raise EOFError()
+        return struct.unpack(byte_order + 'I', data)[0]
+
+    try:
+        version = decode_gcov_version(read_unsigned())
+        header = dict(version=version, stamp=read_unsigned(), cwd=None)
+        if version is None or version < (8,):
+            return header
+
+        # GCC 12 added a checksum and counts string lengths in bytes
+        # instead of 4-byte words.
+        if version >= (12,):
+            read_unsigned()
+            length = read_unsigned()
+        else:
+            length = 4 * read_unsigned()
+        data = stream.read(length)
+        if len(data) < length:
+            raise EOFError()
+    except EOFError:
+        return None
+
+    cwd = data.split(b'\0', 1)[0]
+    if cwd:
+        header['cwd'] = cwd.decode('utf-8', 'replace')
+    return header
+
+
+def decode_gcov_version(word):
+    """Decode the version of a gcov file, e.g. "A75*" for GCC 7.5.
+
+    Returns a (major, minor) tuple, or None for an unknown encoding.
+    """
+    version = struct.pack('>I', word).decode('latin-1')
+    try:
+        if version[0] >= 'A':
+            # GCC 5 and later
+            major = 10 * (ord(version[0]) - ord('A')) + int(version[1])
+            minor = int(version[2])
+        else:
+            major = int(version[0])
+            minor = int(version[1:3])
+    except ValueError:
+        return None
+    return major, minor
+
+
+def read_compile_commands(filename):
+    """Map the object files of a compilation database to their directory.
+
+    The keys are the absolute paths of the object files
+    without their extension, which they share with the .gcno and .gcda files.
+    """
+    with open(filename) as stream:
+        entries = json.load(stream)
+
+    directories = dict()
+    for entry in entries:
+        directory = entry['directory']
+        output = entry.get('output') or find_output_argument(
+            entry.get('arguments') or shlex.split(entry['command']))
+        if output is None:
+            output = os.path.basename(entry['file'])
+        output = normpath(os.path.join(directory, output))
+        directories[os.path.splitext(output)[0]] = directory
+    return directories
+
+
+def find_output_argument(arguments):
+    for i, argument in enumerate(arguments):
+        if argument == '-o' and i + 1 < len(arguments):
+            return arguments[i + 1]
+        if argument.startswith('-o') and len(argument) > 2:
+            return argument[2:]
+    return None
+
+
+def find_gcc_working_directory(abs_filename, compile_directories):
+    """Find the directory where gcc was run for a .gcda or .gcno file.
+
+    The compilation database is preferred over the .gcno header.
+    Returns None if neither knows an existing directory.
+    """
+    stem = os.path.splitext(abs_filename)[0]
+    directory = compile_directories.get(stem)
+    if directory is None:
+        header = read_gcno_header(stem + '.gcno')
+        if header is not None:
+            directory = header['cwd']
+    if directory is not None and os.path.isdir(directory):
+        return directory
+    return None
+
+
+#
+# Read the .gcno and .gcda files without gcov
+#
+# This mirrors what gcov does for the JSON intermediate format:
+# the arc counters of the .gcda file are spread over the flow graph
+# of the .gcno file, the line counts are the number of times
+# the blocks of a line were entered (plus the loops within the line),
+# and the branches of a line are the conditional arcs of its blocks.
+# Only the formats of GCC 8 and later are supported,
+# which record the working directory of gcc.
+#
+
+GCDA_MAGIC = b'gcda'
+
+TAG_FUNCTION = 0x01000000
+TAG_BLOCKS = 0x01410000
+TAG_ARCS = 0x01430000
+TAG_LINES = 0x01450000
+TAG_COUNTER_ARCS = 0x01a10000
+
+ARC_ON_TREE = 1
+ARC_FAKE = 2
+ARC_FALLTHROUGH = 4
+
+ENTRY_BLOCK = 0
+EXIT_BLOCK = 1
+
+
+class GcovFormatError(ValueError):
+    """A .gcno or .gcda file that cannot be read without gcov."""
+
+
+class RecordReader(object):
+    """Read the words, counters and strings of a .gcno or .gcda file."""
+
+    def __init__(self, data, magic):
+        if data[:4] == magic:
+            self.byte_order = '>'
+        elif data[:4] == magic[::-1]:
+            self.byte_order = '<'
+        else:
+            raise GcovFormatError("not a {0} file".format(
+                magic.decode('ascii')))
+        self.data = data
+        self.pos = 4
+        self.strings = dict()
+        self.word = struct.Struct(self.byte_order + 'I')
+        self.version = decode_gcov_version(self.unsigned())
+        if self.version is None or self.version < (8,):
+            raise GcovFormatError("unsupported version {0}".format(
+                self.version))
+        # GCC 12 counts lengths in bytes instead of 4-byte words
+        self.unit = 1 if self.version >= (12,) else 4
+
+    def unsigned(self):
+        pos = self.pos
+        self.pos = pos + 4
+        try:
+            return self.word.unpack_from(self.data, pos)[0]
+        except struct.error:
+            raise GcovFormatError("unexpected end of file")
+
+    def words(self, count):
+        """Read count words at once."""
+        pos = self.pos
+        self.pos = pos + 4 * count
+        try:
+            return struct.unpack_from(
+                '{0}{1}I'.format(self.byte_order, count), self.data, pos)
+        except struct.error:
+            raise GcovFormatError("unexpected end of file")
+
+    def counters(self, count):
+        """Read count 64-bit counters, each stored as low and high word."""
+        words = self.words(2 * count)
+        return [low | (high << 32)
+                for low, high in zip(words[::2], words[1::2])]
+
+    def string(self):
+        length = self.unsigned() * self.unit
+        if not length:
+            return None
+        data = self.data[self.pos:self.pos + length]
+        if len(data) < length:
+            raise GcovFormatError("unexpected end of file")
+        self.pos += length
+        # The same file names come up in every block
+        string = self.strings.get(data)
+        if string is None:
+            string = self.strings[data] = \
+                data.split(b'\0', 1)[0].decode('utf-8', 'replace')
+        return string
+
+    def records(self):
+        """Yield the tag and the length (in bytes) of every record.
+
+        The caller reads the record; the reader then skips its rest.
+        """
+        header = struct.Struct(self.byte_order + 'II')
+        while self.pos + 8 <= len(self.data):
+            tag, length = header.unpack_from(self.data, self.pos)
+            self.pos += 8
+            if self.unit == 1 and length >= 1 << 31:
+                # GCC 12 writes all-zero counters without data,
+                # and with a negative length
+                length -= 1 << 32
+            end = self.pos + max(length, 0) * self.unit
+            yield tag, length * self.unit
+            if self.pos > end:
+                raise GcovFormatError("corrupt record {0:#x}".format(tag))
+            self.pos = end
+
+
+class Arc(object):
+    __slots__ = (
+        'src', 'dst', 'on_tree', 'fake', 'fall_through', 'count',
+        'is_call_non_return', 'is_unconditional')
+
+    def __init__(self, src, dst, flags):
+        self.src = src
+        self.dst = dst
+        self.on_tree = bool(flags & ARC_ON_TREE)
+        self.fake = bool(flags & ARC_FAKE)
+        self.fall_through = bool(flags & ARC_FALLTHROUGH)
+        self.count = None
+        self.is_call_non_return = False
+        self.is_unconditional = False
+
+
+class Block(object):
+    __slots__ = (
+        'index', 'succ', 'pred', 'locations', 'count', 'num_succ', 'num_pred')
+
+    def __init__(self, index):
+        self.index = index
+        self.succ = []
+        self.pred = []
+        self.locations = []  # (source, [line numbers])
+        self.count = None
+        # The number of arcs with an unknown count
+        self.num_succ = 0
+        self.num_pred = 0
+
+
+class Function(object):
+    def __init__(self, ident, lineno_checksum, cfg_checksum):
+        self.ident = ident
+        self.lineno_checksum = lineno_checksum
+        self.cfg_checksum = cfg_checksum
+        self.name = None
+        self.artificial = False
+        self.source = None
+        self.start_line = 0
+        self.start_column = 0
+        self.end_line = 0
+        self.blocks = []
+        self.counts = []
+        self.is_group = False
+
+    def is_group_line(self, source, lineno):
+        return self.is_group and source == self.source and \
+            self.start_line <= lineno <= self.end_line
+
+
+def read_notes(filename):
+    """Read the functions and flow graphs of a .gcno file.
+
+    Returns a dict with the version, stamp, cwd and functions.
+    """
+    with open(filename, 'rb') as stream:
+        reader = RecordReader(stream.read(), GCNO_MAGIC)
+
+    notes = dict(version=reader.version, stamp=reader.unsigned())
+    if reader.version >= (12,):
+        reader.unsigned()  # checksum
+    notes['cwd'] = reader.string()
+    if reader.version >= (9,):
+        reader.unsigned()  # supports has_unexecuted_blocks
+
+    functions = []
+    function = None
+    for tag, length in reader.records():
+        if tag == TAG_FUNCTION:
+            function = Function(
+                reader.unsigned(), reader.unsigned(), reader.unsigned())
+            function.name = reader.string()
+            function.artificial = bool(reader.unsigned())
+            function.source = reader.string()
+            function.start_line = reader.unsigned()
+            function.start_column = reader.unsigned()
+            function.end_line = reader.unsigned()
+            functions.append(function)
+        elif function is None:
+            continue
+        elif tag == TAG_BLOCKS:
+            function.blocks = [Block(i) for i in range(reader.unsigned())]
+        elif tag == TAG_ARCS:
+            words = reader.words(length // 4)
+            blocks = function.blocks
+            try:
+                src = blocks[words[0]]
+                for i in range(1, len(words) - 1, 2):
+                    arc = Arc(src, blocks[words[i]], words[i + 1])
+                    # A fake arc is an exceptional exit of a call,
+                    # unless it is a non-local return to the entry block
+                    arc.is_call_non_return = \
+                        arc.fake and src.index != ENTRY_BLOCK
+                    src.succ.append(arc)
+                    src.num_succ += 1
+                    arc.dst.pred.append(arc)
+                    arc.dst.num_pred += 1
+                    if not arc.on_tree:
+                        function.counts.append(0)
+            except IndexError:
+                raise GcovFormatError("arc of unknown block")
+        elif tag == TAG_LINES:
+            end = reader.pos + length
+            try:
+                block = function.blocks[reader.unsigned()]
+            except IndexError:
+                raise GcovFormatError("lines of unknown block")
+            # Every location is a 0, a source file name,
+            # and its line numbers; the last one has no name.
+            while reader.unsigned() == 0:
+                source = reader.string()
+                if source is None:
+                    break
+                start = reader.pos
+                linenos = reader.words((end - start) // 4)
+                if 0 not in linenos:
+                    raise GcovFormatError("unterminated lines")
+                linenos = linenos[:linenos.index(0)]
+                reader.pos = start + 4 * len(linenos)
+                block.locations.append((source, list(linenos)))
+            else:
+                raise GcovFormatError("line without a source file")
+
+    notes['functions'] = functions
+    return notes
+
+
+def read_counts(filename, notes):
+    """Add the arc counters of a .gcda file to the functions of its notes.
+
+    A missing .gcda file leaves all counts at zero, like gcov does.
+    """
+    try:
+        with open(filename, 'rb') as stream:
+            data = stream.read()
+    except (IOError, OSError):
+        return
+
+    reader = RecordReader(data, GCDA_MAGIC)
+    if reader.version != notes['version'] or \
+            reader.unsigned() != notes['stamp']:
+        raise GcovFormatError("stamp mismatch with notes file")
+    if reader.version >= (12,):
+        reader.unsigned()  # checksum
+
+    functions = dict((f.ident, f) for f in notes['functions'])
+    function = None
+    for tag, length in reader.records():
+        if tag == TAG_FUNCTION:
+            function = None
+            if length:
+                function = functions.get(reader.unsigned())
+                if function is not None and (
+                        reader.unsigned() != function.lineno_checksum or
+                        reader.unsigned() != function.cfg_checksum):
+                    raise GcovFormatError(
+                        "profile mismatch for {0}".format(function.name))
+        elif tag == TAG_COUNTER_ARCS and function is not None:
+            if abs(length) != 8 * len(function.counts):
+                raise GcovFormatError(
+                    "profile mismatch for {0}".format(function.name))
+            if length > 0:
+                function.counts = [
+                    count + counter for count, counter in zip(
+                        function.counts, reader.counters(length // 8))]
+
+
+def solve_flow_graph(function):
+    """Compute the count of every block and arc from the arc counters.
+
+    Like gcov, blocks whose arcs are all known get their count,
+    and blocks with a count and a single unknown arc
+    give the count of that arc, until everything is known.
+    """
+    blocks = function.blocks
+    if len(blocks) < 2:
+        raise GcovFormatError(
+            "{0} lacks entry and/or exit blocks".format(function.name))
+
+    counts = iter(function.counts)
+    for block in blocks:
+        for arc in block.succ:
+            if not arc.on_tree:
+                arc.count = next(counts)
+                block.num_succ -= 1
+                arc.dst.num_pred -= 1
+        non_fake = [arc for arc in block.succ if not arc.fake]
+        if len(non_fake) == 1:
+            non_fake[0].is_unconditional = True
+        # Branches are listed by destination block, like gcov does
+        block.succ.sort(key=lambda arc: arc.dst.index)
+
+    # The count of the entry block cannot be deduced from its
+    # (missing) predecessors, nor that of the exit block from its
+    # successors.
+    blocks[ENTRY_BLOCK].num_pred = float('inf')
+    blocks[EXIT_BLOCK].num_succ = float('inf')
+
+    invalid = [block for block in blocks if not block.num_succ or
+               not block.num_pred]
+    valid = []
+    while invalid or valid:
+        while invalid:
+            block = invalid.pop()
+            if block.count is not None:
+                continue
+            if block.num_succ == 0:
+                arcs = block.succ
+            elif block.num_pred == 0:
+                arcs = block.pred
+            else:
+                continue
+            block.count = sum(arc.count for arc in arcs)
+            valid.append(block)
+
+        while valid:
+            block = valid.pop()
+            if block.num_succ == 1:
+                arc = solve_arc(block, block.succ)
+                block.num_succ = 0
+                dst = arc.dst
+                dst.num_pred -= 1
+                if dst.count is None:
+                    if not dst.num_pred:
+                        invalid.append(dst)
+                elif dst.num_pred == 1:
+                    valid.append(dst)
+            if block.num_pred == 1:
+                arc = solve_arc(block, block.pred)
+                block.num_pred = 0
+                src = arc.src
+                src.num_succ -= 1
+                if src.count is None:
+                    if not src.num_succ:
+                        invalid.append(src)
+                elif src.num_succ == 1:
+                    valid.append(src)
+
+    for block in blocks:
+        if block.count is None:
+            raise GcovFormatError(
+                "graph of {0} is unsolvable".format(function.name))
+
+
+def solve_arc(block, arcs):
+    """Give the single unknown arc of a block the remaining count."""
+    total = block.count
+    unknown = None
+    for arc in arcs:
+        if arc.count is None:
+            unknown = arc
+        else:
+            total -= arc.count
+    unknown.count = total
+    return unknown
+
+
+class Line(object):
+    __slots__ = ('count', 'blocks', 'branches')
+
+    def __init__(self):
+        self.count = 0
+        self.blocks = []
+        self.branches = []
+
+
+def find_group_functions(functions):
+    """Mark the functions that share their start, e.g. templates."""
+    starts = dict()
+    for function in functions:
+        key = (function.source, function.start_line, function.start_column)
+        starts.setdefault(key, []).append(function)
+    for group in starts.values():
+        if len(group) > 1:
+            for function in group:
+                function.is_group = True
+
+
+def collect_lines(functions):
+    """Add up the block counts of every line.
+
+    Returns a list of (source, line number, Line),
+    with one entry per line and group function.
+    """
+    lines = dict()
+    for function in functions:
+        function_lines = dict()
+        for block in function.blocks:
+            line = None
+            for source, linenos in block.locations:
+                # gcov handles the lines of a location in sorted order
+                for lineno in sorted(linenos):
+                    if function.is_group_line(source, lineno):
+                        table = function_lines
+                    else:
+                        table = lines
+                    line = table.get((source, lineno))
+                    if line is None:
+                        line = table[source, lineno] = Line()
+                    line.count += block.count
+                # The last line of every location owns the block
+                # and its arcs, e.g. in the caller and in an inlined callee.
+                # Like gcov, skip the entry block and the last block,
+                # which gcov takes for the exit block.  At -O2 the last
+                # block can be the return of the function, with a line.
+                last_block = len(function.blocks) - 1
+                if line is not None and \
+                        block.index not in (ENTRY_BLOCK, last_block):
+                    line.blocks.append(block)
+                    line.branches.extend(block.succ)
+        for (source, lineno), line in function_lines.items():
+            yield source, lineno, line
+    for (source, lineno), line in lines.items():
+        yield source, lineno, line
+
+
+def count_line(line):
+    """Count how often a line was executed.
+
+    This is how often its blocks were entered from other lines,
+    plus the number of times a loop within the line was run.
+    """
+    if not line.blocks:
+        return line.count
+    blocks = set(line.blocks)
+    count = 0
+    cycle_counts = dict()
+    has_loops = False
+    for block in line.blocks:
+        for arc in block.pred:
+            if arc.src not in blocks:
+                count += arc.count
+        for arc in block.succ:
+            cycle_counts[arc] = arc.count
+            if arc.dst in blocks:
+                has_loops = True
+    if not has_loops:
+        return count
+    return count + count_cycles(line.blocks, blocks, cycle_counts)
+
+
+def count_cycles(line_blocks, blocks, cycle_counts):
+    """Count the loops through the blocks of a line.
+
+    This is the circuit search of Johnson's algorithm, as used by gcov:
+    every elementary cycle adds its smallest arc count,
+    which is then taken away from all of its arcs.
+    """
+    total = [0]
+
+    def arcs_within(block, start):
+        return [
+            arc for arc in block.succ
+            if arc.dst.index >= start.index and cycle_counts[arc] > 0 and
+            arc.dst in blocks]
+
+    def unblock(block, blocked, block_lists):
+        if block not in blocked:
+            return
+        index = blocked.index(block)
+        del blocked[index]
+        for other in block_lists.pop(index):
+            unblock(other, blocked, block_lists)
+
+    def circuit(block, path, start, blocked, block_lists):
+        loop = False
+        blocked.append(block)
+        block_lists.append([])
+        for arc in arcs_within(block, start):
+            path.append(arc)
+            if arc.dst is start:
+                cycle_count = min(cycle_counts[a] for a in path)
+                total[0] += cycle_count
+                for a in path:
+                    cycle_counts[a] -= cycle_count
+                loop = True
+            elif arc.dst not in blocked:
+                loop = circuit(arc.dst, path, start, blocked,
+                               block_lists) or loop
+            path.pop()
+
+        if loop:
+            unblock(block, blocked, block_lists)
+        else:
+            for arc in arcs_within(block, start):
+                waiting = block_lists[blocked.index(arc.dst)]
+                if block not in waiting:
+                    waiting.append(block)
+        return loop
+
+    for block in line_blocks:
+        circuit(block, [], block, [], [])
+    return total[0]
+
+
+def read_coverage(filename):
+    """Read the coverage of a .gcda (or .gcno) file like gcov does.
+
+    Returns a document in the JSON intermediate format of gcov,
+    with the line records that gcovr uses.
+    Raises GcovFormatError if the files need gcov.
+    """
+    try:
+        return analyze_coverage(filename)
+    except GcovFormatError:
+        raise
+    except (IndexError, KeyError, ValueError, struct.error) as e:
+        # A graph this reader does not understand, let gcov count it
+        raise GcovFormatError("cannot follow the flow graph: {0!r}".format(e))
+
+
+def analyze_coverage(filename):
+    stem = os.path.splitext(filename)[0]
+    try:
+        notes = read_notes(stem + '.gcno')
+    except (IOError, OSError) as e:
+        raise GcovFormatError("cannot open notes file: {0}".format(e))
+    read_counts(stem + '.gcda', notes)
+
+    functions = [f for f in notes['functions'] if not f.artificial]
+    find_group_functions(functions)
+    for function in functions:
+        solve_flow_graph(function)
+
+    # Like gcov, list every source file, even without lines
+    files = dict()
+    for function in notes['functions']:
+        files.setdefault(function.source, [])
+        for block in function.blocks:
+            for source, _ in block.locations:
+                files.setdefault(source, [])
+
+    for source, lineno, line in collect_lines(functions):
+        files.setdefault(source, []).append(dict(
+            line_number=lineno,
+            count=count_line(line),
+            branches=[
+                dict(count=arc.count) for arc in line.branches
+                if not arc.is_unconditional and not arc.is_call_non_return]))
+
+    return dict(
+        current_working_directory=notes['cwd'],
+        data_file=filename,
+        files=[
+            dict(file=source, lines=sorted(
+                records, key=lambda record: record['line_number']))
+            for source, records in sorted(files.items())])
@@ -6,23 +6,38 @@
 # Copyright 2013 Sandia Corporation
 # This software is distributed under the BSD license.
 
+import io
+import json
+import locale
 import os
 import re
 import subprocess
 import sys
+import tempfile
 
 from os.path import normpath
 
-from .utils import aliases, search_file, Logger
-from .workers import locked_directory
-from .coverage import CoverageData
+from .utils import aliases, read_directory, search_file, Logger
+from .workers import locked_directory, Prefetcher
+from .cache import hash_file
+from .gcno import (
+    find_gcc_working_directory, read_gcno_header, read_coverage,
+    GcovFormatError)
+from .coverage import CoverageData, merge_covdata, update_counters
 
 output_re = re.compile("[Cc]reating [`'](.*)'$")
+long_file_name_re = re.compile(r"^.*\.gc(da|no)##")
+gcov_version_re = re.compile(r"^gcov\S* .*?(\d+(?:\.\d+)+)(?: .*)?$")
 source_re = re.compile("[Cc]annot open (source|graph) file")
+output_error_re = re.compile("[Cc](ould|annot) not open output file")
 
 exclude_line_flag = "_EXCL_"
+exclude_line_flag_bytes = b"_EXCL_"
 exclude_line_pattern = re.compile('([GL]COVR?)_EXCL_(LINE|START|STOP)')
 
+# Read buffer for gcov files, which can be many megabytes for headers
+GCOV_BUFFER_SIZE = 1 << 20
+
 c_style_comment_pattern = re.compile('/\*.*?\*/')
 cpp_style_comment_pattern = re.compile('//.*?$')
 
@@ -31,66 +46,210 @@ cpp_style_comment_pattern = re.compile('//.*?$')
 # Get the list of datafiles in the directories specified by the user
 #
 def get_datafiles(flist, options):
+    """Find the files to process in the search paths.
+
+    The files are yielded while the directories are searched,
+    so that they can be processed in the meantime.
+    With --search-parallel, the directories are read in threads,
+    starting with all search paths, but the files are still
+    found in the same order.
+    """
     logger = Logger(options.verbose)
 
+    prefetcher = None
+    if options.search_parallel > 1:
+        prefetcher = Prefetcher(read_directory, options.search_parallel)
+        for dir_ in flist:
+            if os.path.isdir(dir_):
+                prefetcher.prefetch(os.path.realpath(dir_))
+
     allfiles = set()
-    for dir_ in flist:
-        if options.gcov_files:
-            logger.verbose_msg(
-                "Scanning directory {0} for gcov files...", dir_)
-            files = search_file(
-                ".*\.gcov$", dir_, exclude_dirs=options.exclude_dirs)
-            gcov_files = [file for file in files if file.endswith('gcov')]
+    try:
+        for dir_ in flist:
+            if options.gcov_files:
+                logger.verbose_msg(
+                    "Scanning directory {0} for gcov files...", dir_)
+                files = CountingIterator(search_file(
+                    ".*\.gcov$", dir_, exclude_dirs=options.exclude_dirs,
+                    prefetcher=prefetcher))
+                selected_files = files
+            else:
+                logger.verbose_msg(
+                    "Scanning directory {0} for gcda/gcno files...", dir_)
+                files = CountingIterator(search_file(
+                    ".*\.gc(da|no)$", dir_, exclude_dirs=options.exclude_dirs,
+                    prefetcher=prefetcher))
+                selected_files = select_datafiles(files)
+
+            processed = 0
+            for filename in selected_files:
+                if filename not in allfiles:
+                    allfiles.add(filename)
+                    processed += 1
+                    yield filename
+
             logger.verbose_msg(
                 "Found {0} files (and will process {1})",
-                len(files), len(gcov_files))
-            allfiles.update(gcov_files)
+                files.count, processed)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+def get_listed_datafiles(filenames, options):
+    """Find the listed files to process, without a search.
+
+    For -g, the listed gcov files are taken as they are.
+    Otherwise, every listed name stands for the .gcda file that shares
+    its name without extension (e.g. an object file), or else for its
+    .gcno file, so that compilation units that never ran are reported
+    as uncovered.  Only these files are looked up.
+    """
+    logger = Logger(options.verbose)
+
+    allfiles = set()
+    for filename in filenames:
+        filename = os.path.abspath(filename)
+        if options.gcov_files:
+            candidates = [filename]
         else:
-            logger.verbose_msg(
-                "Scanning directory {0} for gcda/gcno files...", dir_)
-            files = search_file(
-                ".*\.gc(da|no)$", dir_, exclude_dirs=options.exclude_dirs)
-            # gcno files will *only* produce uncovered results; however,
-            # that is useful information for the case where a compilation
-            # unit is never actually exercised by the test code.  So, we
-            # will process gcno files, but ONLY if there is no corresponding
-            # gcda file.
-            gcda_files = [
-                filenm for filenm in files if filenm.endswith('gcda')
-            ]
-            tmp = set(gcda_files)
-            gcno_files = [
-                filenm for filenm in files if
-                filenm.endswith('gcno') and filenm[:-2] + 'da' not in tmp
-            ]
-            logger.verbose_msg(
-                "Found {0} files (and will process {1})",
-                len(files), len(gcda_files) + len(gcno_files))
-            allfiles.update(gcda_files)
-            allfiles.update(gcno_files)
-    return allfiles
+            stem = os.path.splitext(filename)[0]
+            candidates = [stem + '.gcda', stem + '.gcno']
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                if candidate not in allfiles:
+                    allfiles.add(candidate)
+                    yield candidate
+                break
+        else:
+            logger.verbose_msg("Listed file not found: {0}", filename)
+
+    logger.verbose_msg(
+        "Listed {0} files (and will process {1})",
+        len(filenames), len(allfiles))
+
+
+class CountingIterator(object):
+    """Count the items of an iterator while they are taken."""
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.iterator)
+        self.count += 1
+        return item
+
+    next = __next__  # Python 2
+
+
+def select_datafiles(files):
+    """Select the gcda files, and the gcno files without gcda file.
+
+    gcno files will *only* produce uncovered results; however,
+    that is useful information for the case where a compilation
+    unit is never actually exercised by the test code.  So, we
+    will process gcno files, but ONLY if there is no corresponding
+    gcda file.  As a directory is searched at once, its gcno files
+    are held back until the search has left the directory.
+    """
+    gcda_files = set()
+    gcno_files = []
+    current_dir = None
+    for filename in files:
+        dirname = os.path.dirname(filename)
+        if dirname != current_dir:
+            for gcno_file in gcno_files:
+                if gcno_file[:-2] + 'da' not in gcda_files:
+                    yield gcno_file
+            gcno_files = []
+            current_dir = dirname
+
+        if filename.endswith('gcda'):
+            gcda_files.add(filename)
+            yield filename
+        else:
+            gcno_files.append(filename)
+
+    for gcno_file in gcno_files:
+        if gcno_file[:-2] + 'da' not in gcda_files:
+            yield gcno_file
 
 
 noncode_mapper = dict.fromkeys(ord(i) for i in '}{')
 
+if sys.version_info < (3, 0):
+    def strip_braces(code):
+        return code.translate(None, '}{')
+
+    def decode_text(text):
+        return text
+else:
+    def strip_braces(code):
+        return code.translate(noncode_mapper)
+
+    def decode_text(text):
+        """Decode bytes of a gcov file, like a file opened in text mode."""
+        if isinstance(text, bytes):
+            return text.decode(locale.getpreferredencoding(False), 'replace')
+        return text
+
+# Bytes that might be whitespace once decoded,
+# and that bytes.strip() does not strip
+unicode_space_bytes = frozenset(
+    bytes(bytearray([i]))
+    for i in list(range(0x1c, 0x20)) + list(range(0x80, 0x100)))
+
 
 def is_non_code(code):
-    if sys.version_info < (3, 0):
-        code = code.strip().translate(None, '}{')
-    else:
-        code = code.strip().translate(noncode_mapper)
+    code = strip_braces(code.strip())
     return len(code) == 0 or code.startswith("//") or code == 'else'
 
 
+def is_non_code_bytes(code):
+    """Like is_non_code, for source code that was not decoded."""
+    code = code.strip()
+    if code[:1] in unicode_space_bytes or code[-1:] in unicode_space_bytes:
+        return is_non_code(decode_text(code))
+    code = code.translate(None, b'}{')
+    return len(code) == 0 or code.startswith(b"//") or code == b'else'
+
+
+def is_compiler_generated(code):
+    """Check whether a line holds only braces and comments,
+    so that its branches cannot be reached by user code."""
+    code = cpp_style_comment_pattern.sub('', code)
+    code = c_style_comment_pattern.sub('', code)
+    code = code.strip()
+    return code in ['', '{', '}'] or code.replace(' ', '') == '{}'
+
+
 #
 # Process a single gcov datafile
 #
 def process_gcov_data(data_fname, covdata, source_fname, options, currdir=None):
+    # The lines are read as bytes, in large chunks,
+    # and the parser only decodes the source code it needs
+    with open(data_fname, "rb", GCOV_BUFFER_SIZE) as INPUT:
+        # Find the source file
+        firstline = decode_text(INPUT.readline())
+        process_gcov_lines(
+            firstline, INPUT, data_fname, covdata, source_fname, options,
+            currdir=currdir, binary=True)
+
+
+#
+# Process the lines of a single gcov report, starting with its "Source:" line
+#
+def process_gcov_lines(
+        firstline, lines, data_fname, covdata, source_fname, options,
+        currdir=None, binary=False):
     logger = Logger(options.verbose)
-    INPUT = open(data_fname, "r")
 
-    # Find the source file
-    firstline = INPUT.readline()
     fname = guess_source_file_name(
         firstline, data_fname, source_fname,
         root_dir=options.root_dir, starting_dir=options.starting_dir,
@@ -98,6 +257,20 @@ def process_gcov_data(data_fname, covdata, source_fname, options, currdir=None):
 
     logger.verbose_msg("Parsing coverage data for file {0}", fname)
 
+    if is_filtered_source_file(fname, options, logger):
+        return
+
+    parser = GcovParser(fname, logger=logger)
+    parser.parse_all_lines(
+        lines,
+        exclude_unreachable_branches=options.exclude_unreachable_branches,
+        ignore_parse_errors=options.gcov_ignore_parse_errors,
+        binary=binary)
+    parser.update_coverage(covdata)
+
+
+def is_filtered_source_file(fname, options, logger):
+    """Check whether a source file is excluded from the report."""
     # Return if the filename does not match the filter
     # Return if the filename matches the exclude pattern
     filtered, excluded = apply_filter_include_exclude(
@@ -105,20 +278,49 @@ def process_gcov_data(data_fname, covdata, source_fname, options, currdir=None):
 
     if filtered:
         logger.verbose_msg("  Filtering coverage data for file {0}", fname)
-        return
+        return True
 
     if excluded:
         logger.verbose_msg("  Excluding coverage data for file {0}", fname)
-        return
+        return True
 
-    parser = GcovParser(fname, logger=logger)
-    parser.parse_all_lines(
-        INPUT,
-        exclude_unreachable_branches=options.exclude_unreachable_branches,
-        ignore_parse_errors=options.gcov_ignore_parse_errors)
-    parser.update_coverage(covdata)
+    return False
 
-    INPUT.close()
+
+def is_source_line(line):
+    """Check for the "-:    0:Source:file.cpp" line that starts a report."""
+    if ':Source:' not in line:
+        return False
+    segments = line.split(':', 3)
+    return len(segments) == 4 and segments[1].strip() == '0' and \
+        segments[2] == 'Source'
+
+
+def split_gcov_sections(lines):
+    """Split concatenated gcov reports, e.g. from "gcov --stdout".
+
+    Yields a (source_line, section) tuple for every report,
+    where section lazily iterates over the lines of that report.
+    Each section must be consumed before the next one is requested;
+    unconsumed lines are skipped.
+    """
+    lines = iter(lines)
+    pending = [next(lines, None)]
+
+    def section():
+        for line in lines:
+            if is_source_line(line):
+                pending[0] = line
+                return
+            yield line
+
+    while pending[0] is not None:
+        source_line = pending[0]
+        pending[0] = None
+        lines_of_section = section()
+        yield source_line, lines_of_section
+        for _ in lines_of_section:
+            pass
 
 
 def guess_source_file_name(
@@ -183,17 +385,17 @@ def guess_source_file_name_heuristics(
     gcovname = gcovname.replace('/', os.sep)
 
     # 0. Try using the current working directory as the source directory
-    fname = os.path.join(currdir, gcovname)
+    fname = normpath(os.path.join(currdir, gcovname))
     if os.path.exists(fname):
         return fname
 
     # 1. Try using the path to common prefix with the root_dir as the source directory
-    fname = os.path.join(root_dir, gcovname)
+    fname = normpath(os.path.join(root_dir, gcovname))
     if os.path.exists(fname):
         return fname
 
     # 2. Try using the starting directory as the source directory
-    fname = os.path.join(starting_dir, gcovname)
+    fname = normpath(os.path.join(starting_dir, gcovname))
     if os.path.exists(fname):
         return fname
 
@@ -204,6 +406,16 @@ def guess_source_file_name_heuristics(
 
 
 class GcovParser(object):
+    """Collects the coverage of one source file
+    from a gcov text report or from gcov JSON records.
+
+    The text parser makes a single pass over the lines,
+    and classifies each line by its first character.
+    Lines can also be bytes, which are only decoded where needed.
+    Its target throughput is one million lines per second
+    on one core, as measured by admin/benchmark_gcov_parser.py.
+    """
+
     def __init__(self, fname, logger):
         self.logger = logger
         self.excluding = []
@@ -218,42 +430,215 @@ class GcovParser(object):
         self.last_code_line = ""
         self.last_code_lineno = 0
         self.last_code_line_excluded = False
+        # is_compiler_generated(last_code_line),
+        # computed for the first branch of the line
+        self.last_code_line_compiler_generated = None
         self.unrecognized_lines = []
         self.deferred_exceptions = []
         self.last_was_specialization_section_marker = False
 
-    def parse_all_lines(self, lines, exclude_unreachable_branches, ignore_parse_errors):
-        for line in lines:
+    def parse_all_lines(
+            self, lines, exclude_unreachable_branches, ignore_parse_errors,
+            binary=False):
+        parse_line = self.parse_bytes_line if binary else self.parse_line
+        lines = iter(lines)
+        line = None
+        while True:
+            # The loop is only restarted after a line failed,
+            # so that valid lines do not pay for the error handling
             try:
-                self.parse_line(line, exclude_unreachable_branches)
+                for line in lines:
+                    parse_line(line, exclude_unreachable_branches)
+                break
             except Exception as ex:
-                self.unrecognized_lines.append(line)
+                self.unrecognized_lines.append(decode_text(line))
                 self.deferred_exceptions.append(ex)
 
         self.check_unclosed_exclusions()
         self.check_unrecognized_lines(ignore_parse_errors=ignore_parse_errors)
 
+    def parse_json_lines(self, records, source_lines, exclude_unreachable_branches):
+        """Process the "lines" records of the gcov JSON intermediate format.
+
+        The records only hold executable lines,
+        so the source code is needed for exclusion markers
+        and to recognize non-code lines.
+        Template and inline functions have one record per instance;
+        their counts are added up, like the count that gcov prints
+        on the line itself.  (The text parser keeps the counts
+        of the last instance section instead.)
+        The branches of a line are numbered in order.  Unlike
+        the text format, this numbering cannot include calls,
+        which the JSON format does not list.
+
+        records: the "lines" of a "files" entry
+        source_lines: the lines of the source file, may be empty
+        """
+        counts = dict()
+        branches = dict()
+        for record in records:
+            lineno = record['line_number']
+            counts[lineno] = counts.get(lineno, 0) + record['count']
+            if record['branches']:
+                update_counters(branches.setdefault(lineno, {}), dict(
+                    (branch_index, branch['count'])
+                    for branch_index, branch in enumerate(record['branches'])))
+
+        last_lineno = max([len(source_lines)] + list(counts.keys()))
+        for lineno in range(1, last_lineno + 1):
+            self.lineno = lineno
+
+            if lineno <= len(source_lines):
+                code = source_lines[lineno - 1]
+            else:
+                code = "/*EOF*/"  # the placeholder used by gcov
+
+            if lineno not in counts:
+                status = "-"
+            elif counts[lineno] == 0:
+                status = "#####"
+            else:
+                status = str(counts[lineno])
+
+            self.parse_source_line(status, code)
+
+            for branch_index, count in sorted(branches.get(lineno, {}).items()):
+                if not self.is_excluded_branch(exclude_unreachable_branches):
+                    self.branches.setdefault(lineno, {})[branch_index] = count
+
+        self.check_unclosed_exclusions()
+
     def parse_line(self, line, exclude_unreachable_branches):
-        # If this is a tag line, we stay on the same line number
-        # and can return immediately after processing it.
-        # A tag line cannot hold exclusion markers.
-        if self.parse_tag_line(line, exclude_unreachable_branches):
+        firstchar = line[:1]
+
+        # Start or end a template/macro specialization section.
+        # A marker is followed either by the name of a specialization
+        # (e.g. "Foo<int>::Foo():") or by the line after the section,
+        # and that line is skipped.
+        if firstchar == '-' and line.startswith('-----'):
+            self.last_was_specialization_section_marker = True
+            return
+        if self.last_was_specialization_section_marker:
+            self.last_was_specialization_section_marker = False
             return
 
-        # If this isn't a tag line, this is metadata or source code.
+        # Tag lines stay on the same line number,
+        # and cannot hold exclusion markers.
+        # e.g.  "branch  0 taken 1 (fallthrough)"
+        if firstchar == 'b':
+            if line.startswith('branch '):
+                self.parse_branch_line(line, exclude_unreachable_branches)
+                return
+        elif firstchar == 'f':
+            if line.startswith('function '):
+                return
+        elif firstchar == 'c':
+            if line.startswith('call '):
+                return
+
+        # Otherwise, this is metadata or source code.
         # e.g.  "  -:  0:Data:foo.gcda" (metadata)
         # or    "  3:  7:  c += 1"      (source code)
-
         segments = line.split(":", 2)
         if len(segments) > 1:
-            try:
-                self.lineno = int(segments[1].strip())
-            except ValueError:
-                pass  # keep previous line number!
+            lineno = segments[1].strip()
+            if lineno.isdigit():
+                self.lineno = int(lineno)
+            # else keep previous line number!
+        code = segments[2] if len(segments) == 3 else ""
+
+        if not self.parse_source_line(segments[0].strip(), code):
+            self.unrecognized_lines.append(line)
+
+    def parse_bytes_line(self, line, exclude_unreachable_branches):
+        """Like parse_line, for a line that was not decoded.
+
+        Only the source code with exclusion markers is decoded here;
+        the last code line is decoded if its branches need it.
+        """
+        firstchar = line[:1]
+
+        if firstchar == b'-' and line.startswith(b'-----'):
+            self.last_was_specialization_section_marker = True
+            return
+        if self.last_was_specialization_section_marker:
+            self.last_was_specialization_section_marker = False
+            return
+
+        if firstchar == b'b':
+            if line.startswith(b'branch '):
+                self.parse_branch_line(line, exclude_unreachable_branches)
+                return
+        elif firstchar == b'f':
+            if line.startswith(b'function '):
+                return
+        elif firstchar == b'c':
+            if line.startswith(b'call '):
+                return
+
+        segments = line.split(b":", 2)
+        if len(segments) > 1:
+            lineno = segments[1].strip()
+            if lineno.isdigit():
+                self.lineno = int(lineno)
+        code = segments[2] if len(segments) == 3 else b""
+        status = segments[0].strip()
+        firstchar = status[:1]
+
+        if self.excluding or not firstchar or exclude_line_flag_bytes in code:
+            # Exclusions and errors are handled on the decoded text
+            is_code_statement = self.parse_source_line(
+                status.decode('latin-1'), decode_text(code))
+        else:
+            # The same as parse_code_line, without exclusions
+            is_code_statement = True
+            if firstchar == b'-':
+                if is_non_code_bytes(code):
+                    self.noncode.add(self.lineno)
+            elif firstchar in b'0123456789':
+                self.covered[self.lineno] = int(status.rstrip(b'*'))
+            elif firstchar == b'#':
+                if is_non_code_bytes(code):
+                    self.noncode.add(self.lineno)
+                else:
+                    self.uncovered.add(self.lineno)
+            elif firstchar == b'=':
+                self.uncovered_exceptional.add(self.lineno)
+            else:
+                is_code_statement = False
+
+            if is_code_statement:
+                self.last_code_line = code
+                self.last_code_lineno = self.lineno
+                self.last_code_line_excluded = False
+                self.last_code_line_compiler_generated = None
+
+        if not is_code_statement:
+            self.unrecognized_lines.append(decode_text(line))
+
+    def parse_branch_line(self, line, exclude_unreachable_branches):
+        if self.is_excluded_branch(exclude_unreachable_branches):
+            return
+
+        fields = line.split()  # e.g. "branch  0 taken 0% (fallthrough)"
+        branch_index = int(fields[1])
+        if len(fields) > 3 and fields[3].isdigit():
+            count = int(fields[3])
+        else:
+            count = 0  # e.g. "branch  1 never executed"
+        self.branches.setdefault(self.lineno, {})[branch_index] = count
 
-        if exclude_line_flag in line:
+    def parse_source_line(self, status, code):
+        """Process the status and source code of the current line.
+
+        Handles exclusion markers in the code, and remembers the line
+        for the unreachable branch heuristics.
+
+        returns: True if the status was recognized.
+        """
+        if exclude_line_flag in code:
             excl_line = False
-            for header, flag in exclude_line_pattern.findall(line):
+            for header, flag in exclude_line_pattern.findall(code):
                 if self.parse_exclusion_marker(header, flag):
                     excl_line = True
 
@@ -266,23 +651,21 @@ class GcovParser(object):
             if excl_line:
                 self.excluding.append(False)
 
-        status = segments[0].strip()
-        code = segments[2] if 2 < len(segments) else ""
         is_code_statement = self.parse_code_line(status, code)
 
-        if not is_code_statement:
-            self.unrecognized_lines.append(line)
-
         # save the code line to use it later with branches
         if is_code_statement:
-            self.last_code_line = "".join(segments[2:])
+            self.last_code_line = code
             self.last_code_lineno = self.lineno
             self.last_code_line_excluded = bool(self.excluding)
+            self.last_code_line_compiler_generated = None
 
         # clear the excluding flag for single-line excludes
         if self.excluding and not self.excluding[-1]:
             self.excluding.pop()
 
+        return is_code_statement
+
     def parse_code_line(self, status, code):
         firstchar = status[0]
 
@@ -311,78 +694,28 @@ class GcovParser(object):
 
         return False
 
-    def parse_tag_line(self, line, exclude_unreachable_branches):
-        # Start or end a template/macro specialization section
-        if line.startswith('-----'):
-            self.last_was_specialization_section_marker = True
-            return True
-
-        last_was_marker = self.last_was_specialization_section_marker
-        self.last_was_specialization_section_marker = False
-
-        # A specialization section marker is either followed by a section or
-        # ends it. If it starts a section, the next line contains a function
-        # name, followed by a colon. A function name cannot be parsed reliably,
-        # so we assume it is a function, and try to disprove this assumption by
-        # comparing with other kinds of lines.
-        if last_was_marker:
-            # 1. a function must end with a colon
-            is_function = line.endswith(':')
-
-            # 2. a function cannot start with space
-            if is_function:
-                is_function = not line.startswith(' ')
-
-            # 3. a function cannot start with a tag
-            if is_function:
-                tags = 'function call branch'.split()
-                is_function = not any(
-                    line.startswith(tag + ' ') for tag in tags)
-
-            # If this line turned out to be a function, discard it.
-            return True
-
-        if line.startswith('function '):
-            return True
-
-        if line.startswith('call '):
-            return True
+    def is_excluded_branch(self, exclude_unreachable_branches):
+        """Check whether a branch on the current line should be ignored."""
+        if not exclude_unreachable_branches or \
+                self.lineno != self.last_code_lineno:
+            return False
 
-        if line.startswith('branch '):
-            exclude_branch = False
-            if exclude_unreachable_branches and \
-                    self.lineno == self.last_code_lineno:
-                if self.last_code_line_excluded:
-                    exclude_branch = True
-                    exclude_reason = "marked with exclude pattern"
-                else:
-                    code = self.last_code_line
-                    code = re.sub(cpp_style_comment_pattern, '', code)
-                    code = re.sub(c_style_comment_pattern, '', code)
-                    code = code.strip()
-                    code_nospace = code.replace(' ', '')
-                    exclude_branch = \
-                        code in ['', '{', '}'] or code_nospace == '{}'
-                    exclude_reason = "detected as compiler-generated code"
-
-            if exclude_branch:
-                self.logger.verbose_msg(
-                    "Excluding unreachable branch on line {line} "
-                    "in file {fname}: {reason}",
-                    line=self.lineno, fname=self.fname,
-                    reason=exclude_reason)
-                return True
-
-            fields = line.split()  # e.g. "branch  0 taken 0% (fallthrough)"
-            branch_index = int(fields[1])
-            try:
-                count = int(fields[3])
-            except (ValueError, IndexError):
-                count = 0
-            self.branches.setdefault(self.lineno, {})[branch_index] = count
-            return True
+        if self.last_code_line_excluded:
+            exclude_reason = "marked with exclude pattern"
+        else:
+            if self.last_code_line_compiler_generated is None:
+                self.last_code_line_compiler_generated = \
+                    is_compiler_generated(decode_text(self.last_code_line))
+            if not self.last_code_line_compiler_generated:
+                return False
+            exclude_reason = "detected as compiler-generated code"
 
-        return False
+        self.logger.verbose_msg(
+            "Excluding unreachable branch on line {line} "
+            "in file {fname}: {reason}",
+            line=self.lineno, fname=self.fname,
+            reason=exclude_reason)
+        return True
 
     def parse_exclusion_marker(self, header, flag):
         """Process the exclusion marker
@@ -512,7 +845,9 @@ class GcovParser(object):
 # identifying the original gcc working directory (there is a bit of
 # trial-and-error here)
 #
-def process_datafile(filename, covdata, options, toerase, workdir):
+def process_datafile(
+        filename, covdata, options, toerase, workdir, stats, wd_cache,
+        cache=None):
     logger = Logger(options.verbose)
 
     logger.verbose_msg("Processing file: {0}", filename)
@@ -520,8 +855,489 @@ def process_datafile(filename, covdata, options, toerase, workdir):
     abs_filename = os.path.abspath(filename)
     dirname, fname = os.path.split(abs_filename)
 
+    if cache is not None:
+        key = datafile_cache_key(cache, abs_filename)
+        if load_cached_coverage(cache, key, covdata, stats):
+            if options.delete and not abs_filename.endswith('gcno'):
+                toerase.add(abs_filename)
+            return
+        # Keep the coverage of this data file apart, to store it
+        file_covdata = dict()
+    else:
+        file_covdata = covdata
+
+    errors = []
+
+    potential_wd = find_potential_working_directories(
+        abs_filename, options, workdir=workdir, errors=errors)
+
+    # Start with the directory where gcc was run, if it is known,
+    # and with the working directory that worked for the last data file
+    # of this directory, if any.
+    cached_wd = wd_cache.lookup(dirname, workdir)
+    potential_wd = prefer_working_directories(
+        potential_wd,
+        find_gcc_working_directory(abs_filename, options.compile_directories),
+        cached_wd)
+
+    update_counters(stats, {'datafiles': 1})
+
+    # Iterate from the end of the potential_wd list, which is the root
+    # directory
+
+    #
+    # @latk - 2018: not true, this iterates from the start of the list.
+    # Is that a bug?
+    done = False
+    for dir_ in potential_wd:
+        # NB: either len(potential_wd) == 1, or all entires are absolute
+        # paths, so we don't have to chdir(starting_dir) at every
+        # iteration.
+
+        done = run_gcov_and_process_files(
+            [abs_filename], dirname, file_covdata,
+            options=options, logger=logger, toerase=toerase, errors=errors,
+            chdir=dir_, tempdir=workdir, stats=stats)
+
+        if done:
+            break
+
+    if options.delete:
+        if not abs_filename.endswith('gcno'):
+            toerase.add(abs_filename)
+
+    update_wd_cache(wd_cache, dirname, cached_wd, done and dir_, workdir, stats)
+
+    if cache is not None:
+        if done:
+            store_cached_coverage(cache, key, file_covdata)
+        merge_covdata(covdata, file_covdata)
+
+    if not done:
+        logger.warn(
+            "GCOV produced the following errors processing {filename}:\n"
+            "\t{errors}\n"
+            "\t(gcovr could not infer a working directory that resolved it.)",
+            filename=filename, errors="\n\t".join(errors))
+
+
+def update_wd_cache(wd_cache, dirname, cached_wd, found_wd, workdir, stats):
+    """Remember the working directory that worked, and count cache hits."""
+    if found_wd:
+        wd_cache.store(dirname, found_wd, workdir)
+    if cached_wd is not None and found_wd == cached_wd:
+        update_counters(stats, {'wd_cache_hits': 1})
+    else:
+        update_counters(stats, {'wd_cache_misses': 1})
+
+
+def datafile_cache_key(cache, abs_filename):
+    """Build the cache key of a data file.
+
+    The key covers the contents of the .gcda file
+    and the stamp of its .gcno file, which changes with every compilation.
+    The source files are only known once the data file is processed,
+    so their hashes are kept in the entry and checked by
+    load_cached_coverage().
+    """
+    stem = os.path.splitext(abs_filename)[0]
+    header = read_gcno_header(stem + '.gcno')
+    if header is not None:
+        gcno = header['stamp']
+    else:
+        gcno = hash_file(stem + '.gcno')
+    return cache.key('datafile', abs_filename, hash_file(stem + '.gcda'), gcno)
+
+
+def store_cached_coverage(cache, key, file_covdata):
+    """Cache the coverage of a data file with the hashes of its sources.
+
+    The exclusion markers come from the source files, which can change
+    without changing the data file, e.g. in reproducible builds.
+    """
+    sources = dict(
+        (fname, hash_file(fname)) for fname in file_covdata)
+    cache.store(key, [
+        sources, [cov.__getstate__() for cov in file_covdata.values()]])
+
+
+def load_cached_coverage(cache, key, covdata, stats):
+    """Merge the cached coverage for the key into covdata, if any,
+    and if its source files did not change."""
+    cached = cache.load(key)
+    if cached is not None:
+        try:
+            sources, states = cached
+            cached = dict()
+            for state in states:
+                cov = CoverageData.from_state(state)
+                cached[cov.fname] = cov
+        except (TypeError, ValueError):
+            cached = None  # not an entry of this version
+        else:
+            if any(hash_file(fname) != digest
+                   for fname, digest in sources.items()):
+                cached = None
+    if cached is None:
+        update_counters(stats, {'cache_misses': 1})
+        return False
+    merge_covdata(covdata, cached)
+    update_counters(stats, {'cache_hits': 1, 'datafiles': 1})
+    return True
+
+
+def find_cached_datafiles(filenames, covdata, options, toerase, stats, cache):
+    """Use the cached coverage of data files where possible.
+
+    returns: the files that are not in the cache, and their keys
+    """
+    missing = []
+    keys = dict()
+    for filename in filenames:
+        abs_filename = os.path.abspath(filename)
+        key = datafile_cache_key(cache, abs_filename)
+        if load_cached_coverage(cache, key, covdata, stats):
+            if options.delete and not abs_filename.endswith('gcno'):
+                toerase.add(abs_filename)
+        else:
+            missing.append(filename)
+            keys[abs_filename] = key
+    return missing, keys
+
+
+#
+# Process several datafiles from the same object directory with a single
+# gcov invocation.
+#
+# All files of a batch share their directory, so they also share the list
+# of potential working directories.  gcov is run with --long-file-names so
+# that the .gcov files of different data files cannot overwrite each other.
+# The names only contain the base names of the data files, which are
+# unique within their directory.
+# If no working directory satisfies gcov for the whole batch, every data
+# file is processed again on its own, which recovers the files that were
+# compiled from a different working directory than their neighbours.
+#
+# Cached data files are taken from the cache.  The long .gcov file names
+# tell which data file every .gcov file belongs to, so the coverage of a
+# batch is kept apart by data file, and stored in the cache for each one.
+#
+def process_datafile_batch(
+        filenames, covdata, options, toerase, workdir, stats, wd_cache,
+        cache=None):
+    logger = Logger(options.verbose)
+
+    keys = None
+    if cache is not None and len(filenames) > 1:
+        filenames, keys = find_cached_datafiles(
+            filenames, covdata, options, toerase, stats, cache)
+        if not filenames:
+            return
+
+    if len(filenames) == 1:
+        return process_datafile(
+            filenames[0], covdata, options, toerase, workdir, stats, wd_cache,
+            cache)
+
+    logger.verbose_msg(
+        "Processing batch of {0} files: {1}",
+        len(filenames), " ".join(filenames))
+
+    abs_filenames = [os.path.abspath(filename) for filename in filenames]
+    dirname = os.path.dirname(abs_filenames[0])
+
     errors = []
 
+    potential_wd = find_potential_working_directories(
+        abs_filenames[0], options, workdir=workdir, errors=errors)
+
+    cached_wd = wd_cache.lookup(dirname, workdir)
+    potential_wd = prefer_working_directories(
+        potential_wd,
+        find_gcc_working_directory(
+            abs_filenames[0], options.compile_directories),
+        cached_wd)
+
+    datafile_covdata = None
+    if keys is not None and not options.gcov_pipe:
+        datafile_covdata = dict(
+            (os.path.basename(abs_filename), dict())
+            for abs_filename in abs_filenames)
+
+    done = False
+    for dir_ in potential_wd:
+        done = run_gcov_and_process_files(
+            abs_filenames, dirname, covdata,
+            options=options, logger=logger, toerase=toerase, errors=errors,
+            chdir=dir_, tempdir=workdir, stats=stats, long_file_names=True,
+            datafile_covdata=datafile_covdata)
+        if done:
+            break
+
+    update_wd_cache(wd_cache, dirname, cached_wd, done and dir_, workdir, stats)
+
+    if not done:
+        logger.verbose_msg(
+            "Batch failed, processing {0} files individually",
+            len(filenames))
+        for filename in filenames:
+            process_datafile(
+                filename, covdata, options, toerase, workdir, stats, wd_cache,
+                cache)
+        return
+
+    if datafile_covdata is not None:
+        for abs_filename in abs_filenames:
+            file_covdata = datafile_covdata[os.path.basename(abs_filename)]
+            store_cached_coverage(cache, keys[abs_filename], file_covdata)
+            merge_covdata(covdata, file_covdata)
+
+    update_counters(stats, {'datafiles': len(filenames)})
+
+    if options.delete:
+        toerase.update(
+            abs_filename for abs_filename in abs_filenames
+            if not abs_filename.endswith('gcno'))
+
+
+#
+# Process datafiles with the JSON intermediate format of gcov (GCC 9+).
+#
+# The JSON output records the directory in which gcc was run, so there is
+# no need to infer it: gcov is run once, in the working directory of this
+# thread, and it writes nothing but stdout.  If gcov or the JSON output
+# fail, the data files are processed with the text format instead.
+#
+def process_datafile_json(
+        filenames, covdata, options, toerase, workdir, stats, wd_cache,
+        cache=None):
+    logger = Logger(options.verbose)
+
+    keys = dict()
+    if cache is not None:
+        filenames, keys = find_cached_datafiles(
+            filenames, covdata, options, toerase, stats, cache)
+        if not filenames:
+            return
+
+    abs_filenames = [os.path.abspath(filename) for filename in filenames]
+    dirname = os.path.dirname(abs_filenames[0])
+
+    cmd = gcov_command(abs_filenames, dirname, options) + [
+        "--json-format", "--stdout"]
+
+    # NB: Currently, we will only parse English output
+    env = dict(os.environ)
+    env['LC_ALL'] = 'en_US'
+
+    logger.verbose_msg(
+        "Running gcov: '{cmd}' in '{cwd}'",
+        cmd=' '.join(cmd),
+        cwd=workdir)
+
+    update_counters(stats, {'gcov_runs': 1})
+
+    process = subprocess.Popen(
+        cmd, env=env, cwd=workdir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = process.communicate()
+
+    documents = None
+    if process.returncode == 0:
+        try:
+            documents = [
+                json.loads(line) for line in out.decode('utf-8').splitlines()
+                if line.strip()]
+        except ValueError:
+            pass
+
+    if documents is None:
+        logger.verbose_msg(
+            "GCOV JSON output failed, falling back to the text format:\n"
+            "\t{0}", err.decode('utf-8', 'replace'))
+        for filename in filenames:
+            process_datafile(
+                filename, covdata, options, toerase, workdir, stats, wd_cache,
+                cache)
+        return
+
+    for document in documents:
+        # Every document holds the coverage of one data file
+        key = keys.get(normpath(os.path.join(
+            workdir, document.get('data_file', ''))))
+        process_gcov_document(
+            document, covdata, abs_filenames[0], options, cache, key)
+
+    update_counters(stats, {'datafiles': len(filenames)})
+
+    if options.delete:
+        toerase.update(
+            abs_filename for abs_filename in abs_filenames
+            if not abs_filename.endswith('gcno'))
+
+
+def process_gcov_document(document, covdata, source_fname, options,
+                          cache, key):
+    """Add the coverage of a gcov JSON document, and cache it by key."""
+    if key is None:
+        process_gcov_json(document, covdata, source_fname, options)
+        return
+    file_covdata = dict()
+    process_gcov_json(document, file_covdata, source_fname, options)
+    store_cached_coverage(cache, key, file_covdata)
+    merge_covdata(covdata, file_covdata)
+
+
+#
+# Process datafiles without gcov, by reading the .gcno and .gcda files.
+#
+# The coverage is computed like gcov computes it for the JSON format,
+# so the results are processed like those of the JSON engine.
+# Files that cannot be read this way (e.g. of GCC 7 and older)
+# are processed with gcov instead.
+#
+def process_datafile_python(
+        filenames, covdata, options, toerase, workdir, stats, wd_cache,
+        cache=None):
+    logger = Logger(options.verbose)
+
+    keys = dict()
+    if cache is not None:
+        filenames, keys = find_cached_datafiles(
+            filenames, covdata, options, toerase, stats, cache)
+
+    for filename in filenames:
+        abs_filename = os.path.abspath(filename)
+        logger.verbose_msg("Reading coverage of file: {0}", filename)
+        try:
+            document = read_coverage(abs_filename)
+        except GcovFormatError as e:
+            logger.verbose_msg(
+                "Cannot read {0} without gcov, running gcov: {1}",
+                filename, e)
+            process_datafile(
+                filename, covdata, options, toerase, workdir, stats, wd_cache,
+                cache)
+            continue
+
+        process_gcov_document(
+            document, covdata, abs_filename, options,
+            cache, keys.get(abs_filename))
+
+        update_counters(stats, {'datafiles': 1})
+
+        if options.delete and not abs_filename.endswith('gcno'):
+            toerase.add(abs_filename)
+
+
+def process_gcov_json(document, covdata, source_fname, options):
+    """Add the coverage of one gcov JSON document to covdata.
+
+    source_fname: a data file in the same directory as the document's one
+    """
+    logger = Logger(options.verbose)
+
+    currdir = document.get('current_working_directory')
+    if currdir is None:
+        currdir = os.getcwd()
+
+    for file_ in document['files']:
+        gcovname = file_['file']
+
+        filtered, excluded = apply_filter_include_exclude(
+            gcovname, options.gcov_filter, options.gcov_exclude)
+
+        if filtered:
+            logger.verbose_msg("Filtering gcov output for {0}", gcovname)
+            continue
+
+        if excluded:
+            logger.verbose_msg("Excluding gcov output for {0}", gcovname)
+            continue
+
+        fname = guess_source_file_name_heuristics(
+            gcovname, currdir, options.root_dir, options.starting_dir,
+            source_fname)
+
+        logger.verbose_msg("Parsing coverage data for file {0}", fname)
+
+        if is_filtered_source_file(fname, options, logger):
+            continue
+
+        try:
+            with open(fname, 'r') as INPUT:
+                source_lines = INPUT.readlines()
+        except (IOError, UnicodeDecodeError):
+            source_lines = []
+
+        parser = GcovParser(fname, logger=logger)
+        parser.parse_json_lines(
+            file_['lines'], source_lines,
+            exclude_unreachable_branches=options.exclude_unreachable_branches)
+        parser.update_coverage(covdata)
+
+
+def group_datafiles(datafiles, batch_size, flush=None):
+    """Group data files by their object directory.
+
+    Each group holds at most batch_size files,
+    and all files in a group are in the same directory.
+    The data files are expected to be ordered by directory,
+    as they are found.  A smaller group is yielded early
+    whenever flush() returns True, e.g. if workers are idle.
+
+    yields: sorted lists of file names
+    """
+    group = []
+    group_dir = None
+    for filename in datafiles:
+        dirname = os.path.dirname(os.path.abspath(filename))
+        if group and (dirname != group_dir or len(group) >= batch_size):
+            yield sorted(group)
+            group = []
+        group.append(filename)
+        group_dir = dirname
+        if flush is not None and flush():
+            yield sorted(group)
+            group = []
+
+    if group:
+        yield sorted(group)
+
+
+def estimate_cost(filenames):
+    """Estimate the work for data files (or gcov files) by their size.
+
+    The size of a gcda file is counted together with its gcno file.
+    """
+    if not isinstance(filenames, list):
+        filenames = [filenames]
+    cost = 0
+    for filename in filenames:
+        related = [filename]
+        if filename.endswith('.gcda'):
+            related.append(filename[:-2] + 'no')
+        for related_filename in related:
+            try:
+                cost += os.path.getsize(related_filename)
+            except OSError:
+                pass
+    return cost
+
+
+def merge_results(target, source):
+    """Add the results of work items (their covdata, toerase and stats)
+    to the results of other work items.
+
+    The results of source can be reused by target.
+    """
+    merge_covdata(target['covdata'], source['covdata'])
+    target['toerase'].update(source['toerase'])
+    update_counters(target['stats'], source['stats'])
+
+
+def find_potential_working_directories(abs_filename, options, workdir, errors):
     potential_wd = find_potential_working_directories_via_objdir(
         abs_filename, options.objdir, errors=errors)
 
@@ -545,35 +1361,16 @@ def process_datafile(filename, covdata, options, toerase, workdir):
     if workdir is not None:
         potential_wd = [workdir] + potential_wd
 
-    # Iterate from the end of the potential_wd list, which is the root
-    # directory
-
-    #
-    # @latk - 2018: not true, this iterates from the start of the list.
-    # Is that a bug?
-    done = False
-    for dir_ in potential_wd:
-        if done:
-            break
-
-        # NB: either len(potential_wd) == 1, or all entires are absolute
-        # paths, so we don't have to chdir(starting_dir) at every
-        # iteration.
-
-        done = run_gcov_and_process_files(
-            abs_filename, dirname, covdata,
-            options=options, logger=logger, toerase=toerase, errors=errors, chdir=dir_, tempdir=workdir)
+    return potential_wd
 
-        if options.delete:
-            if not abs_filename.endswith('gcno'):
-                toerase.add(abs_filename)
 
-    if not done:
-        logger.warn(
-            "GCOV produced the following errors processing {filename}:\n"
-            "\t{errors}\n"
-            "\t(gcovr could not infer a working directory that resolved it.)",
-            filename=filename, errors="\n\t".join(errors))
+def prefer_working_directories(potential_wd, *preferred_wds):
+    """Move the preferred directories that are not None to the front."""
+    preferred = []
+    for dir_ in preferred_wds:
+        if dir_ is not None and dir_ not in preferred:
+            preferred.append(dir_)
+    return preferred + [dir_ for dir_ in potential_wd if dir_ not in preferred]
 
 
 def find_potential_working_directories_via_objdir(abs_filename, objdir, errors):
@@ -631,14 +1428,31 @@ def expand_subdirectories(*directories):
 
 
 def run_gcov_and_process_files(
-        abs_filename, dirname, covdata, options, logger, errors, toerase, chdir, tempdir):
-    # If the first element of cmd - the executable name - has embedded spaces
-    # it probably includes extra arguments.
-    cmd = options.gcov_cmd.split(' ') + [
-        abs_filename,
-        "--branch-counts", "--branch-probabilities", "--preserve-paths",
-        '--object-directory', dirname
-    ]
+        abs_filenames, dirname, covdata, options, logger, errors, toerase,
+        chdir, tempdir, stats, long_file_names=False, isolated=None,
+        datafile_covdata=None):
+    if options.gcov_pipe:
+        return run_gcov_and_process_stdout(
+            abs_filenames, dirname, covdata, options=options, logger=logger,
+            errors=errors, chdir=chdir, stats=stats)
+
+    # With --long-file-names, the .gcov files are named after the data
+    # files as they are given to gcov, which only uses their base names
+    # to find them in the object directory.  A prefix that is unique to
+    # this worker makes the names unique, so gcov runs in the same
+    # directory cannot overwrite each other's files, and keeps them short,
+    # unlike the absolute data file names.  Kept .gcov files get the
+    # usual names, which requires locking the directory.
+    if isolated is None:
+        isolated = not options.keep
+    if long_file_names or isolated:
+        prefix = os.path.basename(tempdir) if isolated else ''
+        cmd = gcov_command([
+            os.path.join(prefix, os.path.basename(abs_filename))
+            for abs_filename in abs_filenames], dirname, options)
+        cmd.append("--long-file-names")
+    else:
+        cmd = gcov_command(abs_filenames, dirname, options)
 
     # NB: Currently, we will only parse English output
     env = dict(os.environ)
@@ -649,11 +1463,14 @@ def run_gcov_and_process_files(
         cmd=' '.join(cmd),
         cwd=chdir)
 
-    with locked_directory(chdir):
-        out, err = subprocess.Popen(
+    update_counters(stats, {'gcov_runs': 1})
+
+    with locked_directory(chdir, lock=not isolated):
+        process = subprocess.Popen(
             cmd, env=env, cwd=chdir,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE).communicate()
+            stderr=subprocess.PIPE)
+        out, err = process.communicate()
         out = out.decode('utf-8')
         err = err.decode('utf-8')
 
@@ -664,16 +1481,42 @@ def run_gcov_and_process_files(
             gcov_exclude=options.gcov_exclude,
             logger=logger,
             chdir=chdir,
-            tempdir=tempdir)
-
-    if source_re.search(err):
+            tempdir=None if isolated else tempdir)
+
+        # gcov cannot have created a .gcov file that is gone
+        missing = [
+            fname for fname in all_gcov_files if not os.path.exists(fname)]
+
+    if isolated and output_error_re.search(err):
+        # e.g. the prefixed name is too long:
+        # run gcov again with the usual names
+        if not options.keep:
+            toerase.update(all_gcov_files)
+        return run_gcov_and_process_files(
+            abs_filenames, dirname, covdata, options=options, logger=logger,
+            errors=errors, toerase=toerase, chdir=chdir, tempdir=tempdir,
+            stats=stats, long_file_names=long_file_names, isolated=False,
+            datafile_covdata=datafile_covdata)
+
+    if source_re.search(err) or missing:
         # gcov tossed errors: try the next potential_wd
-        errors.append(err)
+        errors.append(err or "gcov did not create {0}".format(
+            ", ".join(missing)))
         done = False
     else:
+        if output_error_re.search(err):
+            logger.warn(
+                "GCOV could not write all gcov files in {cwd}:\n\t{err}",
+                cwd=chdir, err=err.strip().replace("\n", "\n\t"))
         # Process *.gcov files
+        # All data files share the same directory, which is all that the
+        # source file heuristics need to know about them.
+        # Relative source names are relative to the gcov working directory.
         for fname in active_gcov_files:
-            process_gcov_data(fname, covdata, abs_filename, options)
+            if datafile_covdata is not None:
+                covdata = find_datafile_covdata(datafile_covdata, fname)
+            process_gcov_data(
+                fname, covdata, abs_filenames[0], options, currdir=chdir)
         done = True
 
     if not options.keep:
@@ -682,6 +1525,136 @@ def run_gcov_and_process_files(
     return done
 
 
+def find_datafile_covdata(datafile_covdata, gcov_fname):
+    """Find the coverage of the data file that a long .gcov file name
+    starts with, e.g. 'tmpdir#file.gcda##file.cpp.gcov'.
+
+    datafile_covdata: a dict of the data file base names to their coverage
+    """
+    datafile = os.path.basename(gcov_fname).split('##', 1)[0]
+    if datafile not in datafile_covdata:
+        # without the prefix of the worker
+        datafile = max(
+            (name for name in datafile_covdata
+             if datafile.endswith('#' + name)), key=len)
+    return datafile_covdata[datafile]
+
+
+def gcov_command(abs_filenames, dirname, options):
+    # If the first element of cmd - the executable name - has embedded spaces
+    # it probably includes extra arguments.
+    return options.gcov_cmd.split(' ') + abs_filenames + [
+        "--branch-counts", "--branch-probabilities", "--preserve-paths",
+        '--object-directory', dirname
+    ]
+
+
+#
+# Run "gcov --stdout" and parse its output while it is produced.
+#
+# No .gcov files are written, so nothing has to be copied or erased
+# and the working directory does not need to be locked.  The coverage
+# is collected separately and only merged once gcov has confirmed that
+# it could open all source files in this working directory.
+#
+def run_gcov_and_process_stdout(
+        abs_filenames, dirname, covdata, options, logger, errors, chdir,
+        stats):
+    cmd = gcov_command(abs_filenames, dirname, options) + ["--stdout"]
+
+    # NB: Currently, we will only parse English output
+    env = dict(os.environ)
+    env['LC_ALL'] = 'en_US'
+
+    logger.verbose_msg(
+        "Running gcov: '{cmd}' in '{cwd}'",
+        cmd=' '.join(cmd),
+        cwd=chdir)
+
+    update_counters(stats, {'gcov_runs': 1})
+
+    # stderr goes to a file so that it cannot block gcov
+    # while we are busy reading stdout.
+    ERR = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        cmd, env=env, cwd=chdir, stdout=subprocess.PIPE, stderr=ERR)
+    if sys.version_info >= (3, 0):
+        stdout = io.TextIOWrapper(process.stdout)
+    else:
+        stdout = process.stdout
+
+    pending = dict()
+    for source_line, lines in split_gcov_sections(stdout):
+        gcovname = source_line.split(':', 3)[-1].strip()
+        filtered, excluded = apply_filter_include_exclude(
+            gcovname, options.gcov_filter, options.gcov_exclude)
+
+        if filtered:
+            logger.verbose_msg("Filtering gcov output for {0}", gcovname)
+            continue
+
+        if excluded:
+            logger.verbose_msg("Excluding gcov output for {0}", gcovname)
+            continue
+
+        # All data files share the same directory, which is all that the
+        # source file heuristics need to know about them.
+        process_gcov_lines(
+            source_line, lines, abs_filenames[0], pending, abs_filenames[0],
+            options, currdir=chdir)
+
+    stdout.close()
+    process.wait()
+    ERR.seek(0)
+    err = ERR.read().decode('utf-8')
+    ERR.close()
+
+    if source_re.search(err):
+        # gcov tossed errors: try the next potential_wd
+        errors.append(err)
+        return False
+
+    merge_covdata(covdata, pending)
+    return True
+
+
+def probe_gcov(gcov_cmd):
+    """Find out the version of gcov and the options it supports.
+
+    gcov is run only once with --version and --help.
+
+    returns: a dict with the keys
+        version (tuple of int, or None): the GCC version, None for non-GCC
+        stdout (bool): whether gcov supports --stdout
+        json (bool): whether gcov supports --json-format together with --stdout
+    """
+    info = dict(version=None, stdout=False, json=False)
+
+    def run(*args):
+        out, _ = subprocess.Popen(
+            gcov_cmd.split(' ') + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT).communicate()
+        return out.decode('utf-8', 'replace')
+
+    try:
+        version_text = run('--version')
+        help_text = run('--help')
+    except OSError:
+        return info
+
+    firstline = (version_text.splitlines() or [''])[0]
+    found = gcov_version_re.match(firstline)
+    if found is not None:
+        info['version'] = tuple(int(x) for x in found.group(1).split('.'))
+
+    info['stdout'] = '--stdout' in help_text
+    # The JSON intermediate format is available since GCC 9
+    info['json'] = info['stdout'] and '--json-format' in help_text and \
+        info['version'] is not None and info['version'] >= (9,)
+    return info
+
+
 def select_gcov_files_from_stdout(out, gcov_filter, gcov_exclude, logger, chdir, tempdir):
     active_files = []
     all_files = []
@@ -695,8 +1668,9 @@ def select_gcov_files_from_stdout(out, gcov_filter, gcov_exclude, logger, chdir,
         full = os.path.join(chdir, fname)
         all_files.append(full)
 
+        # Filter long file names by the part that names the source file
         filtered, excluded = apply_filter_include_exclude(
-            fname, gcov_filter, gcov_exclude)
+            long_file_name_re.sub('', fname), gcov_filter, gcov_exclude)
 
         if filtered:
             logger.verbose_msg("Filtering gcov file {0}", fname)
@@ -719,7 +1693,9 @@ def select_gcov_files_from_stdout(out, gcov_filter, gcov_exclude, logger, chdir,
 #
 #  Process Already existing gcov files
 #
-def process_existing_gcov_file(filename, covdata, options, toerase, workdir):
+def process_existing_gcov_file(
+        filename, covdata, options, toerase, workdir, stats, wd_cache,
+        cache=None):
     logger = Logger(options.verbose)
 
     filtered, excluded = apply_filter_include_exclude(
@@ -734,12 +1710,70 @@ def process_existing_gcov_file(filename, covdata, options, toerase, workdir):
         logger.verbose_msg("Excluding gcov file: {0}", filename)
         return
 
-    process_gcov_data(filename, covdata, None, options)
+    if cache is None:
+        process_gcov_data(filename, covdata, None, options)
+    else:
+        process_gcov_data_cached(filename, covdata, options, stats, cache)
 
     if not options.keep:
         toerase.add(filename)
 
 
+#
+# Process an existing gcov file with the parse cache.
+#
+# The cache is keyed by the contents of the gcov file, so the same file
+# at another place shares the entry.  Only the parsed coverage is cached:
+# the source file name is still resolved, and filtered, on every run.
+#
+def process_gcov_data_cached(data_fname, covdata, options, stats, cache):
+    logger = Logger(options.verbose)
+
+    key = cache.key('gcov', hash_file(data_fname))
+
+    with open(data_fname, "rb", GCOV_BUFFER_SIZE) as INPUT:
+        firstline = decode_text(INPUT.readline())
+        fname = guess_source_file_name(
+            firstline, data_fname, None,
+            root_dir=options.root_dir, starting_dir=options.starting_dir,
+            logger=logger)
+
+        if is_filtered_source_file(fname, options, logger):
+            return
+
+        cov = None
+        state = cache.load(key)
+        if state is not None:
+            try:
+                cov = CoverageData.from_state(state)
+            except (TypeError, ValueError):
+                pass  # not an entry of this version
+        if cov is None:
+            update_counters(stats, {'cache_misses': 1})
+            logger.verbose_msg("Parsing coverage data for file {0}", fname)
+            parser = GcovParser(fname, logger=logger)
+            parser.parse_all_lines(
+                INPUT,
+                exclude_unreachable_branches=options.exclude_unreachable_branches,
+                ignore_parse_errors=options.gcov_ignore_parse_errors,
+                binary=True)
+            cov = CoverageData(fname)
+            cov.update(
+                uncovered=parser.uncovered,
+                uncovered_exceptional=parser.uncovered_exceptional,
+                covered=parser.covered,
+                branches=parser.branches,
+                noncode=parser.noncode)
+            cache.store(key, cov.__getstate__())
+        else:
+            update_counters(stats, {'cache_hits': 1})
+            logger.verbose_msg("Cached coverage data for file {0}", fname)
+
+    # The entry can come from the same gcov file at another place
+    cov.fname = fname
+    merge_covdata(covdata, {fname: cov})
+
+
 def apply_filter_include_exclude(
         filename, include_filters, exclude_filters, strip=None):
     """Apply inclusion/exclusion filters to filename
@@ -10,12 +10,17 @@ import os
 import sys
 import time
 import datetime
+import hashlib
+import json
 import zlib
 
 from string import Template
 
 from .version import __version__
-from .utils import commonpath, sort_coverage
+from .cache import hash_file
+from .coverage import COVERED, UNCOVERED
+from .utils import commonpath, get_global_stats, sort_coverage
+from .workers import Workers
 
 medium_coverage = 75.0
 high_coverage = 90.0
@@ -464,6 +469,54 @@ ${ROWS}
 ''')
 
 
+#
+# The rows of the tables, as str.format strings.
+# They are filled once for every line or file, and unlike
+# string.Template, str.format needs no regular expression to do that.
+#
+
+# The fields of a source row are positional, which is faster:
+# line number, class, branches, count and source.
+source_row = '''
+    <tr>
+    <td align="right" class="lineno"><pre>{0}</pre></td>
+    <td align="right" class="linebranch">{2}</td>
+    <td align="right" class="linecount {1}"><pre>{3}</pre></td>
+    <td align="left" class="src {1}"><pre>{4}</pre></td>
+    </tr>'''
+
+file_row = '''
+    <tr>
+      <td class="coverFile" {altstyle}>{filename}</td>
+      <td class="coverBar" align="center" {altstyle}>
+        <table border=0 cellspacing=0 cellpadding=1><tr><td class="coverBarOutline">
+                <div class="graph"><strong class="bar" style="width:{LinesCoverage}%; {BarBorder}background-color:{LinesBar}"></strong></div>
+                </td></tr></table>
+      </td>
+      <td class="CoverValue" style="font-weight:bold; background-color:{LinesColor};">{LinesCoverage}&nbsp;%</td>
+      <td class="CoverValue" style="font-weight:bold; background-color:{LinesColor};">{LinesExec} / {LinesTotal}</td>
+      <td class="CoverValue" style="background-color:{BranchesColor};">{BranchesCoverage}&nbsp;%</td>
+      <td class="CoverValue" style="background-color:{BranchesColor};">{BranchesExec} / {BranchesTotal}</td>
+    </tr>
+'''
+
+taken_branch = (
+    '<span class="takenBranch" title="Branch {0} taken {1} times">'
+    '&check;</span>')
+not_taken_branch = (
+    '<span class="notTakenBranch" title="Branch {0} not taken">'
+    '&cross;</span>')
+
+# The class of a source line, for every combination of state flags
+line_classes = tuple(
+    'coveredLine' if state & COVERED else
+    'uncoveredLine' if state & UNCOVERED else ''
+    for state in range(8))
+
+# The (class, branches, count) cells of a line that is not executable
+no_cells = ('', '', '')
+
+
 def calculate_coverage(covered, total, nan_value=0.0):
     return nan_value if total == 0 else round(100.0 * covered / total, 1)
 
@@ -479,13 +532,49 @@ def coverage_to_color(coverage):
         return high_color
 
 
+def page_filename(output, name):
+    """Get the filename of the page for a file or directory,
+    named after the output file."""
+    ttmp = os.path.abspath(output).split('.')
+    longname = name.replace(os.sep, '_')
+    longname_hash = ""
+    while True:
+        if len(ttmp) > 1:
+            filename = \
+                '.'.join(ttmp[:-1]) + \
+                '.' + longname + longname_hash + \
+                '.' + ttmp[-1]
+        else:
+            filename = ttmp[0] + '.' + longname + longname_hash + '.html'
+        # we add a hash at the end and attempt to shorten the
+        # filename if it exceeds common filesystem limitations
+        if len(os.path.basename(filename)) < 256:
+            return filename
+        longname_hash = "_" + hex(zlib.crc32(longname) & 0xffffffff)[2:]
+        longname = longname[(len(filename) - len(longname_hash)):]
+
+
+def unique_page_filename(output, name, taken):
+    """Get the filename of a page that no other page has taken,
+    and take it.  Names that clash get a number."""
+    filename = page_filename(output, name)
+    number = 1
+    while filename in taken:
+        filename = page_filename(output, '{0}_{1}'.format(name, number))
+        number += 1
+    taken.add(filename)
+    return filename
+
+
 #
 # Produce an HTML report
 #
 def print_html_report(covdata, options):
     details = options.html_details
+    tree = options.html_tree
     if options.output is None:
         details = False
+        tree = False
     data = {}
     data['HEAD'] = "Head"
     data['VERSION'] = __version__
@@ -509,24 +598,14 @@ def print_html_report(covdata, options):
     )
     data['DIRECTORY'] = ''
 
-    branchTotal = 0
-    branchCovered = 0
-    for key in covdata.keys():
-        (total, covered, percent) = covdata[key].coverage(show_branch=True)
-        branchTotal += total
-        branchCovered += covered
+    (lineTotal, lineCovered, _,
+        branchTotal, branchCovered, _) = get_global_stats(covdata)
     data['BRANCHES_EXEC'] = str(branchCovered)
     data['BRANCHES_TOTAL'] = str(branchTotal)
     coverage = calculate_coverage(branchCovered, branchTotal, nan_value=None)
     data['BRANCHES_COVERAGE'] = '-' if coverage is None else str(coverage)
     data['BRANCHES_COLOR'] = coverage_to_color(coverage)
 
-    lineTotal = 0
-    lineCovered = 0
-    for key in covdata.keys():
-        (total, covered, percent) = covdata[key].coverage(show_branch=False)
-        lineTotal += total
-        lineCovered += covered
     data['LINES_EXEC'] = str(lineCovered)
     data['LINES_TOTAL'] = str(lineTotal)
     coverage = calculate_coverage(lineCovered, lineTotal)
@@ -543,32 +622,9 @@ def print_html_report(covdata, options):
         by_num_uncovered=options.sort_uncovered,
         by_percent_uncovered=options.sort_percent)
     for f in keys:
-        cdata = covdata[f]
         filtered_fname = options.root_filter.sub('', f)
         files.append(filtered_fname)
         dirs.append(os.path.dirname(filtered_fname) + os.sep)
-        cdata._filename = filtered_fname
-        if not details:
-            cdata._sourcefile = None
-        else:
-            ttmp = os.path.abspath(options.output).split('.')
-            longname = cdata._filename.replace(os.sep, '_')
-            longname_hash = ""
-            while True:
-                if len(ttmp) > 1:
-                    cdata._sourcefile = \
-                        '.'.join(ttmp[:-1]) + \
-                        '.' + longname + longname_hash + \
-                        '.' + ttmp[-1]
-                else:
-                    cdata._sourcefile = \
-                        ttmp[0] + '.' + longname + longname_hash + '.html'
-                # we add a hash at the end and attempt to shorten the
-                # filename if it exceeds common filesystem limitations
-                if len(os.path.basename(cdata._sourcefile)) < 256:
-                    break
-                longname_hash = "_" + hex(zlib.crc32(longname) & 0xffffffff)[2:]
-                longname = longname[(len(cdata._sourcefile) - len(longname_hash)):]
 
     # Define the common root directory, which may differ from options.root
     # when source files share a common prefix.
@@ -581,39 +637,50 @@ def print_html_report(covdata, options):
         if dir_ != '':
             data['DIRECTORY'] = dir_ + os.sep
 
+    # The pages of the directories are named first,
+    # so that a source file named "index" cannot take their name.
+    taken = set()
+    directory_pages = {'': options.output}
+    if tree:
+        for filtered_fname in files:
+            dirname = os.path.dirname(os.path.relpath(
+                os.path.realpath(filtered_fname), data['DIRECTORY']))
+            while dirname not in directory_pages:
+                directory_pages[dirname] = unique_page_filename(
+                    options.output, dirname + os.sep + 'index', taken)
+                dirname = os.path.dirname(dirname)
+
+    # The (filtered file name, page) of every file
+    pages = dict()
+    for f, filtered_fname in zip(keys, files):
+        if not details:
+            pages[f] = (filtered_fname, None)
+        else:
+            pages[f] = (filtered_fname, unique_page_filename(
+                options.output, filtered_fname, taken))
+
     nrows = 0
+    files_totals = []
     for f in keys:
-        cdata = covdata[f]
-        class_lines = 0
-        class_hits = 0
-        class_branches = 0
-        class_branch_hits = 0
-        for line in sorted(cdata.all_lines):
-            hits = cdata.covered.get(line, 0)
-            class_lines += 1
-            if hits > 0:
-                class_hits += 1
-            branches = cdata.branches.get(line)
-            if branches is None:
-                pass
-            else:
-                b_hits = 0
-                for v in branches.values():
-                    if v > 0:
-                        b_hits += 1
-                coverage = 100 * b_hits / len(branches)
-                class_branch_hits += b_hits
-                class_branches += len(branches)
+        (class_lines, class_hits,
+            class_branches, class_branch_hits) = covdata[f].stats()
 
         lines_covered = calculate_coverage(class_hits, class_lines, nan_value=100.0)
         branches_covered = calculate_coverage(class_branch_hits, class_branches, nan_value=None)
 
         nrows += 1
+        filtered_fname, sourcefile = pages[f]
+        filename = os.path.relpath(
+            os.path.realpath(filtered_fname), data['DIRECTORY'])
+        if tree:
+            files_totals.append((
+                filename, sourcefile,
+                (class_hits, class_lines, class_branch_hits, class_branches)))
+            continue
         data['ROWS'].append(html_row(
-            options, details, cdata._sourcefile, nrows,
+            options, details, sourcefile, nrows,
             directory=data['DIRECTORY'],
-            filename=os.path.relpath(
-                os.path.realpath(cdata._filename), data['DIRECTORY']),
+            filename=filename,
             LinesExec=class_hits,
             LinesTotal=class_lines,
             LinesCoverage=lines_covered,
@@ -627,6 +694,12 @@ def print_html_report(covdata, options):
         data['DIRECTORY'] = "."
     data['DIRECTORY'] = data['DIRECTORY'].replace('\\', '/')
 
+    if tree:
+        # The top page only lists the top directories and files
+        directories = directory_tree(files_totals)
+        data['ROWS'] = print_directory_pages(
+            directories, directory_pages, data, options, details)
+
     htmlString = root_page.substitute(**data)
 
     if options.output is None:
@@ -641,85 +714,300 @@ def print_html_report(covdata, options):
         return
 
     #
-    # Generate an HTML file for every source file
+    # Generate an HTML file for every source file, on the -j workers.
+    # The pages only read the sources and write their own file,
+    # so they can be rendered in any order.
     #
-    for f in keys:
-        cdata = covdata[f]
-
-        data['FILENAME'] = cdata._filename
-        data['ROWS'] = ''
-
-        branchTotal, branchCovered, tmp = cdata.coverage(show_branch=True)
-        data['BRANCHES_EXEC'] = str(branchCovered)
-        data['BRANCHES_TOTAL'] = str(branchTotal)
-        coverage = calculate_coverage(branchCovered, branchTotal, nan_value=None)
-        data['BRANCHES_COVERAGE'] = '-' if coverage is None else str(coverage)
-        data['BRANCHES_COLOR'] = coverage_to_color(coverage)
-
-        lineTotal, lineCovered, tmp = cdata.coverage(show_branch=False)
-        data['LINES_EXEC'] = str(lineCovered)
-        data['LINES_TOTAL'] = str(lineTotal)
-        coverage = calculate_coverage(lineCovered, lineTotal)
-        data['LINES_COVERAGE'] = str(coverage)
-        data['LINES_COLOR'] = coverage_to_color(coverage)
-
-        data['ROWS'] = []
-        currdir = os.getcwd()
-        os.chdir(options.root_dir)
-        INPUT = open(data['FILENAME'], 'r')
-        ctr = 1
-        for line in INPUT:
-            data['ROWS'].append(
-                source_row(ctr, line.rstrip(), cdata)
-            )
-            ctr += 1
-        INPUT.close()
-        os.chdir(currdir)
-        data['ROWS'] = '\n'.join(data['ROWS'])
-
-        htmlString = source_page.substitute(**data)
-        OUTPUT = open(cdata._sourcefile, 'w')
-        OUTPUT.write(htmlString + '\n')
+    del data['ROWS']
+    parallel_mode = options.parallel_mode
+    if parallel_mode == 'auto':
+        # Rendering is Python code, which threads run one at a time
+        parallel_mode = 'processes' if options.gcov_parallel > 1 else 'threads'
+    context = {'page_data': data, 'options': options}
+    work = print_source_page
+    results = None
+    fingerprints = {}
+    if options.html_incremental:
+        # Only the pages whose fingerprint changed are written again
+        fingerprints_file = options.output + '.fingerprints'
+        context['old_fingerprints'] = load_fingerprints(fingerprints_file)
+        work = update_source_page
+        results = {'fingerprints': dict()}
+    with Workers(options.gcov_parallel, lambda: context,
+                 processes=parallel_mode == 'processes',
+                 results=results,
+                 merge=lambda item_results: fingerprints.update(
+                     item_results['fingerprints'])) as pool:
+        for f in keys:
+            pool.add(work, covdata[f], *pages[f])
+    if options.html_incremental:
+        save_fingerprints(fingerprints_file, fingerprints)
+
+
+def directory_tree(files):
+    """Roll the totals of the files up into their directories.
+
+    files: the (filename, page, totals) of the files in report order,
+        with filenames relative to the common directory, and totals as
+        (lines exec, lines total, branches exec, branches total)
+    returns: a dict of every directory, '' for the common directory,
+        to its [totals, subdirectories, files]
+    """
+    directories = {'': [[0, 0, 0, 0], [], []]}
+    # Every directory is added after its parent
+    order = []
+    for file_ in files:
+        dirname = os.path.dirname(file_[0])
+        missing = []
+        while dirname not in directories:
+            missing.append(dirname)
+            dirname = os.path.dirname(dirname)
+        for subdir in reversed(missing):
+            directories[dirname][1].append(subdir)
+            directories[subdir] = [[0, 0, 0, 0], [], []]
+            order.append(subdir)
+            dirname = subdir
+        totals, _, dir_files = directories[dirname]
+        dir_files.append(file_)
+        for i, value in enumerate(file_[2]):
+            totals[i] += value
+
+    # Bottom-up, the totals of a directory are complete
+    # before they are added to its parent
+    for dirname in reversed(order):
+        totals = directories[os.path.dirname(dirname)][0]
+        for i, value in enumerate(directories[dirname][0]):
+            totals[i] += value
+    return directories
+
+
+def print_directory_pages(directories, pages, data, options, details):
+    """Write the page of every subdirectory.
+
+    Every page lists the subdirectories and files of its directory,
+    with a link to the page of every parent directory.
+
+    pages: the page of every directory, options.output for ''
+    returns: the rows of the page of the common directory
+    """
+
+    def link(dirname):
+        page = pages[dirname]
+        if options.relative_anchors:
+            page = os.path.basename(page)
+        return page
+
+    top = data['DIRECTORY'].rstrip('/') or '/'
+    for dirname, (totals, subdirs, files) in directories.items():
+        if not dirname:
+            continue
+        parts = dirname.split(os.sep)
+        breadcrumbs = ['<a href="%s">%s</a>' % (link(''), top)]
+        for i in range(1, len(parts)):
+            breadcrumbs.append('<a href="%s">%s</a>' % (
+                link(os.sep.join(parts[:i])), parts[i - 1]))
+        breadcrumbs.append(parts[-1])
+
+        page_data = dict(data)
+        page_data['DIRECTORY'] = '/'.join(breadcrumbs)
+        lines_exec, lines_total, branches_exec, branches_total = totals
+        page_data['BRANCHES_EXEC'] = str(branches_exec)
+        page_data['BRANCHES_TOTAL'] = str(branches_total)
+        coverage = calculate_coverage(
+            branches_exec, branches_total, nan_value=None)
+        page_data['BRANCHES_COVERAGE'] = \
+            '-' if coverage is None else str(coverage)
+        page_data['BRANCHES_COLOR'] = coverage_to_color(coverage)
+        page_data['LINES_EXEC'] = str(lines_exec)
+        page_data['LINES_TOTAL'] = str(lines_total)
+        coverage = calculate_coverage(lines_exec, lines_total)
+        page_data['LINES_COVERAGE'] = str(coverage)
+        page_data['LINES_COLOR'] = coverage_to_color(coverage)
+        page_data['ROWS'] = directory_rows(
+            directories, dirname, pages, options, details)
+
+        OUTPUT = open(pages[dirname], 'w')
+        OUTPUT.write(root_page.substitute(**page_data) + '\n')
         OUTPUT.close()
 
+    return directory_rows(directories, '', pages, options, details)
 
-def source_row(lineno, source, cdata):
-    rowstr = Template('''
-    <tr>
-    <td align="right" class="lineno"><pre>${lineno}</pre></td>
-    <td align="right" class="linebranch">${linebranch}</td>
-    <td align="right" class="linecount ${covclass}"><pre>${linecount}</pre></td>
-    <td align="left" class="src ${covclass}"><pre>${source}</pre></td>
-    </tr>''')
-    kwargs = {}
-    kwargs['lineno'] = str(lineno)
-    if lineno in cdata.covered:
-        kwargs['covclass'] = 'coveredLine'
-        kwargs['linebranch'] = ''
-        # If line has branches them show them with ticks or crosses
-        if lineno in cdata.branches.keys():
-            branches = cdata.branches.get(lineno)
-            branchcounter = 0
-            for branch in branches:
-                if branches[branch] > 0:
-                    kwargs['linebranch'] += '<span class="takenBranch" title="Branch ' + str(branch) + ' taken ' + str(branches[branch]) + ' times">&check;</span>'
-                else:
-                    kwargs['linebranch'] += '<span class="notTakenBranch" title="Branch ' + str(branch) + ' not taken">&cross;</span>'
-                branchcounter += 1
-                # Wrap at 4 branches to avoid too wide column
-                if (branchcounter > 0) and ((branchcounter % 4) == 0):
-                    kwargs['linebranch'] += '<br/>'
-        kwargs['linecount'] = str(cdata.covered.get(lineno, 0))
-    elif lineno in cdata.uncovered:
-        kwargs['covclass'] = 'uncoveredLine'
-        kwargs['linebranch'] = ''
-        kwargs['linecount'] = ''
-    else:
-        kwargs['covclass'] = ''
-        kwargs['linebranch'] = ''
-        kwargs['linecount'] = ''
-    kwargs['source'] = html_escape(source)
-    return rowstr.substitute(**kwargs)
+
+def directory_rows(directories, dirname, pages, options, details):
+    """Render the rows of the subdirectories and files of a directory.
+
+    The subdirectories come first, by name,
+    and the files keep the order of the report.
+    """
+    _, subdirs, files = directories[dirname]
+    entries = [
+        (os.path.basename(subdir) + '/', pages[subdir], True,
+         directories[subdir][0])
+        for subdir in sorted(subdirs)]
+    entries.extend(
+        (os.path.basename(filename), page, details, totals)
+        for filename, page, totals in files)
+
+    rows = []
+    for nrows, (name, page, linked, totals) in enumerate(entries, 1):
+        lines_exec, lines_total, branches_exec, branches_total = totals
+        rows.append(html_row(
+            options, linked, page, nrows,
+            filename=name,
+            LinesExec=lines_exec,
+            LinesTotal=lines_total,
+            LinesCoverage=calculate_coverage(
+                lines_exec, lines_total, nan_value=100.0),
+            BranchesExec=branches_exec,
+            BranchesTotal=branches_total,
+            BranchesCoverage=calculate_coverage(
+                branches_exec, branches_total, nan_value=None)))
+    return '\n'.join(rows)
+
+
+def load_fingerprints(filename):
+    """Read the page fingerprints of the last report, if any."""
+    try:
+        with open(filename, 'r') as stream:
+            fingerprints = json.load(stream)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(fingerprints, dict):
+        return {}
+    return fingerprints
+
+
+def save_fingerprints(filename, fingerprints):
+    """Replace the page fingerprints with those of this report."""
+    tmp_path = filename + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        json.dump(fingerprints, stream, indent=0, sort_keys=True)
+    if os.path.exists(filename):
+        os.remove(filename)  # for Windows
+    os.rename(tmp_path, filename)
+
+
+# The common page data that a source page uses.
+# The totals of the report are replaced by those of the file.
+source_page_keys = (
+    'ENC', 'CSS', 'DIRECTORY', 'HEAD', 'VERSION',
+    'low_color', 'medium_color', 'high_color',
+    'COVERAGE_MED', 'COVERAGE_HIGH')
+
+
+def source_page_fingerprint(cdata, filename, page_data):
+    """Hash everything a source page is made of, except for its date:
+    the source, its coverage, and the data common to all pages,
+    which includes the gcovr version and the options of the pages.
+    """
+    digest = hashlib.sha1(repr((
+        __version__,
+        filename,
+        hash_file(filename),
+        list(cdata.line_records()),
+        [page_data[key] for key in source_page_keys],
+    )).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def update_source_page(cdata, filename, sourcefile, page_data, options,
+                       old_fingerprints, fingerprints):
+    """Write the page of a source file,
+    unless it exists and its fingerprint is unchanged.
+    """
+    fingerprint = source_page_fingerprint(
+        cdata, os.path.join(options.root_dir, filename), page_data)
+    page = os.path.basename(sourcefile)
+    fingerprints[page] = fingerprint
+    if old_fingerprints.get(page) == fingerprint and \
+            os.path.exists(sourcefile):
+        return
+    print_source_page(cdata, filename, sourcefile, page_data, options)
+
+
+def print_source_page(cdata, filename, sourcefile, page_data, options):
+    """Write the annotated HTML page of a source file.
+
+    The source is read relative to the root directory,
+    without changing the working directory of the process.
+    """
+    data = dict(page_data)
+    data['FILENAME'] = filename
+
+    branchTotal, branchCovered, tmp = cdata.coverage(show_branch=True)
+    data['BRANCHES_EXEC'] = str(branchCovered)
+    data['BRANCHES_TOTAL'] = str(branchTotal)
+    coverage = calculate_coverage(branchCovered, branchTotal, nan_value=None)
+    data['BRANCHES_COVERAGE'] = '-' if coverage is None else str(coverage)
+    data['BRANCHES_COLOR'] = coverage_to_color(coverage)
+
+    lineTotal, lineCovered, tmp = cdata.coverage(show_branch=False)
+    data['LINES_EXEC'] = str(lineCovered)
+    data['LINES_TOTAL'] = str(lineTotal)
+    coverage = calculate_coverage(lineCovered, lineTotal)
+    data['LINES_COVERAGE'] = str(coverage)
+    data['LINES_COLOR'] = coverage_to_color(coverage)
+
+    INPUT = open(os.path.join(options.root_dir, filename), 'r')
+    data['ROWS'] = source_rows(INPUT, cdata)
+    INPUT.close()
+
+    htmlString = source_page.substitute(**data)
+    OUTPUT = open(sourcefile, 'w')
+    OUTPUT.write(htmlString + '\n')
+    OUTPUT.close()
+
+
+def branch_cells(branches):
+    """Render the ticks and crosses of the branches of a line."""
+    cells = []
+    for i, (branch, count) in enumerate(branches, 1):
+        if count > 0:
+            cells.append(taken_branch.format(branch, count))
+        else:
+            cells.append(not_taken_branch.format(branch))
+        # Wrap at 4 branches to avoid too wide column
+        if i % 4 == 0:
+            cells.append('<br/>')
+    return ''.join(cells)
+
+
+def line_cells(cdata):
+    """Precompute the (class, branches, count) cells of the lines of a file.
+
+    returns: a list indexed by line number, up to the last executable line
+    """
+    lines = cdata.lines
+    cells = [no_cells] * (lines[-1] + 1 if lines else 0)
+    for line, state, count, branches in cdata.line_records():
+        if not state & COVERED:
+            cells[line] = (line_classes[state], '', '')
+        elif branches is None:
+            cells[line] = (line_classes[state], '', str(count))
+        else:
+            cells[line] = (
+                line_classes[state], branch_cells(branches), str(count))
+    return cells
+
+
+def source_rows(source_lines, cdata):
+    """Render the rows of a source page in one pass.
+
+    source_lines: the lines of the source file, e.g. the open file
+    returns: the rows, joined by newlines
+    """
+    cells = line_cells(cdata)
+    ncells = len(cells)
+    fill = source_row.format
+    rows = []
+    append = rows.append
+    for lineno, line in enumerate(source_lines, 1):
+        covclass, linebranch, linecount = \
+            cells[lineno] if lineno < ncells else no_cells
+        append(fill(
+            lineno, covclass, linebranch, linecount,
+            html_escape(line.rstrip())))
+    return '\n'.join(rows)
 
 
 #
@@ -728,20 +1016,6 @@ def source_row(lineno, source, cdata):
 def html_row(options, details, sourcefile, nrows, **kwargs):
     if details and options.relative_anchors:
         sourcefile = os.path.basename(sourcefile)
-    rowstr = Template('''
-    <tr>
-      <td class="coverFile" ${altstyle}>${filename}</td>
-      <td class="coverBar" align="center" ${altstyle}>
-        <table border=0 cellspacing=0 cellpadding=1><tr><td class="coverBarOutline">
-                <div class="graph"><strong class="bar" style="width:${LinesCoverage}%; ${BarBorder}background-color:${LinesBar}"></strong></div>
-                </td></tr></table>
-      </td>
-      <td class="CoverValue" style="font-weight:bold; background-color:${LinesColor};">${LinesCoverage}&nbsp;%</td>
-      <td class="CoverValue" style="font-weight:bold; background-color:${LinesColor};">${LinesExec} / ${LinesTotal}</td>
-      <td class="CoverValue" style="background-color:${BranchesColor};">${BranchesCoverage}&nbsp;%</td>
-      <td class="CoverValue" style="background-color:${BranchesColor};">${BranchesExec} / ${BranchesTotal}</td>
-    </tr>
-''')
     if nrows % 2 == 0:
         kwargs['altstyle'] = 'style="background-color:LightSteelBlue"'
     else:
@@ -769,4 +1043,4 @@ def html_row(options, details, sourcefile, nrows, **kwargs):
     kwargs['BranchesColor'] = coverage_to_color(kwargs['BranchesCoverage'])
     kwargs['BranchesCoverage'] = '-' if kwargs['BranchesCoverage'] is None else round(kwargs['BranchesCoverage'], 1)
 
-    return rowstr.substitute(**kwargs)
+    return file_row.format(**kwargs)
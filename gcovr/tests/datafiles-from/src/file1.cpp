@@ -0,0 +1,5 @@
+
+int bar()
+{
+return 0;
+}
@@ -0,0 +1,6 @@
+int unused(int x)
+{
+    if (x > 0)
+        return x;
+    return -x;
+}
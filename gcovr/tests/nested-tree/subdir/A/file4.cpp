@@ -0,0 +1,8 @@
+int foobar(int param)
+{
+  if (param) {
+     return 1;
+  } else {
+     return 0;
+  }
+}
@@ -0,0 +1,4 @@
+int uncovered()
+{
+return 0;
+}
@@ -0,0 +1,11 @@
+#include "a.h"
+
+int mix(int x)
+{
+    Acc<int> acc = {x};
+    for (int i = 0; i < x; ++i)
+        acc.add(scale(i));
+    return acc.total;
+}
+
+int shift(int x) { Acc<int> acc = {x}; acc.add(scale(x)); return acc.total; }
@@ -0,0 +1,10 @@
+inline int scale(int x) { return x > 3 ? x * 3 : x + 1; }
+
+template <typename T>
+struct Acc {
+    T total;
+    void add(T x) { if (x % 2) total += x; else total -= x; }
+};
+
+int mix(int x);
+int shift(int x);
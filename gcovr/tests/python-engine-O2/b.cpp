@@ -0,0 +1,12 @@
+#include "a.h"
+
+int main(int argc, char* argv[])
+{
+    Acc<long> acc = {0};
+    for (int i = 0; i < argc + 6; ++i) {
+        acc.add(scale(i));
+        if (acc.total > 100)
+            break;
+    }
+    return mix(argc + 4) + shift(argc) + (int) acc.total > 1000 ? 1 : 0;
+}
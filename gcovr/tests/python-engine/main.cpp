@@ -0,0 +1,35 @@
+#include <stdexcept>
+
+template <typename T>
+T twice(T x) { return x + x; }
+
+int check(int x)
+{
+    if (x > 2)
+        throw std::runtime_error("too large");
+    return x;
+}
+
+int main(int argc, char* argv[])
+{
+    int sum = 0;
+    for (int i = 0; i < 10; ++i) sum += i; while (sum > 3) sum /= 2;
+
+    for (int i = 0; i < 5; ++i) {
+        try {
+            sum += check(i);
+        } catch (const std::exception&) {
+            sum -= 1;
+        }
+    }
+
+    switch (argc) {
+    case 1:
+        sum += twice(1);
+        break;
+    default:
+        sum += (int) twice(2.0);
+    }
+
+    return sum > 100 ? 1 : 0;
+}
@@ -78,3 +78,10 @@ def test_line_threshold_100_1(capsys):
     assert c.out == ''
     assert 'not in range [0.0, 100.0]' in c.err
     assert c.exception.code != 0
+
+
+def test_cache_with_keep(capsys, tmpdir):
+    c = capture(capsys, [
+        '-r', str(tmpdir), '-k', '--cache', str(tmpdir.join('cache'))])
+    assert 'Ignoring the --cache option, as --keep is set.' in c.err
+    assert not tmpdir.join('cache').check()
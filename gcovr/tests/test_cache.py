@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import os
+import pickle
+import re
+import zlib
+
+from argparse import Namespace
+
+from ..cache import ResultCache, hash_file
+from ..coverage import CoverageData
+from ..gcov import (
+    find_datafile_covdata, load_cached_coverage, process_existing_gcov_file,
+    store_cached_coverage)
+
+
+def test_store_and_load(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=('a',))
+    cov = CoverageData('file.cpp')
+    cov.update(
+        uncovered=set([2]), uncovered_exceptional=set(), covered={1: 3},
+        branches={1: {0: 1, 1: 0}}, noncode=set())
+
+    key = cache.key('datafile', 'file.gcda')
+    assert cache.load(key) is None
+    cache.store(key, cov.__getstate__())
+
+    loaded = CoverageData.from_state(cache.load(key))
+    assert loaded.fname == 'file.cpp'
+    assert loaded.covered == {1: 3}
+    assert loaded.uncovered == set([2])
+    assert loaded.all_lines == set([1, 2])
+    assert loaded.branches == {1: {0: 1, 1: 0}}
+
+
+def test_key_options(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=('a',))
+    other = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=('b',))
+    assert cache.key('file.gcda') == cache.key('file.gcda')
+    assert cache.key('file.gcda') != other.key('file.gcda')
+    assert cache.key('file.gcda', 1) != cache.key('file.gcda', 2)
+
+
+def test_corrupt_entry(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=())
+    key = cache.key('file.gcda')
+    cache.store(key, {})
+    with open(cache.path(key), 'wb') as stream:
+        stream.write(b'garbage')
+    assert cache.load(key) is None
+
+
+def test_pickle_entry(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=())
+    key = cache.key('file.gcda')
+    cache.store(key, [])
+    # Entries are never unpickled, which could run any code
+    with open(cache.path(key), 'wb') as stream:
+        stream.write(zlib.compress(pickle.dumps(CoverageData('file.cpp'))))
+    assert cache.load(key) is None
+
+
+def test_foreign_entry(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=())
+    key = cache.key('datafile', 'foo.gcda')
+    cache.store(key, {'not': 'an entry'})
+    stats = dict()
+    assert not load_cached_coverage(cache, key, dict(), stats)
+    assert stats == {'cache_misses': 1}
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = ResultCache(str(tmpdir), size_limit=1 << 20, key_options=())
+    keys = [cache.key(i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store(key, {'data': list(bytearray(os.urandom(1000)))})
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+    # A hit makes the oldest entry the most recently used one
+    assert cache.load(keys[0]) is not None
+
+    cache.size_limit = sum(
+        os.path.getsize(cache.path(key)) for key in (keys[0], keys[2]))
+    assert cache.evict() == 1
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[0]) is not None
+    assert cache.load(keys[2]) is not None
+
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_hash_file(tmpdir):
+    filename = str(tmpdir.join('file.gcda'))
+    assert hash_file(filename) is None
+    tmpdir.join('file.gcda').write('data')
+    assert hash_file(filename) == hash_file(filename)
+    first = hash_file(filename)
+    tmpdir.join('file.gcda').write('other data')
+    assert hash_file(filename) != first
+
+
+GCOV_FILE = """\
+        -:    0:Source:foo.c
+        -:    1:int foo(int x) {
+        1:    2:    if (x)
+branch  0 taken 1
+branch  1 taken 0
+    #####:    3:        return 1;
+        1:    4:    return 0;
+        -:    5:}
+"""
+
+
+def test_gcov_file_cache(tmpdir):
+    tmpdir.join('foo.c').write('')
+    gcov_fname = str(tmpdir.join('foo.c.gcov'))
+    tmpdir.join('foo.c.gcov').write(GCOV_FILE)
+    root_dir = str(tmpdir)
+    options = Namespace(
+        verbose=False, keep=True, root_dir=root_dir, starting_dir=root_dir,
+        root_filter=re.compile(re.escape(root_dir + os.sep)),
+        filter=[re.compile('')], exclude=[],
+        gcov_filter=[re.compile('')], gcov_exclude=[],
+        exclude_unreachable_branches=False, gcov_ignore_parse_errors=False)
+    cache = ResultCache(
+        str(tmpdir.join('cache')), size_limit=1 << 20, key_options=())
+
+    results = []
+    stats = dict()
+    for _ in range(2):
+        covdata = dict()
+        process_existing_gcov_file(
+            gcov_fname, covdata, options, toerase=set(), workdir=None,
+            stats=stats, wd_cache=None, cache=cache)
+        results.append(covdata)
+    assert stats == {'cache_hits': 1, 'cache_misses': 1}
+
+    cold, warm = [covdata[str(tmpdir.join('foo.c'))] for covdata in results]
+    assert warm.covered == cold.covered == {2: 1, 4: 1}
+    assert warm.uncovered == cold.uncovered == set([3])
+    assert warm.branches == cold.branches == {2: {0: 1, 1: 0}}
+
+    # Another file with the same contents shares the entry
+    tmpdir.join('copy.c.gcov').write(GCOV_FILE)
+    process_existing_gcov_file(
+        str(tmpdir.join('copy.c.gcov')), dict(), options, toerase=set(),
+        workdir=None, stats=stats, wd_cache=None, cache=cache)
+    assert stats == {'cache_hits': 2, 'cache_misses': 1}
+
+
+def test_datafile_cache_checks_sources(tmpdir):
+    source = tmpdir.join('foo.c')
+    source.write('int x; // GCOVR_EXCL_LINE\n')
+    cov = CoverageData(str(source))
+    cov.update(
+        uncovered=set(), uncovered_exceptional=set(), covered={1: 1},
+        branches={}, noncode=set())
+    cache = ResultCache(
+        str(tmpdir.join('cache')), size_limit=1 << 20, key_options=())
+    key = cache.key('datafile', 'foo.gcda')
+    store_cached_coverage(cache, key, {str(source): cov})
+
+    stats = dict()
+    covdata = dict()
+    assert load_cached_coverage(cache, key, covdata, stats)
+    assert covdata[str(source)].covered == {1: 1}
+
+    # Editing an exclusion marker changes neither the gcda nor the gcno
+    source.write('int x;\n')
+    assert not load_cached_coverage(cache, key, dict(), stats)
+    assert stats == {'cache_hits': 1, 'datafiles': 1, 'cache_misses': 1}
+
+
+def test_batch_gcov_files_by_datafile():
+    first, second = dict(), dict()
+    datafile_covdata = {'a.gcda': first, 'a#b.gcda': second}
+    assert find_datafile_covdata(
+        datafile_covdata, '/obj/tmpabc#a.gcda##a.cpp.gcov') is first
+    assert find_datafile_covdata(
+        datafile_covdata, 'a.gcda###usr#include#a.h.gcov') is first
+    assert find_datafile_covdata(
+        datafile_covdata, 'a#b.gcda##b.cpp.gcov') is second
+    assert find_datafile_covdata(
+        datafile_covdata, 'tmpabc#a#b.gcda##b.cpp.gcov') is second
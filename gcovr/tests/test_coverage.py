@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import pickle
+
+import pytest
+
+from ..coverage import (
+    CoverageData, merge_covdata, COVERED, UNCOVERED, UNCOVERED_EXCEPTIONAL)
+from ..utils import get_global_stats
+
+
+def make_coverage(covered, uncovered=(), uncovered_exceptional=(),
+                  branches=None):
+    cov = CoverageData('file.cpp')
+    cov.update(
+        uncovered=set(uncovered),
+        uncovered_exceptional=set(uncovered_exceptional),
+        covered=dict(covered), branches=branches or {}, noncode=set())
+    return cov
+
+
+def test_line_records():
+    cov = make_coverage(
+        covered={1: 3, 7: 1}, uncovered=[4], uncovered_exceptional=[5],
+        branches={1: {1: 0, 0: 2}, 3: {0: 1}})
+    assert list(cov.line_records()) == [
+        (1, COVERED, 3, [(0, 2), (1, 0)]),
+        (4, UNCOVERED, 0, None),
+        (5, UNCOVERED_EXCEPTIONAL, 0, None),
+        (7, COVERED, 1, None),
+    ]
+    assert cov.branches == {1: {0: 2, 1: 0}, 3: {0: 1}}
+    assert cov.coverage(show_branch=False) == (4, 2, '50')
+    assert cov.coverage(show_branch=True) == (3, 2, '66')
+    assert cov.uncovered_str(exceptional=False, show_branch=True) == '1'
+
+
+@pytest.mark.parametrize('same_lines', [True, False])
+def test_merge(same_lines):
+    cov = make_coverage(
+        covered={1: 3}, uncovered=[2, 4], branches={1: {0: 1, 1: 0}})
+    if same_lines:
+        other = make_coverage(
+            covered={2: 1, 4: 2}, uncovered=[1], branches={1: {0: 1, 1: 5}})
+    else:
+        other = make_coverage(
+            covered={2: 1, 3: 2}, uncovered=[5], branches={3: {0: 1}})
+
+    target = {'file.cpp': cov}
+    merge_covdata(target, {'file.cpp': other})
+    merged = target['file.cpp']
+
+    if same_lines:
+        assert merged.covered == {1: 3, 2: 1, 4: 2}
+        assert merged.uncovered == set()
+        assert merged.branches == {1: {0: 2, 1: 5}}
+    else:
+        assert merged.covered == {1: 3, 2: 1, 3: 2}
+        assert merged.uncovered == set([4, 5])
+        assert merged.branches == {1: {0: 1, 1: 0}, 3: {0: 1}}
+
+
+def test_pickle():
+    cov = make_coverage(
+        covered={1: 1 << 40}, uncovered=[2], branches={2: {0: 0, 1: 0}})
+    loaded = pickle.loads(pickle.dumps(cov, pickle.HIGHEST_PROTOCOL))
+    assert list(loaded.line_records()) == list(cov.line_records())
+    loaded.merge(cov)
+    assert loaded.covered == {1: 1 << 41}
+
+
+def test_stats():
+    cov = make_coverage(
+        covered={1: 3}, uncovered=[2], branches={1: {0: 1, 1: 0}})
+    assert cov.stats() == (2, 1, 2, 1)
+    assert cov.stats() is cov.stats()
+
+    cov.merge(make_coverage(covered={2: 1}, branches={1: {1: 4}}))
+    assert cov.stats() == (2, 2, 2, 2)
+    cov.update(
+        uncovered=set([5]), uncovered_exceptional=set(), covered={},
+        branches={}, noncode=set())
+    assert cov.stats() == (3, 2, 2, 2)
+
+    other = make_coverage(covered={}, uncovered=[1])
+    assert get_global_stats({'a.cpp': cov, 'b.cpp': other}) == (
+        4, 2, 50.0, 2, 2, 100.0)
@@ -0,0 +1,223 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import io
+import json
+import os
+import struct
+
+import pytest
+
+from .. import gcno
+from ..gcno import (
+    decode_gcov_version, parse_gcno_header, read_compile_commands,
+    read_coverage, GcovFormatError)
+
+
+def gcno_header(version, cwd, byte_order='<'):
+    """Build the start of a .gcno file like the given GCC version would."""
+    def unsigned(value):
+        return struct.pack(byte_order + 'I', value)
+
+    data = unsigned(0x67636e6f) + unsigned(struct.unpack(
+        '>I', version.encode('ascii'))[0]) + unsigned(12345)
+    if version >= 'B2':
+        # GCC 12: checksum, string length in bytes
+        data += unsigned(0) + unsigned(len(cwd) + 1) + cwd + b'\0'
+    elif version >= 'A8':
+        # GCC 8 to 11: string length in words, padded
+        length = len(cwd) // 4 + 1
+        data += unsigned(length) + cwd.ljust(4 * length, b'\0')
+    return data + unsigned(1)
+
+
+@pytest.mark.parametrize('version, expected', [
+    ('408*', (4, 8)),
+    ('A75*', (7, 5)),
+    ('A93*', (9, 3)),
+    ('B22*', (12, 2)),
+])
+def test_decode_gcov_version(version, expected):
+    word = struct.unpack('>I', version.encode('ascii'))[0]
+    assert decode_gcov_version(word) == expected
+
+
+@pytest.mark.parametrize('version, byte_order', [
+    ('A82*', '<'),
+    ('A93*', '>'),
+    ('B22*', '<'),
+    ('B22*', '>'),
+])
+def test_gcno_header(version, byte_order):
+    for cwd in [b'/build', b'/home/user/build']:
+        stream = io.BytesIO(gcno_header(version, cwd, byte_order))
+        header = parse_gcno_header(stream)
+        assert header['stamp'] == 12345
+        assert header['cwd'] == cwd.decode('ascii')
+
+
+def test_gcno_header_without_cwd():
+    header = parse_gcno_header(io.BytesIO(gcno_header('A75*', b'/build')))
+    assert header == dict(version=(7, 5), stamp=12345, cwd=None)
+
+
+def test_gcno_header_invalid():
+    assert parse_gcno_header(io.BytesIO(b'not a gcno file')) is None
+    truncated = gcno_header('B22*', b'/build')[:24]
+    assert parse_gcno_header(io.BytesIO(truncated)) is None
+
+
+def test_compile_commands(tmpdir):
+    database = [
+        {'directory': '/build', 'file': '../src/a.cpp',
+         'command': 'g++ -c ../src/a.cpp -o obj/a.o'},
+        {'directory': '/build', 'file': '../src/b.cpp',
+         'arguments': ['g++', '-c', '../src/b.cpp', '-oobj/b.cpp.o']},
+        {'directory': '/build/c', 'file': 'c.cpp',
+         'command': 'g++ -c c.cpp'},
+        {'directory': '/build', 'file': 'd.cpp', 'output': '../obj/d.o',
+         'command': 'g++ -c d.cpp -o ../obj/d.o'},
+    ]
+    filename = str(tmpdir.join('compile_commands.json'))
+    with open(filename, 'w') as stream:
+        json.dump(database, stream)
+
+    def stem(path):
+        return path.replace('/', os.sep)
+
+    assert read_compile_commands(filename) == {
+        stem('/build/obj/a'): '/build',
+        stem('/build/obj/b.cpp'): '/build',
+        stem('/build/c/c'): '/build/c',
+        stem('/obj/d'): '/build',
+    }
+
+
+class GcovWriter(object):
+    """Write .gcno and .gcda files like the given GCC version would."""
+
+    def __init__(self, version):
+        self.version = version
+        self.bytes_ = version >= 'B2'  # GCC 12 counts lengths in bytes
+
+    def unsigned(self, *values):
+        return b''.join(struct.pack('<I', value) for value in values)
+
+    def string(self, value):
+        data = value.encode('utf-8') + b'\0'
+        if self.bytes_:
+            return self.unsigned(len(data)) + data
+        length = (len(data) + 3) // 4
+        return self.unsigned(length) + data.ljust(4 * length, b'\0')
+
+    def record(self, tag, payload, length=None):
+        if length is None:
+            length = len(payload) if self.bytes_ else len(payload) // 4
+        return self.unsigned(tag) + struct.pack('<i', length) + payload
+
+    def header(self, magic):
+        data = self.unsigned(struct.unpack('>I', magic)[0]) + self.unsigned(
+            struct.unpack('>I', self.version.encode('ascii'))[0], 12345)
+        if self.bytes_:
+            data += self.unsigned(0)  # checksum
+        return data
+
+
+def write_branch_function(writer, stem, counts):
+    """A function with an if/else on line 1, and its branches on 2 and 3.
+
+    Blocks: 0 entry, 1 exit, 2 the condition, 3 and 4 the branches.
+    The arcs from the condition are counted, all other arcs are
+    on the spanning tree.
+    """
+    u = writer.unsigned
+    gcno = writer.header(b'gcno') + writer.string('/build') + u(1)
+    gcno += writer.record(0x01000000, u(7, 8, 9) + writer.string('f') + u(0) +
+                          writer.string('f.c') + u(1, 1, 3, 1))
+    gcno += writer.record(0x01410000, u(5))
+    gcno += writer.record(0x01430000, u(0, 2, 5))
+    gcno += writer.record(0x01430000, u(2, 3, 4, 4, 0))
+    gcno += writer.record(0x01430000, u(3, 1, 1))
+    gcno += writer.record(0x01430000, u(4, 1, 1))
+    for block, line in [(2, 1), (3, 2), (4, 3)]:
+        gcno += writer.record(0x01450000, u(block, 0) + writer.string('f.c') +
+                              u(line, 0) + u(0))
+    with open(stem + '.gcno', 'wb') as stream:
+        stream.write(gcno)
+
+    if counts is None:
+        return
+    gcda = writer.header(b'gcda')
+    gcda += writer.record(0x01000000, u(7, 8, 9))
+    if any(counts) or not writer.bytes_:
+        gcda += writer.record(0x01a10000, b''.join(
+            u(count, 0) for count in counts))
+    else:
+        # GCC 12 writes all-zero counters without data
+        gcda += writer.record(0x01a10000, b'', length=-8 * len(counts))
+    with open(stem + '.gcda', 'wb') as stream:
+        stream.write(gcda)
+
+
+def line_counts(document):
+    [file_] = document['files']
+    assert file_['file'] == 'f.c'
+    return [
+        (line['line_number'], line['count'],
+         [branch['count'] for branch in line['branches']])
+        for line in file_['lines']]
+
+
+@pytest.mark.parametrize('version', ['A93*', 'B22*'])
+def test_read_coverage(tmpdir, version):
+    stem = str(tmpdir.join('f'))
+    write_branch_function(GcovWriter(version), stem, [3, 1])
+    document = read_coverage(stem + '.gcda')
+    assert document['current_working_directory'] == '/build'
+    assert line_counts(document) == [(1, 4, [3, 1]), (2, 3, []), (3, 1, [])]
+
+
+@pytest.mark.parametrize('version', ['A93*', 'B22*'])
+def test_read_coverage_not_executed(tmpdir, version):
+    stem = str(tmpdir.join('f'))
+    write_branch_function(GcovWriter(version), stem, [0, 0])
+    assert line_counts(read_coverage(stem + '.gcda')) == [
+        (1, 0, [0, 0]), (2, 0, []), (3, 0, [])]
+
+    # Without a .gcda file, nothing was executed either
+    write_branch_function(GcovWriter(version), stem, None)
+    tmpdir.join('f.gcda').remove()
+    assert line_counts(read_coverage(stem + '.gcno')) == [
+        (1, 0, [0, 0]), (2, 0, []), (3, 0, [])]
+
+
+def test_read_coverage_unsupported(tmpdir):
+    stem = str(tmpdir.join('f'))
+    with pytest.raises(GcovFormatError):
+        read_coverage(stem + '.gcda')
+
+    tmpdir.join('f.gcno').write_binary(gcno_header('A75*', b''))
+    with pytest.raises(GcovFormatError):
+        read_coverage(stem + '.gcda')
+
+    # The counters do not fit the flow graph
+    write_branch_function(GcovWriter('B22*'), stem, [1, 2, 3])
+    with pytest.raises(GcovFormatError):
+        read_coverage(stem + '.gcda')
+
+
+def test_read_coverage_internal_error(tmpdir, monkeypatch):
+    stem = str(tmpdir.join('f'))
+    write_branch_function(GcovWriter('B22*'), stem, [3, 1])
+
+    def broken(function):
+        return [][function.ident]
+
+    # A graph the reader gets wrong must still fall back to gcov
+    monkeypatch.setattr(gcno, 'solve_flow_graph', broken)
+    with pytest.raises(GcovFormatError):
+        read_coverage(stem + '.gcda')
@@ -6,15 +6,19 @@
 # Copyright 2013 Sandia Corporation
 # This software is distributed under the BSD license.
 
+import os
 import re
 import pytest
 import time
 
 from threading import Event
 
-from ..gcov import GcovParser
+from ..coverage import CoverageData
+from ..gcov import (
+    GcovParser, group_datafiles, merge_results, select_datafiles,
+    split_gcov_sections)
 from ..utils import Logger
-from ..workers import Workers
+from ..workers import Prefetcher, Scheduler, Workers, WorkingDirectoryCache
 
 # This example is taken from the GCC 8 Gcov documentation:
 # <https://gcc.gnu.org/onlinedocs/gcc/Invoking-Gcov.html>
@@ -174,8 +178,9 @@ GCOV_8_EXPECTED_UNCOVERED_BRANCHES = dict(
     nautilus_example='51')
 
 
+@pytest.mark.parametrize('binary', [False, True])
 @pytest.mark.parametrize('sourcename', sorted(GCOV_8_SOURCES))
-def test_gcov_8(capsys, sourcename):
+def test_gcov_8(capsys, sourcename, binary):
     """Verify support for GCC 8 .gcov files.
 
     GCC 8 introduces two changes:
@@ -186,6 +191,8 @@ def test_gcov_8(capsys, sourcename):
 
     source = GCOV_8_SOURCES[sourcename]
     lines = source.splitlines()[1:]
+    if binary:
+        lines = [line.encode('utf-8') for line in lines]
     expected_uncovered_lines = GCOV_8_EXPECTED_UNCOVERED_LINES[sourcename]
     expected_uncovered_branches = GCOV_8_EXPECTED_UNCOVERED_BRANCHES[sourcename]
 
@@ -193,7 +200,8 @@ def test_gcov_8(capsys, sourcename):
     parser.parse_all_lines(
         lines,
         exclude_unreachable_branches=False,
-        ignore_parse_errors=False)
+        ignore_parse_errors=False,
+        binary=binary)
 
     covdata = {}
     parser.update_coverage(covdata)
@@ -210,6 +218,124 @@ def test_gcov_8(capsys, sourcename):
     assert (out, err) == ('', '')
 
 
+def test_split_gcov_sections():
+    """Verify that concatenated "gcov --stdout" reports are split by file."""
+    lines = (GCOV_8_EXAMPLE + GCOV_8_NAUTILUS).splitlines(True)[1:]
+
+    sections = []
+    for source_line, section in split_gcov_sections(lines):
+        if 'nautilus' in source_line:
+            # skipping the rest of a section must be possible
+            sections.append((source_line.strip(), None))
+            continue
+        sections.append((source_line.strip(), list(section)))
+
+    assert [source for source, _ in sections] == [
+        '-:    0:Source:tmp.cpp',
+        '-:    0:Source:../src/nautilus-freedesktop-dbus.c']
+    assert sections[0][1][0].strip() == '-:    0:Graph:tmp.gcno'
+    assert sections[0][1][-1].strip() == '-:   37:}'
+
+
+def test_json_lines():
+    """Verify that JSON records are processed like the text report."""
+    source_lines = [
+        'int foo(int x) {\n',
+        '    if (x)\n',
+        '        return 1;  // GCOVR_EXCL_LINE\n',
+        '    return 0;\n',
+        '}\n',
+    ]
+    records = [
+        {'line_number': 1, 'count': 1, 'branches': []},
+        {'line_number': 2, 'count': 1, 'branches': [
+            {'count': 1}, {'count': 0}]},
+        {'line_number': 3, 'count': 0, 'branches': []},
+        {'line_number': 4, 'count': 1, 'branches': [
+            {'count': 0}, {'count': 1}]},
+        # a second instance of an inline function adds up
+        {'line_number': 4, 'count': 2, 'branches': [
+            {'count': 1}, {'count': 0}]},
+    ]
+
+    parser = GcovParser("foo.c", Logger())
+    parser.parse_json_lines(
+        records, source_lines, exclude_unreachable_branches=False)
+    covdata = {}
+    parser.update_coverage(covdata)
+    coverage = covdata['foo.c']
+
+    assert coverage.uncovered_str(
+        exceptional=False, show_branch=False) == ''
+    assert coverage.uncovered_str(
+        exceptional=False, show_branch=True) == '2'
+    assert coverage.branches[4] == {0: 1, 1: 1}
+    assert 3 not in coverage.all_lines
+
+
+def test_unreachable_branches():
+    """Verify that branches of lines without user code are excluded."""
+    lines = r"""
+        -:    0:Source:foo.c
+        1:    1:int foo(int x) {  // entry
+branch  0 taken 1
+        1:    2:    if (x)
+branch  0 taken 1
+branch  1 taken 0
+        1:    3:        return 1;  // GCOVR_EXCL_LINE
+branch  0 taken 1
+        1:    4:/* end */ }  // of foo
+branch  0 taken 0
+branch  1 taken 1 (fallthrough)
+------------------
+foo:
+        1:    5:  { }
+branch  0 taken 1
+------------------
+        -:    6:
+    #####:    7:} /* unreachable */
+branch  0 never executed
+""".splitlines()[1:]
+
+    parser = GcovParser("foo.c", Logger())
+    parser.parse_all_lines(
+        lines,
+        exclude_unreachable_branches=True,
+        ignore_parse_errors=False)
+    covdata = {}
+    parser.update_coverage(covdata)
+
+    assert covdata['foo.c'].branches == {1: {0: 1}, 2: {0: 1, 1: 0}}
+
+
+def test_binary_lines():
+    """Verify that undecoded lines are parsed like text lines."""
+    lines = u"""
+        -:    1:/* \u00e9t\u00e9 */
+        -:    2:\u00a0
+    #####:    3:\u3000}\u3000
+        2:    4:    x = "\u00e9";  // LCOV_EXCL_LINE
+        2:    5:    {  // \u00e9
+branch  0 taken 1
+        1:    6:    return x;
+""".splitlines(True)[1:]
+
+    def parse(lines, binary):
+        parser = GcovParser("foo.c", Logger())
+        parser.parse_all_lines(
+            lines,
+            exclude_unreachable_branches=True,
+            ignore_parse_errors=False,
+            binary=binary)
+        return (parser.noncode, parser.uncovered, parser.covered,
+                parser.branches)
+
+    expected = (set([2, 3, 4]), set(), {5: 2, 6: 1}, {})
+    assert parse(lines, binary=False) == expected
+    assert parse(
+        [line.encode('utf-8') for line in lines], binary=True) == expected
+
+
 def contains_phrases(string, *phrases):
     phrase_re = re.compile(
         '.*'.join(re.escape(p) for p in phrases),
@@ -319,3 +445,168 @@ def test_pathologic_threads(capsys, threads):
     # first job throws an exception and every other thread
     # can action at most one job before the queue is drained
     assert len(mutable) <= threads - 1
+
+
+def test_working_directory_cache():
+    cache = WorkingDirectoryCache()
+    assert cache.lookup('/build/src/a', '/tmp/one') is None
+
+    cache.store('/build/src', '/build', '/tmp/one')
+    cache.store('/build/tmp', '/tmp/one', '/tmp/one')
+
+    # subdirectories fall back to their closest parent directory
+    assert cache.lookup('/build/src', '/tmp/one') == '/build'
+    assert cache.lookup('/build/src/a/b', '/tmp/one') == '/build'
+    assert cache.lookup('/build/lib', '/tmp/one') is None
+
+    # the working directory of a thread is not shared with the others
+    assert cache.lookup('/build/tmp', '/tmp/two') == '/tmp/two'
+
+
+def cover_line(number, covdata):
+    if number == 0:
+        raise ValueError("Number == 0")
+    coverage = CoverageData('file{0}.c'.format(number))
+    coverage.update(
+        uncovered=set([1]), uncovered_exceptional=set(),
+        covered={number: os.getpid()}, branches={}, noncode=set())
+    covdata[coverage.fname] = coverage
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_worker_processes(processes):
+    with Workers(processes, lambda: {'covdata': {}}, processes=True) as pool:
+        for number in range(1, 20):
+            pool.add(cover_line, number)
+        contexts = pool.wait()
+
+    covdata = {}
+    for context in contexts:
+        covdata.update(context['covdata'])
+    assert len(covdata) == 19
+    for number in range(1, 20):
+        coverage = covdata['file{0}.c'.format(number)]
+        assert coverage.all_lines == set([1, number])
+        assert coverage.covered[number] != os.getpid()
+
+
+def test_pathologic_processes(capsys):
+    with pytest.raises(ValueError) as excinfo:
+        with Workers(2, lambda: {'covdata': {}}, processes=True) as pool:
+            for number in range(0, 100):
+                pool.add(cover_line, number)
+            pool.wait()
+
+    assert excinfo.value.args[0] == "Number == 0"
+    out, err = capsys.readouterr()
+    assert contains_phrases(err, 'Traceback', 'cover_line', 'Number == 0')
+
+
+def test_select_datafiles():
+    files = [
+        '/a/x.gcno', '/a/x.gcda', '/a/y.gcno',
+        '/b/z.gcda', '/b/z.gcno',
+    ]
+    selected = select_datafiles(iter(files))
+    # gcda files are not held back
+    assert next(selected) == '/a/x.gcda'
+    assert list(selected) == ['/a/y.gcno', '/b/z.gcda']
+
+
+def test_group_datafiles():
+    files = ['/a/1', '/a/3', '/a/2', '/b/1', '/a/4']
+    assert list(group_datafiles(files, 2)) == [
+        ['/a/1', '/a/3'], ['/a/2'], ['/b/1'], ['/a/4']]
+
+    flushes = iter([True, False, False, False, False])
+    assert list(group_datafiles(files, 8, flush=lambda: next(flushes))) == [
+        ['/a/1'], ['/a/2', '/a/3'], ['/b/1'], ['/a/4']]
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_worker_results(processes):
+    covdata = {}
+
+    def merge(results):
+        # every work item has its own results
+        assert len(results['covdata']) == 1
+        covdata.update(results['covdata'])
+
+    with Workers(2, lambda: {}, processes=processes,
+                 results={'covdata': {}}, merge=merge) as pool:
+        for number in range(1, 20):
+            pool.add(cover_line, number)
+        contexts = pool.wait()
+
+    assert contexts == [{}, {}]
+    assert sorted(covdata) == sorted(
+        'file{0}.c'.format(number) for number in range(1, 20))
+
+
+def cover_and_count(number, covdata, toerase, stats):
+    cover_line(number, covdata)
+    stats['items'] = 1
+
+
+def test_worker_reduce():
+    results = {'covdata': {}, 'toerase': set(), 'stats': {}}
+    merges = []
+
+    def merge(item_results):
+        merges.append(len(item_results['covdata']))
+        merge_results(results, item_results)
+
+    with Workers(2, lambda: {}, processes=True,
+                 results={'covdata': {}, 'toerase': set(), 'stats': {}},
+                 merge=merge, reduce=merge_results, batch=4) as pool:
+        for number in range(1, 20):
+            pool.add(cover_and_count, number)
+        pool.wait()
+
+    # every worker process sends the results of up to 4 work items
+    assert sum(merges) == 19
+    assert max(merges) <= 4
+    assert len(merges) <= 19 // 4 + 2
+    assert results['stats'] == {'items': 19}
+    assert sorted(results['covdata']) == sorted(
+        'file{0}.c'.format(number) for number in range(1, 20))
+
+
+def test_prefetcher():
+    calls = []
+
+    def square(key):
+        calls.append(key)
+        if key < 0:
+            raise ValueError(key)
+        return key * key
+
+    prefetcher = Prefetcher(square, 2)
+    try:
+        for key in (1, 2, -3):
+            prefetcher.prefetch(key)
+        assert prefetcher.get(2) == 4
+        assert prefetcher.get(1) == 1
+        with pytest.raises(ValueError):
+            prefetcher.get(-3)
+        # a key that was not prefetched is computed on the spot
+        assert prefetcher.get(4) == 16
+    finally:
+        prefetcher.close()
+    assert sorted(calls) == [-3, 1, 2, 4]
+
+
+def test_scheduler():
+    sizes = {'/a/1': 1, '/a/2': 5, '/b/1': 4, '/b/2': 4, '/c/1': 7}
+
+    def schedule(ready):
+        scheduler = Scheduler(sizes.get)
+        return list(scheduler.schedule(
+            sorted(sizes), directory=lambda item: item[:2], ready=ready))
+
+    # when all files are known, the directory with the largest total
+    # goes first, and its files stay together, largest first
+    assert schedule(lambda: False) == ['/b/1', '/b/2', '/c/1', '/a/2', '/a/1']
+
+    # when idle workers wait, files go out as they come
+    assert schedule(lambda: True) == sorted(sizes)
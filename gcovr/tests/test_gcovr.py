@@ -54,6 +54,13 @@ def scrub_html(contents):
     return contents
 
 
+# The test cases that are run again with other gcovr options,
+# chosen in their Makefile by the VARIANT variable
+VARIANTS = {
+    'threaded': ['batched', 'piped'],
+}
+
+
 def findtests(basedir):
     for f in os.listdir(basedir):
         if not os.path.isdir(os.path.join(basedir, f)):
@@ -63,6 +70,8 @@ def findtests(basedir):
         if 'pycache' in f:
             continue
         yield f
+        for variant in VARIANTS.get(f, []):
+            yield f + ':' + variant
 
 
 def assert_xml_equals(coverage, reference):
@@ -109,10 +118,11 @@ def test_build(name, format):
     if name == 'linked' and format == 'html' and is_windows:
         pytest.xfail("have yet to figure out symlinks on Windows")
 
+    name, _, variant = name.partition(':')
     os.chdir(os.path.join(basedir, name))
     assert run(["make", "clean"])
     assert run(["make"])
-    assert run(["make", format])
+    assert run(["make", format] + (["VARIANT=" + variant] if variant else []))
 
     for coverage_file, reference_file in find_reference_files(output_pattern):
         with open(coverage_file) as f:
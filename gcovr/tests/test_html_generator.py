@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import argparse
+import os
+import re
+
+import pytest
+
+from ..coverage import CoverageData
+from ..html_generator import directory_tree, print_html_report, source_rows
+
+
+def make_options(root, output, parallel=1, parallel_mode='auto',
+                 incremental=False):
+    return argparse.Namespace(
+        html_details=True, output=output, html_encoding='UTF-8',
+        root_dir=root, root_filter=re.compile(re.escape(root + os.sep)),
+        sort_uncovered=False, sort_percent=False, relative_anchors=False,
+        gcov_parallel=parallel, parallel_mode=parallel_mode,
+        html_incremental=incremental, html_tree=False)
+
+
+def make_sources(tmpdir, names):
+    root = os.path.realpath(str(tmpdir.mkdir('src')))
+    output = os.path.realpath(str(tmpdir.mkdir('html').join('coverage.html')))
+    covdata = {}
+    for name in names:
+        filename = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as stream:
+            stream.write('int %s;\nint main() { return 0; }\n' % name[0])
+        cov = CoverageData(filename)
+        cov.update(
+            uncovered=set([1]), uncovered_exceptional=set(),
+            covered={2: 4}, branches={}, noncode=set())
+        covdata[filename] = cov
+    return root, output, covdata
+
+
+@pytest.mark.parametrize('parallel, parallel_mode', [
+    (1, 'auto'), (2, 'threads'), (2, 'processes')])
+def test_details_in_parallel(tmpdir, parallel, parallel_mode):
+    root, output, covdata = make_sources(tmpdir, ('a.cpp', 'b.cpp', 'c.cpp'))
+
+    cwd = os.getcwd()
+    print_html_report(
+        covdata, make_options(root, output, parallel, parallel_mode))
+    # the sources are read by their path under the root
+    assert os.getcwd() == cwd
+
+    for name in ('a.cpp', 'b.cpp', 'c.cpp'):
+        with open(output[:-len('html')] + name + '.html') as stream:
+            page = stream.read()
+        assert '<pre>int %s;</pre>' % name[0] in page
+        assert 'uncoveredLine' in page
+        assert '<pre>4</pre>' in page
+
+
+def test_source_rows():
+    cov = CoverageData('file.cpp')
+    cov.update(
+        uncovered=set([2]), uncovered_exceptional=set(), covered={3: 7},
+        branches={3: dict((branch, branch % 2) for branch in range(5))},
+        noncode=set())
+    rows = source_rows(['a < b\n', '  b;  \n', 'c\n', 'd\n'], cov)
+    rows = rows.split('\n    <tr>')
+    assert len(rows) == 5
+    assert '<pre>a &lt; b</pre>' in rows[1]
+    assert 'class="src uncoveredLine"><pre>  b;</pre>' in rows[2]
+    assert 'class="linecount coveredLine"><pre>7</pre>' in rows[3]
+    assert rows[3].count('takenBranch"') == 2
+    assert rows[3].count('notTakenBranch"') == 3
+    assert rows[3].count('<br/>') == 1
+    assert 'class="src "><pre>d</pre>' in rows[4]
+
+
+def test_incremental(tmpdir):
+    root, output, covdata = make_sources(tmpdir, ('a.cpp', 'b.cpp', 'c.cpp'))
+    options = make_options(root, output, incremental=True)
+    pages = dict(
+        (name, output[:-len('html')] + name + '.html')
+        for name in ('a.cpp', 'b.cpp', 'c.cpp'))
+
+    def report():
+        for page in pages.values():
+            if os.path.exists(page):
+                os.utime(page, (0, 0))
+        print_html_report(covdata, options)
+        return sorted(
+            name for name, page in pages.items()
+            if os.path.getmtime(page) != 0)
+
+    assert report() == ['a.cpp', 'b.cpp', 'c.cpp']
+    assert report() == []
+
+    # the totals of the report change, but only one page
+    more = CoverageData(os.path.join(root, 'b.cpp'))
+    more.update(
+        uncovered=set(), uncovered_exceptional=set(),
+        covered={1: 3}, branches={}, noncode=set())
+    covdata[os.path.join(root, 'b.cpp')].merge(more)
+    assert report() == ['b.cpp']
+    with open(pages['b.cpp']) as stream:
+        assert 'class="src uncoveredLine"' not in stream.read()
+    with open(os.path.join(root, 'c.cpp'), 'a') as stream:
+        stream.write('// changed\n')
+    assert report() == ['c.cpp']
+
+    # a changed source, a changed coverage and a missing page
+    with open(os.path.join(root, 'a.cpp'), 'a') as stream:
+        stream.write('// changed\n')
+    covdata[os.path.join(root, 'b.cpp')].merge(
+        covdata[os.path.join(root, 'b.cpp')])
+    os.remove(pages['c.cpp'])
+    assert report() == ['a.cpp', 'b.cpp', 'c.cpp']
+    with open(pages['b.cpp']) as stream:
+        assert '<pre>8</pre>' in stream.read()
+
+    # the pages have other options
+    options.html_encoding = 'ISO-8859-1'
+    assert report() == ['a.cpp', 'b.cpp', 'c.cpp']
+    assert report() == []
+
+
+def test_directory_tree():
+    def name(*parts):
+        return os.path.join(*parts)
+
+    directories = directory_tree([
+        (name('a', 'b', 'x.cpp'), 'x.html', (1, 2, 0, 0)),
+        ('y.cpp', 'y.html', (3, 4, 1, 2)),
+        (name('a', 'z.cpp'), 'z.html', (0, 5, 0, 4)),
+        (name('c', 'd', 'e', 'w.cpp'), 'w.html', (2, 2, 2, 2)),
+    ])
+    assert sorted(directories) == sorted([
+        '', 'a', name('a', 'b'), 'c', name('c', 'd'), name('c', 'd', 'e')])
+    assert directories[''] == [
+        [6, 13, 3, 8], ['a', 'c'], [('y.cpp', 'y.html', (3, 4, 1, 2))]]
+    assert directories['a'][:2] == [[1, 7, 0, 4], [name('a', 'b')]]
+    assert [f[0] for f in directories['a'][2]] == [name('a', 'z.cpp')]
+    assert directories[name('c', 'd')] == [
+        [2, 2, 2, 2], [name('c', 'd', 'e')], []]
+
+
+def test_directory_page_of_source_named_index(tmpdir):
+    root, output, covdata = make_sources(tmpdir, [
+        'main.c', os.path.join('sub', 'index'), os.path.join('sub', 'o.c')])
+    options = make_options(root, output)
+    options.html_tree = True
+    print_html_report(covdata, options)
+
+    # the directory keeps its page, the source gets another one
+    with open(output.replace('.html', '.sub_index.html')) as stream:
+        directory_page = stream.read()
+    assert 'coverage.sub_index_1.html' in directory_page
+    assert 'coverage.sub_o.c.html' in directory_page
+    with open(output.replace('.html', '.sub_index_1.html')) as stream:
+        assert '<pre>int s;</pre>' in stream.read()
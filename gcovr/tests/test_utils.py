@@ -0,0 +1,152 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of gcovr <http://gcovr.com/>.
+#
+# Copyright 2013-2018 the gcovr authors
+# This software is distributed under the BSD license.
+
+import os
+import re
+
+import pytest
+
+from .. import utils
+from ..utils import (
+    combine_filters, read_directory, read_file_list, search_file)
+from ..workers import Prefetcher
+
+
+def make_tree(root):
+    for directory in ('src/a', 'src/b', 'build/obj', 'ext/obj'):
+        os.makedirs(os.path.join(root, directory))
+    for filename in ('src/a/x.gcda', 'src/b/y.gcno', 'build/obj/z.gcda',
+                     'ext/obj/w.gcda', 'src/a/x.cpp'):
+        open(os.path.join(root, filename), 'w').close()
+
+
+@pytest.fixture(params=['scandir', 'listdir', 'prefetch'])
+def prefetcher(request, monkeypatch):
+    """The prefetcher for search_file, if any, of every way to walk."""
+    if request.param == 'listdir':
+        monkeypatch.setattr(utils, 'scandir', None)
+    elif utils.scandir is None:
+        pytest.skip("os.scandir is not available")
+    if request.param != 'prefetch':
+        yield None
+        return
+    prefetcher = Prefetcher(read_directory, 3)
+    yield prefetcher
+    prefetcher.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="no symbolic links")
+def test_search_file_links(tmpdir, prefetcher):
+    root = os.path.realpath(str(tmpdir))
+    make_tree(root)
+    # a loop, an alias of a directory, and a link to a file
+    os.symlink(root, os.path.join(root, 'src', 'loop'))
+    os.symlink(os.path.join(root, 'src', 'a'), os.path.join(root, 'alias'))
+    os.symlink(os.path.join(root, 'src', 'b', 'y.gcno'),
+               os.path.join(root, 'ext', 'v.gcno'))
+
+    found = list(search_file(
+        r'.*\.gc(da|no)$', root, exclude_dirs=[], prefetcher=prefetcher))
+    # every directory is searched once
+    assert sorted(found) == sorted(os.path.join(root, name) for name in (
+        'src/a/x.gcda', 'src/b/y.gcno', 'build/obj/z.gcda',
+        'ext/obj/w.gcda', 'src/b/y.gcno'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="no symbolic links")
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_search_file_reads_aliases_once(tmpdir, monkeypatch, prefetch):
+    root = os.path.realpath(str(tmpdir))
+    make_tree(root)
+    os.symlink(root, os.path.join(root, 'src', 'loop'))
+    os.symlink(os.path.join(root, 'src', 'a'), os.path.join(root, 'alias'))
+    os.symlink(os.path.join(root, 'src'), os.path.join(root, 'build', 'src'))
+
+    listed = []
+
+    def counting_read_directory(directory):
+        listed.append(directory)
+        return read_directory(directory)
+
+    monkeypatch.setattr(utils, 'read_directory', counting_read_directory)
+    prefetcher = Prefetcher(counting_read_directory, 3) if prefetch else None
+    try:
+        found = list(search_file(
+            r'.*\.gc(da|no)$', root, exclude_dirs=[], prefetcher=prefetcher))
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+    assert len(found) == 4
+    # the links are followed, but no directory is listed twice
+    assert sorted(listed) == sorted(set(listed))
+    assert len(listed) == 8
+
+
+def test_search_file_exclude_dirs(tmpdir, prefetcher):
+    root = os.path.realpath(str(tmpdir))
+    make_tree(root)
+
+    exclude_dirs = [
+        re.compile(re.escape(os.path.join(root, 'build'))),
+        re.compile('.*' + re.escape(os.sep) + 'b$')]
+    found = list(search_file(
+        r'.*\.gc(da|no)$', root, exclude_dirs=exclude_dirs,
+        prefetcher=prefetcher))
+    assert sorted(found) == sorted(os.path.join(root, name) for name in (
+        'src/a/x.gcda', 'ext/obj/w.gcda'))
+
+
+def test_combine_filters():
+    assert combine_filters([]) is None
+
+    one = re.compile('a')
+    assert combine_filters([one]) is one
+
+    combined = combine_filters([re.compile('a+$'), re.compile('b')])
+    assert combined.match('aa')
+    assert combined.match('bc')
+    assert not combined.match('ab')
+    assert not combined.match('cb')
+
+    # filters with groups are not combined into one regex
+    combined = combine_filters([re.compile(r'(a)\1$'), re.compile('b')])
+    assert combined.match('aa')
+    assert combined.match('bc')
+    assert not combined.match('a')
+
+
+def test_search_file_order(tmpdir):
+    root = os.path.realpath(str(tmpdir))
+    for directory in range(20):
+        for subdirectory in range(5):
+            path = os.path.join(
+                root, str(directory), str(subdirectory), 'obj')
+            os.makedirs(path)
+            open(os.path.join(path, 'x.gcda'), 'w').close()
+
+    expected = list(search_file('.*', root, exclude_dirs=[]))
+    assert len(expected) == 100
+    prefetcher = Prefetcher(read_directory, 4)
+    try:
+        # the directories are read ahead, but found in the same order
+        assert list(search_file(
+            '.*', root, exclude_dirs=[], prefetcher=prefetcher)) == expected
+    finally:
+        prefetcher.close()
+
+
+@pytest.mark.parametrize('text', [
+    'a.gcda\nb c.o\n\nd.gcno',
+    'a.gcda\r\nb c.o\r\nd.gcno\r\n',
+    'a.gcda\0b c.o\0d.gcno\0',
+])
+def test_read_file_list(tmpdir, text):
+    filename = str(tmpdir.join('list'))
+    with open(filename, 'w') as stream:
+        stream.write(text)
+    assert read_file_list(filename) == ['a.gcda', 'b c.o', 'd.gcno']
@@ -16,6 +16,12 @@ try:
 except ImportError:
     pass
 
+# scandir is only available in 3.5 and later
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
 
 def resolve_symlinks(orig_path):
     """
@@ -130,38 +136,181 @@ aliases = PathAliaser()
 #
 #
 # NB:  Users have complained that this code causes a performance issue.
-# I have replaced this logic with os.walk(), which works for Python >= 2.6
+# I have replaced this logic with os.walk(), which works for Python >= 2.6,
+# and then with os.scandir(), which tells the directories and symbolic
+# links apart without a system call per file on most platforms.
 #
-def link_walker(path, exclude_dirs):
-    for root, dirs, files in os.walk(os.path.abspath(path), followlinks=True):
-        for exc in exclude_dirs:
-            for d in dirs:
-                m = exc.search(d)
-                if m is not None:
-                    dirs[:] = [d for d in dirs if d is not m.group()]
-        yield (os.path.abspath(os.path.realpath(root)), dirs, files)
+def link_walker(path, exclude_dirs, prefetcher=None):
+    """
+    Walk the directory tree below path top-down, following symbolic links,
+    and yield the (real path, directory entries, file entries) of every
+    directory.  Directories whose real path matches any of the exclude_dirs
+    filters are not entered, and every directory is only entered once,
+    even if symbolic links (or loops) lead to it several times.
+
+    With a prefetcher of read_directory, the next directories of the walk
+    are read in its threads, but they are still yielded in order.
+    """
+    exclude = combine_filters(exclude_dirs)
+    seen = set()
+    stack = []
+
+    def push(paths):
+        # Check every directory before it is read (or prefetched),
+        # so that aliases and loops are never listed
+        unseen = []
+        for real_path in paths:
+            try:
+                key = directory_key(real_path)
+            except OSError:
+                continue
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            unseen.append(real_path)
+        stack.extend(reversed(unseen))
+
+    push([os.path.realpath(path)])
+    while stack:
+        if prefetcher is not None:
+            for directory in stack[-2 * prefetcher.size():]:
+                prefetcher.prefetch(directory)
+        root = stack.pop()
+        try:
+            if prefetcher is not None:
+                dirs, files = prefetcher.get(root)
+            else:
+                dirs, files = read_directory(root)
+        except OSError:
+            continue
+
+        if exclude is not None:
+            dirs = [(entry, real_path) for entry, real_path in dirs
+                    if not exclude.match(real_path)]
+        yield (root, [entry for entry, _ in dirs], files)
+        push(real_path for _, real_path in dirs)
+
+
+def directory_key(path):
+    """
+    Return the (st_dev, st_ino) key of a directory, or None if it is unknown
+    """
+    stat = os.stat(path)
+    if stat.st_ino:  # unknown on Windows with Python 2
+        return (stat.st_dev, stat.st_ino)
+    return None
+
+
+def read_directory(root):
+    """
+    Read a directory, and return its (directory entry, real path)
+    subdirectories and its other entries.
+    """
+    dirs = []
+    files = []
+    for entry in scandir_entries(root):
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if not is_dir:
+            files.append(entry)
+        elif entry.is_symlink():
+            dirs.append((entry, os.path.realpath(entry.path)))
+        else:
+            dirs.append((entry, entry.path))
+    return dirs, files
+
+
+class ListdirEntry(object):
+    """The parts of os.DirEntry that link_walker needs, for Python < 3.5"""
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
 
+    def is_symlink(self):
+        return os.path.islink(self.path)
 
-def search_file(expr, path, exclude_dirs):
+
+def scandir_entries(path):
+    if scandir is not None:
+        return scandir(path)
+    return [ListdirEntry(path, name) for name in os.listdir(path)]
+
+
+def combine_filters(filters):
+    """
+    Combine filters into one regex that matches if any filter matches,
+    or return None if there are no filters
+    """
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    if any(f.groups for f in filters):
+        # Group references would change their meaning
+        return AnyFilter(filters)
+    return re.compile('|'.join('(?:{0})'.format(f.pattern) for f in filters))
+
+
+class AnyFilter(object):
+    """Match if any of several regexes matches."""
+
+    def __init__(self, filters):
+        self.filters = filters
+
+    def match(self, string):
+        for f in self.filters:
+            if f.match(string):
+                return True
+        return False
+
+
+def search_file(expr, path, exclude_dirs, prefetcher=None):
     """
     Given a search path, recursively descend to find files that match a
-    regular expression.
+    regular expression.  The files are yielded while they are found.
+    The directories can be read ahead by a prefetcher of read_directory.
     """
-    ans = []
     pattern = re.compile(expr)
     if path is None or path == ".":
         path = os.getcwd()
     elif not os.path.exists(path):
         raise IOError("Unknown directory '" + path + "'")
-    for root, dirs, files in link_walker(path, exclude_dirs):
-        for name in files:
-            if pattern.match(name):
-                name = os.path.join(root, name)
-                if os.path.islink(name):
-                    ans.append(os.path.abspath(os.readlink(name)))
+    return walk_matching_files(pattern, path, exclude_dirs, prefetcher)
+
+
+def walk_matching_files(pattern, path, exclude_dirs, prefetcher=None):
+    for root, dirs, files in link_walker(path, exclude_dirs, prefetcher):
+        for entry in files:
+            if pattern.match(entry.name):
+                if entry.is_symlink():
+                    yield os.path.abspath(os.readlink(entry.path))
                 else:
-                    ans.append(os.path.abspath(name))
-    return ans
+                    yield entry.path
+
+
+def read_file_list(filename):
+    """
+    Read the file names in a file, or in the standard input for '-'.
+    The names are separated by NUL characters, if there are any,
+    or else by newlines.  Empty names are skipped.
+    """
+    if filename == '-':
+        text = sys.stdin.read()
+    else:
+        with open(filename) as stream:
+            text = stream.read()
+    if '\0' in text:
+        names = text.split('\0')
+    else:
+        names = text.splitlines()
+    return [name for name in names if name]
 
 
 def commonpath(files):
@@ -197,16 +346,13 @@ def get_global_stats(covdata):
     branches_total = 0
     branches_covered = 0
 
-    keys = list(covdata.keys())
-
-    for key in keys:
-        (t, n, txt) = covdata[key].coverage(show_branch=False)
-        lines_total += t
-        lines_covered += n
-
-        (t, n, txt) = covdata[key].coverage(show_branch=True)
-        branches_total += t
-        branches_covered += n
+    # The statistics of every file are only computed once
+    for cov in covdata.values():
+        (l_total, l_covered, b_total, b_covered) = cov.stats()
+        lines_total += l_total
+        lines_covered += l_covered
+        branches_total += b_total
+        branches_covered += b_covered
 
     percent = calculate_coverage(lines_covered, lines_total)
     percent_branches = calculate_coverage(branches_covered, branches_total)
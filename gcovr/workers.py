@@ -6,7 +6,11 @@
 # This software is distributed under the BSD license.
 
 
-from threading import Thread, Condition, RLock
+import copy
+import heapq
+import multiprocessing
+import os
+from threading import Thread, Condition, Event, Lock, RLock
 from contextlib import contextmanager
 
 import sys
@@ -45,10 +49,14 @@ class LockedDirectories(object):
 
 
 @contextmanager
-def locked_directory(dir_):
+def locked_directory(dir_, lock=True):
     """
     Context for doing something in a locked directory
+    (or in any directory if lock is False)
     """
+    if not lock:
+        yield
+        return
     locked_directory.global_object.run_in(dir_)
     yield
     locked_directory.global_object.done(dir_)
@@ -57,6 +65,223 @@ def locked_directory(dir_):
 locked_directory.global_object = LockedDirectories()
 
 
+class WorkingDirectoryCache(object):
+    """
+    Class that remembers the working directory that last worked
+    for the files of a directory, shared by all threads
+    """
+    # Stands for the working directory of the thread that looks it up,
+    # as each thread has its own
+    WORKDIR = object()
+
+    def __init__(self):
+        self.dirs = dict()
+        self.lock = Lock()
+
+    def lookup(self, key, workdir):
+        """
+        Get the working directory that worked for the directory key,
+        or else for its closest parent directory (or None)
+        """
+        with self.lock:
+            dir_ = None
+            while dir_ is None:
+                dir_ = self.dirs.get(key)
+                parent = os.path.dirname(key)
+                if parent == key:
+                    break
+                key = parent
+        if dir_ is WorkingDirectoryCache.WORKDIR:
+            return workdir
+        return dir_
+
+    def store(self, key, dir_, workdir):
+        """
+        Remember the working directory that worked for the key
+        """
+        if dir_ == workdir:
+            dir_ = WorkingDirectoryCache.WORKDIR
+        with self.lock:
+            self.dirs[key] = dir_
+
+    def __getstate__(self):
+        # Every worker process gets a copy without the lock,
+        # and without the thread working directories
+        with self.lock:
+            return dict(
+                (key, dir_) for key, dir_ in self.dirs.items()
+                if dir_ is not WorkingDirectoryCache.WORKDIR)
+
+    def __setstate__(self, dirs):
+        self.dirs = dirs
+        self.lock = Lock()
+
+
+class Scheduler(object):
+    """
+    Class that orders work items by their estimated cost:
+    the directory with the most expensive work goes first,
+    and the work of one directory is kept together,
+    most expensive first
+    """
+    def __init__(self, cost):
+        self.cost = cost
+        self.directories = dict()
+        self.totals = dict()
+        self.heap = []
+        self.current = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def put(self, item, dir_):
+        """
+        Add a work item of a directory
+        """
+        self.count += 1
+        cost = self.cost(item)
+        heapq.heappush(
+            self.directories.setdefault(dir_, []), (-cost, self.count, item))
+        self.totals[dir_] = self.totals.get(dir_, 0) + cost
+        if dir_ != self.current:
+            heapq.heappush(self.heap, (-self.totals[dir_], self.count, dir_))
+
+    def get(self):
+        """
+        Take the next work item
+        """
+        while not self.directories.get(self.current):
+            # Entries with an outdated total are skipped
+            total, _, dir_ = heapq.heappop(self.heap)
+            if self.directories.get(dir_) and -total == self.totals[dir_]:
+                self.current = dir_
+        cost, _, item = heapq.heappop(self.directories[self.current])
+        self.totals[self.current] += cost
+        self.count -= 1
+        return item
+
+    def schedule(self, items, directory, ready):
+        """
+        Yield the items in the order of their cost, starting as
+        soon as ready() is True, e.g. when the workers are idle
+        """
+        for item in items:
+            self.put(item, directory(item))
+            while self and ready():
+                yield self.get()
+        while self:
+            yield self.get()
+
+
+class PrefetchedCall(object):
+    """
+    Class that holds a call of a function and its result,
+    which is computed by the first thread that needs it
+    """
+    def __init__(self, function, key):
+        self.function = function
+        self.key = key
+        self.lock = Lock()
+        self.started = False
+        self.done = Event()
+        self.value = None
+        self.exception = None
+
+    def run(self):
+        """
+        Make the call, unless another thread has started it
+        """
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        try:
+            self.value = self.function(self.key)
+        except Exception as exception:
+            self.exception = exception
+        self.done.set()
+
+    def cancel(self):
+        """
+        Skip the call, unless a thread has started it
+        """
+        with self.lock:
+            self.started = True
+
+    def result(self):
+        """
+        Get the result, making the call here if no thread has started it
+        """
+        self.run()
+        while not self.done.is_set():
+            # Allow interrupts in Event.wait
+            self.done.wait(1)
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class Prefetcher(object):
+    """
+    Class that makes calls of function(key) in a number of
+    threads, ahead of when their results are needed.
+    The calls are prefetched and taken by a single thread.
+    """
+    def __init__(self, function, number):
+        assert number >= 1
+        self.function = function
+        self.pending = dict()
+        self.q = Queue()
+        self.threads = [
+            Thread(target=self.run) for _ in range(0, number)]
+        for t in self.threads:
+            # Prefetched calls that are never needed must not block the exit
+            t.daemon = True
+            t.start()
+
+    def size(self):
+        """
+        The number of threads
+        """
+        return len(self.threads)
+
+    def prefetch(self, key):
+        """
+        Start the call for the key in a thread, if it is not pending
+        """
+        if key not in self.pending:
+            call = PrefetchedCall(self.function, key)
+            self.pending[key] = call
+            self.q.put(call)
+
+    def get(self, key):
+        """
+        Get the result for the key, from a prefetched call if any
+        """
+        call = self.pending.pop(key, None)
+        if call is None:
+            return self.function(key)
+        return call.result()
+
+    def run(self):
+        while True:
+            call = self.q.get(True)
+            if call is None:
+                break
+            call.run()
+
+    def close(self):
+        """
+        Let the threads stop once they are done with the pending calls
+        """
+        for call in self.pending.values():
+            call.cancel()
+        self.pending.clear()
+        for _ in self.threads:
+            self.q.put(None)
+
+
 def worker(queue, context, pool):
     """
     Run work items from the queue until the sentinal
@@ -66,30 +291,135 @@ def worker(queue, context, pool):
         work, args, kwargs = queue.get(True)
         if not work:
             break
+        results = pool.new_results()
         kwargs.update(context)
+        kwargs.update(results)
         try:
             work(*args, **kwargs)
+            if results:
+                pool.merge_results(results)
         except:  # noqa: E722
             import sys
             pool.raise_exception(sys.exc_info())
             break
 
 
+def process_worker(queue, replies, failed, index, context, results,
+                   reduce, batch):
+    """
+    Run work items from the queue in a separate process
+    until the sentinal None value is hit, then send the
+    context back.  The results of every work item are sent
+    back as soon as it is done, or if reduce is given,
+    the results of batch work items are reduced into one
+    and sent back together.
+    """
+    exception = None
+    pending = None
+    count = 0
+    while True:
+        work, args, kwargs = queue.get(True)
+        if not work:
+            break
+        if failed.is_set():
+            # Skip the remaining work, like a drained queue
+            continue
+        work_results = copy.deepcopy(results)
+        kwargs.update(context)
+        kwargs.update(work_results)
+        try:
+            work(*args, **kwargs)
+            if work_results and reduce is None:
+                replies.put(('results', work_results))
+            elif work_results:
+                if pending is None:
+                    pending = work_results
+                else:
+                    reduce(pending, work_results)
+                count += 1
+                if count >= batch:
+                    replies.put(('results', pending))
+                    pending = None
+                    count = 0
+        except:  # noqa: E722
+            import pickle
+            import traceback
+            failed.set()
+            exc_type, exc_obj, exc_trace = sys.exc_info()
+            try:
+                pickle.dumps(exc_obj)
+            except Exception:
+                exc_obj = RuntimeError(repr(exc_obj))
+            exception = (exc_type.__name__, exc_obj, ''.join(
+                traceback.format_exception(exc_type, exc_obj, exc_trace)))
+    if pending is not None:
+        replies.put(('results', pending))
+    replies.put(('done', index, context, exception))
+
+
 class Workers(object):
     """
-    Create a thread-pool which can be given work via an
-    add method and will run until work is complete
+    Create a thread-pool (or a process-pool) which can be given
+    work via an add method and will run until work is complete
+
+    Each work item gets the items of its worker's context as
+    keyword arguments.  If results is given, each work item also
+    gets a fresh copy of its items (e.g. empty containers to fill),
+    and merge is called with them as soon as the item is done,
+    one call at a time, in the process that created the pool.
+
+    With processes, reduce(target, source) can be given to add the
+    results of one work item to another's, e.g. the same function
+    that merge calls.  Every worker process then reduces the results
+    of up to batch work items before it sends them back, so that the
+    process that created the pool receives and merges fewer results.
+    reduce must be picklable.
     """
 
-    def __init__(self, number, context):
+    def __init__(self, number, context, processes=False,
+                 results=None, merge=None, reduce=None, batch=16):
         assert(number >= 1)
-        self.q = Queue()
         self.lock = RLock()
+        self.merge_lock = Lock()
         self.exceptions = []
         self.contexts = [context() for _ in range(0, number)]
-        self.workers = [Thread(target=worker, args=(self.q, c, self)) for c in self.contexts]
+        self.results = results or dict()
+        self.merge = merge
+        self.processes = processes
+        self.collected = False
+        if processes:
+            # The work, its arguments and the contexts must be picklable
+            self.q = multiprocessing.Queue()
+            self.replies = multiprocessing.Queue()
+            self.failed = multiprocessing.Event()
+            self.workers = [
+                multiprocessing.Process(
+                    target=process_worker,
+                    args=(self.q, self.replies, self.failed, i, c,
+                          self.results, reduce, batch))
+                for i, c in enumerate(self.contexts)]
+            # Receive the results while the processes are working
+            self.collector = Thread(target=self.collect_replies)
+        else:
+            self.q = Queue()
+            self.workers = [Thread(target=worker, args=(self.q, c, self)) for c in self.contexts]
         for w in self.workers:
             w.start()
+        if processes:
+            self.collector.start()
+
+    def new_results(self):
+        """
+        Get the results for a new work item
+        """
+        return copy.deepcopy(self.results)
+
+    def merge_results(self, results):
+        """
+        Merge the results of a work item
+        """
+        with self.merge_lock:
+            self.merge(results)
 
     def add(self, work, *args, **kwargs):
         """
@@ -114,6 +444,8 @@ class Workers(object):
         Drain the queue
         """
         with self.lock:
+            if self.processes:
+                self.failed.set()
             while True:
                 try:
                     work, args, kwargs = self.q.get(False)
@@ -129,24 +461,73 @@ class Workers(object):
             self.drain()
             self.exceptions.append(exc_info)
 
+    def queue_empty(self):
+        """
+        Check whether the workers have taken all work added so far
+        """
+        return self.q.empty()
+
     def size(self):
         """
         Run the size of the thread pool
         """
         return len(self.workers)
 
+    def collect_replies(self):
+        """
+        Receive the results, contexts and exceptions
+        of the worker processes
+        """
+        running = len(self.workers)
+        while running:
+            try:
+                reply = self.replies.get(timeout=1)
+            except Empty:
+                if not any(w.is_alive() for w in self.workers):
+                    self.exceptions.append((
+                        RuntimeError, RuntimeError("A worker process died."),
+                        "A worker process died.\n"))
+                    return
+                continue
+            if reply[0] == 'results':
+                try:
+                    self.merge_results(reply[1])
+                except:  # noqa: E722
+                    import traceback
+                    exc_type, exc_obj, exc_trace = sys.exc_info()
+                    self.failed.set()
+                    self.exceptions.append((exc_type, exc_obj, ''.join(
+                        traceback.format_exception(
+                            exc_type, exc_obj, exc_trace))))
+            else:
+                index, context, exception = reply[1:]
+                self.contexts[index] = context
+                if exception is not None:
+                    self.exceptions.append(exception)
+                running -= 1
+
     def wait(self):
         """
         Wait until all work is complete
         """
+        if self.collected:
+            return self.contexts
         self.add_sentinels()
+        if self.processes:
+            # Results must be received before the processes can exit
+            while self.collector.is_alive():
+                self.collector.join(timeout=1)
+            self.collected = True
         for w in self.workers:
             # Allow interrupts in Thread.join
             while w.is_alive():
                 w.join(timeout=1)
         for exc_type, exc_obj, exc_trace in self.exceptions:
-            import traceback
-            traceback.print_exception(exc_type, exc_obj, exc_trace)
+            if self.processes:
+                sys.stderr.write(exc_trace)
+            else:
+                import traceback
+                traceback.print_exception(exc_type, exc_obj, exc_trace)
         if self.exceptions:
             raise self.exceptions[0][1]
         return self.contexts